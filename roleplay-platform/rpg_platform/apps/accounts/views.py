@@ -591,10 +591,8 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         context['characters'] = Character.objects.filter(user=user)[:5]
 
         # Active chats
-        from rpg_platform.apps.messages.models import ChatRoom
-        context['chatrooms'] = ChatRoom.objects.filter(
-            participants=user
-        ).order_by('-last_message_time')[:5]
+        from rpg_platform.apps.messages.summaries import inbox_rooms
+        context['chat_rooms'] = inbox_rooms(user).prefetch_related('participants')[:5]
 
         return context
 
@@ -9,6 +9,7 @@ from rpg_platform.apps.characters.models import (
     Character,
     CharacterInfo,
     CharacterKink,
+    KinkFacet,
     CustomKink,
     CharacterImage,
     CharacterRating,
@@ -123,6 +124,15 @@ class CharacterKinkAdmin(admin.ModelAdmin):
     search_fields = ('character__name', 'kink__name')
 
 
+@admin.register(KinkFacet)
+class KinkFacetAdmin(admin.ModelAdmin):
+    list_display = ('kink', 'rating', 'character_count', 'updated_at')
+    list_filter = ('rating',)
+    search_fields = ('kink__name',)
+    exclude = ('bitmap',)
+    readonly_fields = ('kink', 'rating', 'character_count', 'updated_at')
+
+
 @admin.register(CustomKink)
 class CustomKinkAdmin(admin.ModelAdmin):
     list_display = ('character', 'name', 'category', 'rating')
@@ -0,0 +1,137 @@
+"""
+Denormalized rating and comment aggregates on Character.
+
+Signal handlers apply each rating or comment change as a relative UPDATE on
+the character row, inside the same transaction as the change itself, so
+pages and queries can read the columns instead of aggregating ratings.
+``repair_character_aggregates`` recalculates them from scratch.
+"""
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Greatest
+
+from .models import Character, CharacterComment, CharacterRating
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+HISTOGRAM_FIELDS = tuple(f"rating_{value}_count" for value in RATING_VALUES)
+
+# Recomputes the average from the stored sum and count
+AVERAGE_RATING = Case(
+    When(rating_count=0, then=Value(0.0)),
+    default=Cast(F("rating_sum"), FloatField()) / F("rating_count"),
+    output_field=FloatField(),
+)
+
+
+def _decrement(field, amount=1):
+    # Never let drifted aggregates fail a user's change; repair fixes drift
+    return Greatest(F(field) - amount, Value(0))
+
+
+def apply_rating_change(character_id, old_rating, new_rating):
+    """
+    Apply a single rating change to the character's aggregates.
+
+    ``old_rating`` is ``None`` for a new rating and ``new_rating`` is ``None``
+    for a deleted one.
+    """
+    if old_rating == new_rating:
+        return
+
+    updates = {}
+
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    if count_delta > 0:
+        updates["rating_count"] = F("rating_count") + 1
+    elif count_delta < 0:
+        updates["rating_count"] = _decrement("rating_count")
+
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    if sum_delta > 0:
+        updates["rating_sum"] = F("rating_sum") + sum_delta
+    elif sum_delta < 0:
+        updates["rating_sum"] = _decrement("rating_sum", -sum_delta)
+
+    if old_rating in RATING_VALUES:
+        updates[f"rating_{old_rating}_count"] = _decrement(f"rating_{old_rating}_count")
+    if new_rating in RATING_VALUES:
+        updates[f"rating_{new_rating}_count"] = F(f"rating_{new_rating}_count") + 1
+
+    characters = Character.objects.filter(pk=character_id)
+    characters.update(**updates)
+
+    # The average must be computed from the updated sum and count
+    characters.update(average_rating=AVERAGE_RATING)
+
+
+def apply_comment_change(character_id, delta):
+    """Adjust the character's comment count by ``delta``"""
+    if delta > 0:
+        count = F("comment_count") + delta
+    else:
+        count = _decrement("comment_count", -delta)
+
+    Character.objects.filter(pk=character_id).update(comment_count=count)
+
+
+def compute_character_aggregates(character_ids=None):
+    """
+    Calculate aggregates from the ratings and comments tables.
+
+    Returns a dict mapping character id to a dict of aggregate field values,
+    for characters that have at least one rating or comment.
+    """
+    ratings = CharacterRating.objects.all()
+    comments = CharacterComment.objects.all()
+    if character_ids is not None:
+        ratings = ratings.filter(character_id__in=character_ids)
+        comments = comments.filter(character_id__in=character_ids)
+
+    histogram = {
+        field: Count("id", filter=Q(rating=value))
+        for field, value in zip(HISTOGRAM_FIELDS, RATING_VALUES)
+    }
+
+    aggregates = {}
+    for row in ratings.values("character_id").annotate(
+        rating_sum=Sum("rating"), rating_count=Count("id"), **histogram
+    ):
+        character_id = row.pop("character_id")
+        row["average_rating"] = row["rating_sum"] / row["rating_count"]
+        aggregates[character_id] = row
+
+    for character_id, comment_count in comments.values("character_id").annotate(
+        count=Count("id")
+    ).values_list("character_id", "count"):
+        aggregates.setdefault(character_id, {})["comment_count"] = comment_count
+
+    return aggregates
+
+
+def repair_character_aggregates(character_ids=None, batch_size=1000):
+    """
+    Recalculate stored aggregates and fix the characters that drifted.
+
+    Returns the number of characters updated.
+    """
+    computed = compute_character_aggregates(character_ids)
+    empty = {field: 0 for field in Character.AGGREGATE_FIELDS}
+
+    characters = Character.objects.only("pk", *Character.AGGREGATE_FIELDS)
+    if character_ids is not None:
+        characters = characters.filter(pk__in=character_ids)
+
+    drifted = []
+    for character in characters.iterator(chunk_size=batch_size):
+        expected = {**empty, **computed.get(character.pk, {})}
+        changed = False
+        for field, value in expected.items():
+            if getattr(character, field) != value:
+                setattr(character, field, value)
+                changed = True
+        if changed:
+            drifted.append(character)
+
+    Character.objects.bulk_update(drifted, Character.AGGREGATE_FIELDS, batch_size=batch_size)
+
+    return len(drifted)
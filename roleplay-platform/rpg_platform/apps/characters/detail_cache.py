@@ -0,0 +1,99 @@
+"""
+Cached fragments of the character detail page.
+
+The parts of a profile that are the same for every visitor (gallery, kinks
+grouped by category, visible comments) are built once per character version
+and kept in two tiers: a small LRU in each process in front of the shared
+Django cache. The version of a character is bumped by the signal handlers in
+``characters.signals`` whenever the character or one of its related rows
+changes, so a popular profile renders its static parts without queries.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext as _
+
+from rpg_platform.utils.cache import LocalLRUCache, bump_version, get_version
+
+from .models import CharacterComment, CharacterImage, CharacterKink, CustomKink
+
+# Seconds a fragment is kept in the shared cache
+DEFAULT_TIMEOUT = 60 * 60
+
+# Fragments kept in each process
+DEFAULT_LOCAL_SIZE = 256
+
+_local = LocalLRUCache(getattr(settings, 'CHARACTER_DETAIL_CACHE_LOCAL_SIZE', DEFAULT_LOCAL_SIZE))
+
+
+def version_key(character_id):
+    return f"characters:detail_version:{character_id}"
+
+
+def fragment_key(character_id, version):
+    return f"characters:detail:{character_id}:{version}"
+
+
+def invalidate_character_detail(character_id):
+    """Make every process rebuild the detail fragment of a character"""
+    bump_version(version_key(character_id))
+
+
+def build_character_detail(character):
+    """Load the visitor independent parts of a character profile"""
+    images = list(
+        CharacterImage.objects.filter(character=character).order_by('-is_primary', 'order')
+    )
+
+    # Organize kinks by category
+    kinks_by_category = {}
+
+    # Add standard kinks
+    character_kinks = CharacterKink.objects.filter(character=character).select_related('kink__category')
+    for character_kink in character_kinks:
+        kinks_by_category.setdefault(character_kink.kink.category.name, []).append({
+            'name': character_kink.kink.name,
+            'rating': character_kink.rating,
+            'description': character_kink.kink.description
+        })
+
+    # Add custom kinks
+    for custom_kink in CustomKink.objects.filter(character=character):
+        kinks_by_category.setdefault(custom_kink.category or _('Other'), []).append({
+            'name': custom_kink.name,
+            'rating': custom_kink.rating,
+            'description': custom_kink.description,
+            'is_custom': True
+        })
+
+    comments = list(
+        CharacterComment.objects.filter(character=character, is_hidden=False)
+        .select_related('author', 'author__profile')
+    )
+
+    return {
+        'images': images,
+        'kinks_by_category': kinks_by_category,
+        'comments': comments,
+    }
+
+
+def get_character_detail(character):
+    """
+    Return the cached detail fragment of a character, building it if needed.
+
+    Looks in the process-local LRU first, then in the shared cache.
+    """
+    version = get_version(version_key(character.pk))
+    key = fragment_key(character.pk, version)
+
+    detail = _local.get(key)
+    if detail is not None:
+        return detail
+
+    detail = cache.get(key)
+    if detail is None:
+        detail = build_character_detail(character)
+        cache.set(key, detail, getattr(settings, 'CHARACTER_DETAIL_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+    _local.set(key, detail)
+    return detail
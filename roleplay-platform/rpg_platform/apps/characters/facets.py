@@ -0,0 +1,327 @@
+"""
+Kink facet index for character search.
+
+For every kink and rating a ``KinkFacet`` row stores a bitmap of character
+ids, so kink filters (any of / all of / none of) and per-kink result counts
+are evaluated with integer bit operations in memory instead of one join per
+selected kink. Bitmaps are Python ints with bit ``n`` standing for character
+``n``.
+
+Each process keeps the facets in memory and reloads them when their version
+moves; versions are stored in the database, see ``utils.cache``, so every
+process sees a change within ``CACHE_VERSION_CHECK_INTERVAL`` seconds.
+``update_character_facets`` applies changed kinks of one character and is
+called by the ``CharacterKink`` signal handlers in ``characters.signals``;
+``rebuild_kink_facets`` recomputes everything.
+"""
+import json
+import logging
+import random
+import threading
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import BinaryField, Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from rpg_platform.utils.cache import bump_version, get_version
+
+from .models import CharacterKink, KinkFacet
+
+FACET_VERSION_KEY = "characters:kink_facet_version"
+
+RATINGS = tuple(value for value, _ in CharacterKink.RATING_CHOICES)
+
+# Ids per ``IN`` list on databases that can't bind them as a single parameter
+ID_CHUNK_SIZE = 500
+
+# Facets written per conditional UPDATE
+WRITE_BATCH_SIZE = 500
+
+# Facet writes lost to concurrent ones before a kink change is given up
+MAX_FACET_UPDATE_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_facets = None
+
+
+def bitmap_from_ids(ids):
+    """Build a bitmap with the bits of ``ids`` set"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for value in ids:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def ids_from_bitmap(bitmap):
+    """List the ids whose bits are set, in ascending order"""
+    ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            ids.append(index * 8 + low.bit_length() - 1)
+            byte ^= low
+    return ids
+
+
+def ids_filter(bitmap, field="id", using="default"):
+    """
+    Filter matching ``field`` against the ids in a bitmap.
+
+    SQLite and PostgreSQL get the ids as a single parameter, a JSON list or
+    an integer array, so large bitmaps don't run into the limit on SQL
+    variables; other databases get ``IN`` lists of ``ID_CHUNK_SIZE`` ids.
+    """
+    ids = ids_from_bitmap(bitmap)
+    vendor = connections[using].vendor
+
+    if vendor == "sqlite":
+        return Q(**{f"{field}__in": RawSQL("SELECT value FROM json_each(%s)", [json.dumps(ids)])})
+    if vendor == "postgresql":
+        return Q(**{f"{field}__in": RawSQL("SELECT unnest(%s::integer[])", [ids])})
+
+    condition = Q(**{f"{field}__in": ids[:ID_CHUNK_SIZE]})
+    for start in range(ID_CHUNK_SIZE, len(ids), ID_CHUNK_SIZE):
+        condition |= Q(**{f"{field}__in": ids[start:start + ID_CHUNK_SIZE]})
+    return condition
+
+
+def popcount(bitmap):
+    return bin(bitmap).count("1")
+
+
+def to_bytes(bitmap):
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+
+class FacetIndex:
+    """
+    In-memory bitmaps per ``(kink_id, rating)``
+    """
+
+    def __init__(self, bitmaps, version):
+        self.bitmaps = bitmaps
+        self.version = version
+
+        # Characters having the kink with any rating
+        self.any_rating = defaultdict(int)
+        for (kink_id, _), bitmap in bitmaps.items():
+            self.any_rating[kink_id] |= bitmap
+
+    def kink_bitmap(self, kink_id, rating=None):
+        if rating:
+            return self.bitmaps.get((kink_id, rating), 0)
+        return self.any_rating.get(kink_id, 0)
+
+    def match(self, within, any_of=(), all_of=(), none_of=(), rating=None):
+        """
+        Restrict the ``within`` bitmap to characters matching kink filters.
+
+        ``any_of`` kinks are OR-ed, ``all_of`` kinks AND-ed and ``none_of``
+        kinks excluded whatever their rating.
+        """
+        result = within
+
+        if any_of:
+            matches = 0
+            for kink_id in any_of:
+                matches |= self.kink_bitmap(kink_id, rating)
+            result &= matches
+
+        for kink_id in all_of:
+            result &= self.kink_bitmap(kink_id, rating)
+
+        for kink_id in none_of:
+            result &= ~self.kink_bitmap(kink_id)
+
+        return result
+
+    def select(self, any_of=(), all_of=(), none_of=(), rating=None):
+        """
+        Return the bitmap of all characters matching kink filters.
+
+        Needs ``any_of`` or ``all_of`` kinks; excluded kinks alone match
+        characters the facets know nothing about.
+        """
+        if any_of:
+            within = 0
+            for kink_id in any_of:
+                within |= self.kink_bitmap(kink_id, rating)
+        elif all_of:
+            within = self.kink_bitmap(all_of[0], rating)
+        else:
+            raise ValueError("Kink facets need kinks to select, not only kinks to exclude")
+
+        return self.match(within, all_of=all_of, none_of=none_of, rating=rating)
+
+    def counts(self, within, kink_ids=None, rating=None):
+        """Number of characters in the ``within`` bitmap having each kink"""
+        kink_ids = self.any_rating.keys() if kink_ids is None else kink_ids
+        return {
+            kink_id: popcount(within & self.kink_bitmap(kink_id, rating))
+            for kink_id in kink_ids
+        }
+
+
+def load_facet_index(version=None):
+    bitmaps = {
+        (kink_id, rating): int.from_bytes(bytes(bitmap), "little")
+        for kink_id, rating, bitmap in KinkFacet.objects.values_list("kink_id", "rating", "bitmap")
+    }
+    return FacetIndex(bitmaps, version)
+
+
+def get_facet_index():
+    """Return the process-local facet index, reloading it after changes"""
+    global _facets
+
+    version = get_version(FACET_VERSION_KEY)
+    facets = _facets
+
+    if facets is None or facets.version != version:
+        with _lock:
+            if _facets is facets:
+                _facets = load_facet_index(version)
+            facets = _facets
+
+    return facets
+
+
+def invalidate_facet_index():
+    """Make every process reload the facets"""
+    bump_version(FACET_VERSION_KEY)
+
+
+def update_character_facets(character_id, ratings):
+    """
+    Apply changed kinks of one character to the stored bitmaps.
+
+    ``ratings`` maps kink ids to their new rating, or to ``None`` for kinks
+    the character no longer has. The character is removed from the other
+    ratings of those kinks, so the previous ratings need not be known.
+    Must run inside the transaction making the change.
+
+    Bitmaps are shared by every character, so each facet is only written if
+    its ``revision`` is still the one read; the kinks of facets changed
+    concurrently are read and applied again.
+    """
+    pending = dict(ratings)
+
+    with transaction.atomic(savepoint=False):
+        for _ in range(MAX_FACET_UPDATE_ATTEMPTS):
+            if not pending:
+                return
+            pending = _write_character_facets(character_id, pending)
+
+    if pending:
+        logger.error(
+            f"Kink facets of character {character_id} lost {MAX_FACET_UPDATE_ATTEMPTS} concurrent updates "
+            f"for kinks {sorted(pending)}; run rebuild_kink_facets"
+        )
+
+
+def _write_character_facets(character_id, ratings):
+    """Write the facets of changed kinks once, returning those lost to concurrent writes"""
+    bit = 1 << character_id
+    existing = {
+        (facet.kink_id, facet.rating): facet
+        for facet in KinkFacet.objects.filter(kink_id__in=ratings).only("id", "kink_id", "rating", "bitmap", "revision")
+    }
+
+    changed, created = [], []
+    for kink_id, new_rating in ratings.items():
+        for rating in RATINGS:
+            facet = existing.get((kink_id, rating))
+            if facet is None:
+                if rating != new_rating:
+                    continue
+                facet = KinkFacet(kink_id=kink_id, rating=rating)
+                created.append(facet)
+                bitmap = 0
+            else:
+                bitmap = int.from_bytes(bytes(facet.bitmap), "little")
+
+            updated = bitmap | bit if rating == new_rating else bitmap & ~bit
+            if facet.pk is not None and updated == bitmap:
+                continue
+            if facet.pk is not None:
+                changed.append(facet)
+
+            facet.bitmap = to_bytes(updated)
+            facet.character_count = popcount(updated)
+
+    if not changed and not created:
+        return {}
+
+    # Marks the rows written by this attempt
+    revision = random.getrandbits(62) + 1
+    now = timezone.now()
+    lost = set()
+
+    for start in range(0, len(changed), WRITE_BATCH_SIZE):
+        batch = changed[start:start + WRITE_BATCH_SIZE]
+        read = Q()
+        for facet in batch:
+            read |= Q(pk=facet.pk, revision=facet.revision)
+
+        written = KinkFacet.objects.filter(read).update(
+            bitmap=Case(
+                *[When(pk=facet.pk, then=Value(facet.bitmap, output_field=BinaryField())) for facet in batch],
+                output_field=BinaryField()
+            ),
+            character_count=Case(
+                *[When(pk=facet.pk, then=Value(facet.character_count)) for facet in batch],
+                output_field=IntegerField()
+            ),
+            revision=revision,
+            updated_at=now
+        )
+        if written < len(batch):
+            revisions = dict(KinkFacet.objects.filter(pk__in=[facet.pk for facet in batch]).values_list("pk", "revision"))
+            lost.update(facet.kink_id for facet in batch if revisions.get(facet.pk) != revision)
+
+    if created:
+        for facet in created:
+            facet.revision = revision
+        try:
+            with transaction.atomic():
+                KinkFacet.objects.bulk_create(created)
+        except IntegrityError:
+            # Created concurrently for a kink and rating
+            lost.update(facet.kink_id for facet in created)
+
+    if len(lost) < len({facet.kink_id for facet in changed + created}):
+        transaction.on_commit(invalidate_facet_index)
+
+    return {kink_id: ratings[kink_id] for kink_id in lost}
+
+
+def rebuild_kink_facets():
+    """Recompute every facet bitmap from the character kinks"""
+    ids = defaultdict(list)
+    for kink_id, rating, character_id in CharacterKink.objects.values_list(
+        "kink_id", "rating", "character_id"
+    ).iterator(chunk_size=10000):
+        ids[(kink_id, rating)].append(character_id)
+
+    facets = []
+    for (kink_id, rating), character_ids in ids.items():
+        bitmap = bitmap_from_ids(character_ids)
+        facets.append(KinkFacet(
+            kink_id=kink_id, rating=rating,
+            bitmap=to_bytes(bitmap), character_count=popcount(bitmap)
+        ))
+
+    with transaction.atomic():
+        KinkFacet.objects.all().delete()
+        KinkFacet.objects.bulk_create(facets, batch_size=500)
+        transaction.on_commit(invalidate_facet_index)
+
+    return len(facets)
@@ -411,8 +411,25 @@ class CharacterSearchForm(forms.Form):
         widget=forms.Select(attrs={"class": "form-select"}),
     )
 
+    kink_mode = forms.ChoiceField(
+        choices=[
+            ("any", _("Any selected kink")),
+            ("all", _("All selected kinks")),
+        ],
+        required=False,
+        initial="any",
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+
+    exclude_kinks = forms.ModelMultipleChoiceField(
+        queryset=Kink.objects.all().order_by("category__name", "name"),
+        required=False,
+        widget=forms.SelectMultiple(attrs={"class": "form-select"}),
+    )
+
     sort_by = forms.ChoiceField(
         choices=[
+            ("relevance", _("Relevance")),
             ("name", _("Name (A-Z)")),
             ("-name", _("Name (Z-A)")),
             ("created_at", _("Oldest First")),
@@ -420,6 +437,8 @@ class CharacterSearchForm(forms.Form):
             ("gender", _("Gender")),
             ("species", _("Species")),
             ("age", _("Age")),
+            ("-average_rating", _("Highest Rated")),
+            ("-rating_count", _("Most Rated")),
         ],
         required=False,
         initial="name",
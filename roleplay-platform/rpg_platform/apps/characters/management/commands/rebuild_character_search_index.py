@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.characters.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for characters'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rebuild_search_index()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt character search index in {elapsed:.2f}s"))
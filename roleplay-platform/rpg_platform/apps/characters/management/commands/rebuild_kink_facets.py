@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.characters.facets import rebuild_kink_facets
+
+
+class Command(BaseCommand):
+    help = 'Recompute the kink facet bitmaps used by the character search'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        facet_count = rebuild_kink_facets()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {facet_count} kink facets in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.characters.aggregates import repair_character_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the rating and comment aggregates stored on characters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'character_ids', nargs='*', type=int,
+            help='Only repair these characters (default: all characters)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of characters loaded and updated at a time'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        repaired = repair_character_aggregates(
+            options['character_ids'] or None,
+            batch_size=options['batch_size']
+        )
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Repaired aggregates on {repaired} characters in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:49
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_aggregates(apps, schema_editor):
+    Character = apps.get_model('characters', 'Character')
+    CharacterRating = apps.get_model('characters', 'CharacterRating')
+    CharacterComment = apps.get_model('characters', 'CharacterComment')
+
+    histogram = {
+        f'rating_{value}_count': Count('id', filter=Q(rating=value))
+        for value in range(1, 6)
+    }
+
+    for row in CharacterRating.objects.values('character_id').annotate(
+        rating_sum=Sum('rating'), rating_count=Count('id'), **histogram
+    ):
+        character_id = row.pop('character_id')
+        row['average_rating'] = row['rating_sum'] / row['rating_count']
+        Character.objects.filter(pk=character_id).update(**row)
+
+    for row in CharacterComment.objects.values('character_id').annotate(count=Count('id')):
+        Character.objects.filter(pk=row['character_id']).update(comment_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('characters', '0004_character_content_preferences_character_views_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='average_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
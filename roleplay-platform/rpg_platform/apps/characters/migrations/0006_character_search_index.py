@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:20
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from rpg_platform.apps.characters.search import get_search_backend
+
+    backend = get_search_backend(schema_editor.connection)
+    backend.create_index()
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from rpg_platform.apps.characters.search import get_search_backend
+
+    get_search_backend(schema_editor.connection).drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('characters', '0005_character_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_kink_facets(apps, schema_editor):
+    from collections import defaultdict
+
+    from rpg_platform.apps.characters.facets import bitmap_from_ids, popcount, to_bytes
+
+    CharacterKink = apps.get_model('characters', 'CharacterKink')
+    KinkFacet = apps.get_model('characters', 'KinkFacet')
+
+    ids = defaultdict(list)
+    for kink_id, rating, character_id in CharacterKink.objects.values_list(
+        'kink_id', 'rating', 'character_id'
+    ).iterator():
+        ids[(kink_id, rating)].append(character_id)
+
+    facets = []
+    for (kink_id, rating), character_ids in ids.items():
+        bitmap = bitmap_from_ids(character_ids)
+        facets.append(KinkFacet(
+            kink_id=kink_id, rating=rating,
+            bitmap=to_bytes(bitmap), character_count=popcount(bitmap)
+        ))
+    KinkFacet.objects.bulk_create(facets, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('characters', '0006_character_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KinkFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.CharField(choices=[('fave', 'Favorite'), ('yes', 'Yes'), ('maybe', 'Maybe'), ('no', 'No')], max_length=10, verbose_name='Rating')),
+                ('bitmap', models.BinaryField(default=b'', verbose_name='Character Bitmap')),
+                ('character_count', models.PositiveIntegerField(default=0, verbose_name='Character Count')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('kink', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='characters.kink', verbose_name='Kink')),
+            ],
+            options={
+                'verbose_name': 'Kink Facet',
+                'verbose_name_plural': 'Kink Facets',
+                'unique_together': {('kink', 'rating')},
+            },
+        ),
+        migrations.RunPython(build_kink_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('characters', '0007_kinkfacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kinkfacet',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Changed by every write, so writes can be made conditional on the bitmap read', verbose_name='Revision'),
+        ),
+    ]
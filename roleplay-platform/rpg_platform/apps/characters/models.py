@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
@@ -156,17 +156,73 @@ class Character(models.Model):
     list_description = models.TextField(blank=True)
     views = models.PositiveIntegerField(default=0)
     content_preferences = models.TextField(blank=True)
+
+    # Rating and comment aggregates, maintained by the signals in
+    # characters.signals and repaired by repair_character_aggregates
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0, editable=False, db_index=True)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    AGGREGATE_FIELDS = (
+        "rating_sum", "rating_count", "rating_1_count", "rating_2_count", "rating_3_count",
+        "rating_4_count", "rating_5_count", "average_rating", "comment_count",
+    )
+
     class Meta:
         ordering = ["-created_at"]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can tell what changed
+        instance._original_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self, *fields):
+        """Check if any of ``fields`` differs from its stored value, True if unknown"""
+        original = getattr(self, "_original_values", None)
+        if original is None:
+            return True
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            if attname not in original or original[attname] != getattr(self, attname):
+                return True
+        return False
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        saved = kwargs.get("update_fields")
+        self._original_values = {
+            **getattr(self, "_original_values", {}),
+            **{
+                field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+                if saved is None or field.name in saved
+            },
+        }
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Aggregates are only written through relative updates, so saving a
+        # previously loaded character must not overwrite them with stale values.
+        # A character whose row is gone is still inserted whole, as usual
+        if update_fields is None:
+            values = [value for value in values if value[0].name not in self.AGGREGATE_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
     def get_absolute_url(self):
-        return reverse("characters:detail", kwargs={"pk": self.pk})
+        return reverse("characters:character_detail", kwargs={"pk": self.pk})
 
     def can_edit(self, user):
         return user == self.user or user.is_staff
@@ -189,14 +245,23 @@ class Character(models.Model):
 
     def get_average_rating(self):
         """Get the average rating for this character"""
-        ratings = self.ratings.all()
-        if not ratings:
-            return 0
-        return round(sum(rating.rating for rating in ratings) / len(ratings), 1)
+        return round(self.average_rating, 1)
 
     def get_rating_count(self):
         """Get the number of ratings for this character"""
-        return self.ratings.count()
+        return self.rating_count
+
+    def get_rating_histogram(self):
+        """Get the number of ratings per star value, highest first"""
+        histogram = []
+        for value in range(5, 0, -1):
+            count = getattr(self, f"rating_{value}_count")
+            histogram.append({
+                "rating": value,
+                "count": count,
+                "percent": round(100 * count / self.rating_count) if self.rating_count else 0,
+            })
+        return histogram
 
     def get_user_rating(self, user):
         """Get the rating given by a specific user"""
@@ -216,6 +281,10 @@ class Character(models.Model):
         # Otherwise filter out hidden comments
         return comments.filter(is_hidden=False)
 
+    def is_visible_to(self, user):
+        """Check if a user can see this character"""
+        return self.public or (user is not None and user == self.user)
+
     def can_user_comment(self, user):
         """Check if a user can comment on this character"""
         # User must be authenticated
@@ -357,6 +426,40 @@ class CharacterKink(models.Model):
         return f"{self.character.name} - {self.kink.name}: {self.rating}"
 
 
+class KinkFacet(models.Model):
+    """
+    Bitmap of the characters that have a kink with a given rating.
+
+    Bit ``n`` of ``bitmap`` (little-endian) is set when the character with id
+    ``n`` rates the kink with ``rating``. See ``characters.facets``.
+    """
+
+    kink = models.ForeignKey(
+        Kink,
+        on_delete=models.CASCADE,
+        related_name="facets",
+        verbose_name=_("Kink"),
+    )
+    rating = models.CharField(_("Rating"), max_length=10, choices=CharacterKink.RATING_CHOICES)
+    bitmap = models.BinaryField(_("Character Bitmap"), default=b"")
+    character_count = models.PositiveIntegerField(_("Character Count"), default=0)
+    revision = models.BigIntegerField(
+        _("Revision"),
+        default=0,
+        editable=False,
+        help_text=_("Changed by every write, so writes can be made conditional on the bitmap read"),
+    )
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Kink Facet")
+        verbose_name_plural = _("Kink Facets")
+        unique_together = ("kink", "rating")
+
+    def __str__(self):
+        return f"{self.kink.name} ({self.rating}): {self.character_count} characters"
+
+
 class CustomKink(models.Model):
     """
     Custom kinks created by users
@@ -504,6 +607,24 @@ class CharacterRating(models.Model):
     def __str__(self):
         return f"{self.character.name}: {self.rating} stars by {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so signal handlers can compute deltas
+        instance._original_rating = dict(zip(field_names, values)).get("rating")
+        return instance
+
+    @property
+    def original_rating(self):
+        """The rating as last loaded from or saved to the database"""
+        return getattr(self, "_original_rating", None)
+
+    def save(self, *args, **kwargs):
+        # Signal handlers update the character aggregates in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._original_rating = self.rating
+
 
 class CharacterComment(models.Model):
     """
@@ -535,6 +656,11 @@ class CharacterComment(models.Model):
     def __str__(self):
         return f"Comment by {self.author.username} on {self.character.name}"
 
+    def save(self, *args, **kwargs):
+        # Signal handlers update the character aggregates in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def is_edited(self):
         """Check if the comment has been edited"""
         time_difference = self.updated_at - self.created_at
@@ -0,0 +1,342 @@
+"""
+Full-text search over characters.
+
+Character text fields and custom kink names are indexed in a dedicated
+search table: an FTS5 virtual table on SQLite, or a ``tsvector`` column with
+a GIN index on PostgreSQL. Queries are turned into prefix matches on every
+term, ranked with BM25 (``ts_rank_cd`` on PostgreSQL) and highlighted by the
+database. Other databases fall back to unranked ``icontains`` filters.
+
+The index is joined once to the character queryset being searched and ranks
+come from that single match, so visibility and the other search filters apply
+before ranking and no match is cut off by a result limit.
+
+The index is kept in sync by the signal handlers in ``characters.signals`` and
+can be rebuilt with the ``rebuild_character_search_index`` command.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_TABLE = "characters_character_search"
+
+# Character fields copied into the index, searched in addition to kink names
+SEARCH_FIELDS = ("name", "species", "personality", "appearance", "background")
+
+# Relative importance of a match in each indexed column, ``kinks`` last
+COLUMN_WEIGHTS = (10.0, 4.0, 1.0, 1.0, 0.5, 2.0)
+
+# Terms beyond this are ignored
+MAX_TERMS = 10
+
+# Markers wrapped around matches by the database, replaced after escaping
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+SNIPPET_WORDS = 16
+
+
+def parse_terms(query):
+    """Split a user query into lowercase word terms"""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+def render_highlight(text):
+    """Escape highlighted text from the database and mark matches"""
+    if not text:
+        return ""
+    html = escape(text)
+    return mark_safe(html.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>"))
+
+
+class SearchBackend:
+    """
+    Base class for database specific search implementations
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def rebuild(self):
+        """Reindex every character"""
+        pass
+
+    def index_characters(self, character_ids):
+        """Reindex the given characters from their current rows"""
+        pass
+
+    def remove_characters(self, character_ids):
+        """Remove the given characters from the index"""
+        pass
+
+    def matches(self, queryset, terms):
+        """
+        Restrict a character queryset to matches, annotated with ``search_rank``.
+
+        Lower ranks are better matches.
+        """
+        from .models import Character
+
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(name__icontains=term) | Q(species__icontains=term) |
+                Q(personality__icontains=term) | Q(appearance__icontains=term) |
+                Q(background__icontains=term) | Q(custom_kinks__name__icontains=term)
+            )
+        return queryset.filter(id__in=Character.objects.filter(condition).values("id")).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+    def character_id_column(self, queryset):
+        """Quoted id column of the searched queryset, to join the index on"""
+        quote = self.connection.ops.quote_name
+        return f"{quote(queryset.model._meta.db_table)}.{quote('id')}"
+
+    def highlights(self, terms, character_ids):
+        """Return ``{id: (highlighted name, snippet)}`` for matching characters"""
+        return {}
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 virtual table keyed by character id
+    """
+
+    # Text columns of a character as stored in the index
+    DOCUMENT_SQL = (
+        "SELECT c.id, c.name, c.species, c.personality, c.appearance, c.background, "
+        "(SELECT group_concat(k.name, ' ') FROM characters_customkink k WHERE k.character_id = c.id) "
+        "FROM characters_character c"
+    )
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "name, species, personality, appearance, background, kinks, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} "
+                "(rowid, name, species, personality, appearance, background, kinks) "
+                f"{self.DOCUMENT_SQL}"
+            )
+
+    def index_characters(self, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return
+        placeholders = ", ".join(["%s"] * len(character_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", character_ids)
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} "
+                "(rowid, name, species, personality, appearance, background, kinks) "
+                f"{self.DOCUMENT_SQL} WHERE c.id IN ({placeholders})",
+                character_ids
+            )
+
+    def remove_characters(self, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return
+        placeholders = ", ".join(["%s"] * len(character_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", character_ids)
+
+    def match_expression(self, terms):
+        # Terms are word characters only, so quoting them is safe
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def matches(self, queryset, terms):
+        weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+
+        # One MATCH joined on the character rows; bm25 is negative, lower is better
+        return queryset.extra(
+            select={"search_rank": f"bm25({SEARCH_TABLE}, {weights})"},
+            tables=[SEARCH_TABLE],
+            where=[
+                f"{SEARCH_TABLE}.rowid = {self.character_id_column(queryset)}",
+                f"{SEARCH_TABLE} MATCH %s",
+            ],
+            params=[self.match_expression(terms)]
+        )
+
+    def highlights(self, terms, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(character_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, highlight({SEARCH_TABLE}, 0, %s, %s), "
+                f"snippet({SEARCH_TABLE}, -1, %s, %s, '…', %s) "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, SNIPPET_WORDS,
+                 self.match_expression(terms), *character_ids]
+            )
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Weighted ``tsvector`` per character with a GIN index
+    """
+
+    DOCUMENT_SQL = (
+        "SELECT c.id, "
+        "setweight(to_tsvector('simple', coalesce(c.name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(c.species, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce((SELECT string_agg(k.name, ' ') "
+        "FROM characters_customkink k WHERE k.character_id = c.id), '')), 'B') || "
+        "setweight(to_tsvector('simple', concat_ws(' ', c.personality, c.appearance)), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(c.background, '')), 'D') "
+        "FROM characters_character c"
+    )
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                "character_id integer PRIMARY KEY REFERENCES characters_character (id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin (document)"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (character_id, document) {self.DOCUMENT_SQL}")
+
+    def index_characters(self, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (character_id, document) "
+                f"{self.DOCUMENT_SQL} WHERE c.id = ANY(%s) "
+                "ON CONFLICT (character_id) DO UPDATE SET document = EXCLUDED.document",
+                [character_ids]
+            )
+
+    def remove_characters(self, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE character_id = ANY(%s)", [character_ids])
+
+    def tsquery(self, terms):
+        return " & ".join(f"{term}:*" for term in terms)
+
+    def matches(self, queryset, terms):
+        # ts_rank_cd grows with relevance, negated so lower is better
+        return queryset.extra(
+            select={"search_rank": f"-ts_rank_cd({SEARCH_TABLE}.document, to_tsquery('simple', %s))"},
+            select_params=[self.tsquery(terms)],
+            tables=[SEARCH_TABLE],
+            where=[
+                f"{SEARCH_TABLE}.character_id = {self.character_id_column(queryset)}",
+                f"{SEARCH_TABLE}.document @@ to_tsquery('simple', %s)",
+            ],
+            params=[self.tsquery(terms)]
+        )
+
+    def highlights(self, terms, character_ids):
+        character_ids = list(character_ids)
+        if not character_ids:
+            return {}
+        options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, HighlightAll=true"
+        snippet_options = (
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, "
+            f"MaxWords={SNIPPET_WORDS}, MinWords=5, MaxFragments=1"
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.id, ts_headline('simple', c.name, query, %s), "
+                "ts_headline('simple', concat_ws(' ', c.personality, c.appearance, c.background), query, %s) "
+                "FROM characters_character c, to_tsquery('simple', %s) query WHERE c.id = ANY(%s)",
+                [options, snippet_options, self.tsquery(terms), character_ids]
+            )
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def get_search_backend(using="default"):
+    """Return the search backend for a database connection"""
+    connection = connections[using] if isinstance(using, str) else using
+
+    if connection.vendor == "sqlite":
+        return SQLiteSearchBackend(connection)
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend(connection)
+    return SearchBackend(connection)
+
+
+def index_characters(character_ids):
+    get_search_backend().index_characters(character_ids)
+
+
+def remove_characters(character_ids):
+    get_search_backend().remove_characters(character_ids)
+
+
+def rebuild_search_index():
+    get_search_backend().rebuild()
+
+
+def search_characters(queryset, query):
+    """
+    Restrict a character queryset to matches for ``query``, best match first.
+
+    Matching characters are annotated with ``search_rank`` (lower is better).
+    If the query has no searchable terms the queryset is returned unchanged.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return queryset
+
+    return get_search_backend().matches(queryset, terms).order_by("search_rank")
+
+
+def attach_highlights(characters, query):
+    """
+    Set ``search_name`` and ``search_snippet`` on characters of a result page.
+
+    Both are safe HTML with matches wrapped in ``<mark>``.
+    """
+    characters = list(characters)
+    terms = parse_terms(query)
+    highlights = get_search_backend().highlights(terms, [c.id for c in characters]) if terms else {}
+
+    for character in characters:
+        name, snippet = highlights.get(character.id, (None, None))
+        character.search_name = render_highlight(name) if name else escape(character.name)
+        character.search_snippet = render_highlight(snippet)
+
+    return characters
@@ -1,5 +1,112 @@
 # Signal handlers for character-related events
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 
-from rpg_platform.apps.characters.models import Character, CharacterImage
+from rpg_platform.apps.characters.models import (
+    Character, CharacterImage, CharacterKink, CharacterRating, CharacterComment, CustomKink
+)
+from rpg_platform.apps.characters.detail_cache import invalidate_character_detail
+from rpg_platform.apps.characters.facets import update_character_facets
+from rpg_platform.apps.characters.aggregates import (
+    apply_comment_change, apply_rating_change, repair_character_aggregates
+)
+from rpg_platform.apps.characters.search import SEARCH_FIELDS, index_characters, remove_characters
+
+# Sent after a character's kink sheet was saved with bulk queries, which
+# bypass the model signals. Receives ``character_id`` and ``ratings``, the
+# new rating of each created or updated kink and ``None`` for deleted ones.
+character_kinks_changed = Signal()
+
+
+@receiver(post_save, sender=CharacterRating)
+def update_aggregates_on_rating_save(sender, instance, created, **kwargs):
+    """Keep the character's rating aggregates in sync with a saved rating"""
+    if created:
+        apply_rating_change(instance.character_id, None, instance.rating)
+    elif instance.original_rating is None:
+        # Saved without being loaded first, so the previous value is unknown
+        repair_character_aggregates([instance.character_id])
+    else:
+        apply_rating_change(instance.character_id, instance.original_rating, instance.rating)
+
+
+@receiver(post_delete, sender=CharacterRating)
+def update_aggregates_on_rating_delete(sender, instance, **kwargs):
+    """Remove a deleted rating from the character's aggregates"""
+    apply_rating_change(instance.character_id, instance.rating, None)
+
+
+@receiver(post_save, sender=CharacterComment)
+def update_aggregates_on_comment_save(sender, instance, created, **kwargs):
+    """Count a new comment on the character"""
+    if created:
+        apply_comment_change(instance.character_id, 1)
+
+
+@receiver(post_delete, sender=CharacterComment)
+def update_aggregates_on_comment_delete(sender, instance, **kwargs):
+    """Uncount a deleted comment"""
+    apply_comment_change(instance.character_id, -1)
+
+
+@receiver(post_save, sender=Character)
+def update_search_index_on_character_save(sender, instance, update_fields=None, **kwargs):
+    """Reindex a character whose searchable text may have changed"""
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    index_characters([instance.pk])
+
+
+@receiver(post_delete, sender=Character)
+def update_search_index_on_character_delete(sender, instance, **kwargs):
+    """Remove a deleted character from the search index"""
+    remove_characters([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=CustomKink)
+def update_search_index_on_custom_kink_change(sender, instance, **kwargs):
+    """Reindex a character whose custom kink names changed"""
+    index_characters([instance.character_id])
+
+
+@receiver(post_save, sender=CharacterKink)
+def update_facets_on_kink_save(sender, instance, **kwargs):
+    """Move the character to the facet of its new rating"""
+    update_character_facets(instance.character_id, {instance.kink_id: instance.rating})
+
+
+@receiver(post_delete, sender=CharacterKink)
+def update_facets_on_kink_delete(sender, instance, **kwargs):
+    """Remove the character from the facets of a deleted kink"""
+    update_character_facets(instance.character_id, {instance.kink_id: None})
+
+
+@receiver(character_kinks_changed)
+def update_facets_on_kink_sheet_change(sender, character_id, ratings=None, **kwargs):
+    """Apply the kinks of a bulk kink sheet update to the facets"""
+    update_character_facets(character_id, ratings or {})
+
+
+@receiver([post_save, post_delete], sender=Character)
+def invalidate_detail_on_character_change(sender, instance, **kwargs):
+    """Drop the cached profile fragment of a changed character"""
+    character_id = instance.pk
+    transaction.on_commit(lambda: invalidate_character_detail(character_id))
+
+
+@receiver([post_save, post_delete], sender=CharacterKink)
+@receiver([post_save, post_delete], sender=CustomKink)
+@receiver([post_save, post_delete], sender=CharacterImage)
+@receiver([post_save, post_delete], sender=CharacterRating)
+@receiver([post_save, post_delete], sender=CharacterComment)
+def invalidate_detail_on_related_change(sender, instance, **kwargs):
+    """Drop the cached profile fragment when a row shown on it changes"""
+    character_id = instance.character_id
+    transaction.on_commit(lambda: invalidate_character_detail(character_id))
+
+
+@receiver(character_kinks_changed)
+def invalidate_detail_on_kink_sheet_change(sender, character_id, **kwargs):
+    """Drop the cached profile fragment after a bulk kink sheet update"""
+    transaction.on_commit(lambda: invalidate_character_detail(character_id))
@@ -0,0 +1,414 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rpg_platform.apps.core.models import CacheVersion
+
+from .aggregates import repair_character_aggregates
+from .detail_cache import _local as local_detail_cache, get_character_detail, version_key
+from .facets import (
+    bitmap_from_ids, get_facet_index, ids_filter, ids_from_bitmap, invalidate_facet_index, rebuild_kink_facets,
+    to_bytes, update_character_facets
+)
+from .models import (
+    Character, CharacterComment, CharacterImage, CharacterKink, CharacterRating, CustomKink, Kink,
+    KinkCategory, KinkFacet
+)
+from .search import attach_highlights, search_characters
+
+User = get_user_model()
+
+
+class CharacterAggregateTests(TestCase):
+    """
+    Tests for the rating and comment aggregates stored on characters.
+    """
+
+    def setUp(self):
+        """Set up a character and a few raters."""
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        self.character = Character.objects.create(user=self.owner, name='Aria', gender='female', species='elf')
+        self.raters = [
+            User.objects.create_user(username=f'rater{i}', password='testpassword')
+            for i in range(3)
+        ]
+
+    def test_ratings_update_aggregates(self):
+        """Test that creating, changing and deleting ratings keeps aggregates exact."""
+        for rater, value in zip(self.raters, [5, 4, 2]):
+            CharacterRating.objects.create(character=self.character, user=rater, rating=value)
+
+        rating = CharacterRating.objects.get(character=self.character, user=self.raters[2])
+        rating.rating = 5
+        rating.save()
+        CharacterRating.objects.filter(user=self.raters[1]).delete()
+
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.rating_count, 2)
+        self.assertEqual(self.character.rating_sum, 10)
+        self.assertEqual(self.character.average_rating, 5.0)
+        self.assertEqual(
+            [self.character.rating_5_count, self.character.rating_4_count, self.character.rating_2_count],
+            [2, 0, 0]
+        )
+
+    def test_comments_update_count(self):
+        """Test that the comment count follows comment creation and deletion."""
+        comments = [
+            CharacterComment.objects.create(character=self.character, author=rater, content='Hello')
+            for rater in self.raters
+        ]
+        comments[0].delete()
+
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.comment_count, 2)
+
+    def test_stale_character_save_keeps_aggregates(self):
+        """Test that saving a previously loaded character does not overwrite aggregates."""
+        stale = Character.objects.get(pk=self.character.pk)
+        CharacterRating.objects.create(character=self.character, user=self.raters[0], rating=3)
+
+        stale.name = 'Aria Renamed'
+        stale.save()
+
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.name, 'Aria Renamed')
+        self.assertEqual(self.character.rating_count, 1)
+
+    def test_saving_a_deleted_character_stores_it_again(self):
+        """Test that saving a loaded character whose row is gone inserts it, like a plain save."""
+        stale = Character.objects.get(pk=self.character.pk)
+        Character.objects.filter(pk=self.character.pk).delete()
+
+        stale.name = 'Aria Restored'
+        stale.save()
+        self.assertTrue(Character.objects.filter(pk=self.character.pk, name='Aria Restored').exists())
+
+        stale.delete()
+        stale.save()
+        self.assertTrue(Character.objects.filter(pk=stale.pk, name='Aria Restored').exists())
+
+    def test_repair_fixes_drift(self):
+        """Test that the repair recalculates aggregates changed behind the signals' back."""
+        CharacterRating.objects.create(character=self.character, user=self.raters[0], rating=4)
+        CharacterRating.objects.update(rating=1)
+
+        self.assertEqual(repair_character_aggregates(), 1)
+
+        self.character.refresh_from_db()
+        self.assertEqual(self.character.average_rating, 1.0)
+        self.assertEqual(self.character.rating_1_count, 1)
+        self.assertEqual(self.character.rating_4_count, 0)
+        self.assertEqual(repair_character_aggregates(), 0)
+
+
+class CharacterSearchTests(TestCase):
+    """
+    Tests for the full-text character search index.
+    """
+
+    def setUp(self):
+        """Set up characters with searchable text."""
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        self.named = Character.objects.create(
+            user=self.owner, name='Silverwind', gender='female', species='elf'
+        )
+        self.described = Character.objects.create(
+            user=self.owner, name='Bram', gender='male', species='dwarf',
+            background='Raised by a clan of silversmiths <b>under</b> the mountain.'
+        )
+        Character.objects.create(user=self.owner, name='Unrelated', gender='male', species='human')
+
+    def search(self, query):
+        return list(search_characters(Character.objects.all(), query))
+
+    def test_prefix_match_ranks_name_first(self):
+        """Test that prefixes match and name hits outrank background hits."""
+        self.assertEqual(self.search('silver'), [self.named, self.described])
+
+    def test_search_ranks_within_the_filtered_queryset(self):
+        """Test that filters apply before ranking, so better matches elsewhere don't crowd them out."""
+        for i in range(5):
+            Character.objects.create(user=self.owner, name=f'Silver {i}', gender='other', species='elf', public=False)
+
+        characters = list(search_characters(Character.objects.filter(species='dwarf'), 'silver'))
+        self.assertEqual(characters, [self.described])
+        self.assertLess(characters[0].search_rank, 0)
+
+    def test_search_ranks_in_one_match(self):
+        """Test that results are ranked by a single match joined on the characters, not one per row."""
+        with CaptureQueriesContext(connection) as queries:
+            characters = self.search('silver')
+
+        self.assertEqual(characters, [self.named, self.described])
+        self.assertLess(characters[0].search_rank, characters[1].search_rank)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertEqual(sql.count(' MATCH '), 1)
+        self.assertEqual(sql.count('SELECT'), 1)
+
+    def test_index_follows_saves_and_deletes(self):
+        """Test that edits, custom kinks and deletions update the index."""
+        self.described.name = 'Thorn'
+        self.described.save()
+        CustomKink.objects.create(character=self.named, name='Stargazing', rating='fave')
+
+        self.assertEqual(self.search('thorn'), [self.described])
+        self.assertEqual(self.search('stargaz'), [self.named])
+
+        self.named.delete()
+        self.assertEqual(self.search('silver'), [self.described])
+
+    def test_highlights_are_escaped(self):
+        """Test that highlights mark matches and escape character text."""
+        characters = attach_highlights(self.search('silversmiths'), 'silversmiths')
+
+        self.assertIn('<mark>silversmiths</mark>', characters[0].search_snippet)
+        self.assertIn('&lt;b&gt;', characters[0].search_snippet)
+
+
+class KinkFacetTests(TestCase):
+    """
+    Tests for the kink facet bitmaps used by the character search.
+    """
+
+    def setUp(self):
+        """Set up kinks and characters with kink sheets."""
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        category = KinkCategory.objects.create(name='General')
+        self.bondage, self.roleplay, self.fluff = [
+            Kink.objects.create(category=category, name=name) for name in ('Bondage', 'Roleplay', 'Fluff')
+        ]
+        self.first, self.second, self.third = [
+            Character.objects.create(user=self.owner, name=name, gender='female', species='elf')
+            for name in ('First', 'Second', 'Third')
+        ]
+        for character, kink, rating in [
+            (self.first, self.bondage, 'fave'), (self.first, self.roleplay, 'yes'),
+            (self.second, self.bondage, 'maybe'), (self.third, self.roleplay, 'fave'),
+        ]:
+            CharacterKink.objects.create(character=character, kink=kink, rating=rating)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_kink_facets()
+
+    def tearDown(self):
+        invalidate_facet_index()
+
+    def match(self, **filters):
+        everyone = bitmap_from_ids([self.first.pk, self.second.pk, self.third.pk])
+        return ids_from_bitmap(get_facet_index().match(everyone, **filters))
+
+    def test_bitmap_round_trip(self):
+        """Test that ids survive conversion to a bitmap and back."""
+        self.assertEqual(ids_from_bitmap(bitmap_from_ids([900, 3, 64, 0])), [0, 3, 64, 900])
+
+    def test_match_and_counts(self):
+        """Test any/all/none kink filters, rating filters and facet counts."""
+        bondage, roleplay = self.bondage.pk, self.roleplay.pk
+
+        self.assertEqual(self.match(any_of=[bondage, roleplay]), [self.first.pk, self.second.pk, self.third.pk])
+        self.assertEqual(self.match(all_of=[bondage, roleplay]), [self.first.pk])
+        self.assertEqual(self.match(any_of=[roleplay], none_of=[bondage]), [self.third.pk])
+        self.assertEqual(self.match(any_of=[bondage, roleplay], rating='fave'), [self.first.pk, self.third.pk])
+
+        counts = get_facet_index().counts(bitmap_from_ids([self.first.pk, self.second.pk]))
+        self.assertEqual(counts, {bondage: 2, roleplay: 1})
+
+    def test_kink_update_view_updates_facets(self):
+        """Test that saving a kink sheet moves the character between facets."""
+        self.client.login(username='owner', password='testpassword')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('characters:kink_update', args=[self.second.pk]), {
+                f'kink_{self.fluff.pk}': 'yes',
+                f'kink_{self.roleplay.pk}': 'fave',
+            })
+
+        self.assertEqual(self.match(any_of=[self.bondage.pk]), [self.first.pk])
+        self.assertEqual(self.match(any_of=[self.roleplay.pk], rating='fave'), [self.second.pk, self.third.pk])
+        self.assertEqual(self.match(any_of=[self.fluff.pk]), [self.second.pk])
+
+    def test_kink_changes_outside_the_view_update_facets(self):
+        """Test that kinks saved or deleted through the ORM keep the facets in step."""
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterKink.objects.create(character=self.third, kink=self.fluff, rating='yes')
+            CharacterKink.objects.filter(character=self.first, kink=self.bondage).delete()
+
+        self.assertEqual(self.match(any_of=[self.fluff.pk]), [self.third.pk])
+        self.assertEqual(self.match(any_of=[self.bondage.pk]), [self.second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Character.objects.filter(pk=self.second.pk).delete()
+
+        self.assertEqual(self.match(any_of=[self.bondage.pk]), [])
+
+    def test_concurrent_facet_writes_are_not_lost(self):
+        """Test that a facet changed between reading and writing it is read and written again."""
+        concurrent = []
+
+        def change_concurrently(bitmap):
+            # Another character gets the kink once this update has read the facets
+            if not concurrent:
+                facet = KinkFacet.objects.get(kink=self.bondage, rating='fave')
+                both = int.from_bytes(bytes(facet.bitmap), 'little') | 1 << self.third.pk
+                concurrent.append(KinkFacet.objects.filter(pk=facet.pk).update(
+                    bitmap=to_bytes(both), revision=facet.revision + 1
+                ))
+            return to_bytes(bitmap)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch('rpg_platform.apps.characters.facets.to_bytes', side_effect=change_concurrently):
+                update_character_facets(self.second.pk, {self.bondage.pk: 'fave'})
+
+        self.assertEqual(concurrent, [1])
+        self.assertEqual(
+            self.match(any_of=[self.bondage.pk], rating='fave'), [self.first.pk, self.second.pk, self.third.pk]
+        )
+        self.assertEqual(self.match(any_of=[self.bondage.pk], rating='maybe'), [])
+
+    def test_ids_filter_chunks_ids_on_other_databases(self):
+        """Test that databases without a single parameter for the ids get bounded IN lists."""
+        bitmap = bitmap_from_ids([self.first.pk, self.second.pk, self.third.pk])
+        other = mock.Mock(vendor='mysql')
+
+        with mock.patch('rpg_platform.apps.characters.facets.connections', {'default': other}), \
+                mock.patch('rpg_platform.apps.characters.facets.ID_CHUNK_SIZE', 2):
+            condition = ids_filter(bitmap)
+
+        self.assertEqual([len(child[1]) for child in condition.children], [2, 1])
+        self.assertEqual(Character.objects.filter(condition).count(), 3)
+        self.assertEqual(Character.objects.filter(ids_filter(bitmap)).count(), 3)
+
+    def test_search_filters_by_kinks(self):
+        """Test that the search view filters on kinks and counts them among the results."""
+        Character.objects.filter(pk=self.second.pk).update(public=False)
+        url = reverse('characters:character_search')
+
+        response = self.client.get(url, {'kinks': [self.bondage.pk, self.roleplay.pk], 'kink_mode': 'any'})
+        characters = list(response.context['characters'])
+        self.assertEqual(sorted(character.pk for character in characters), [self.first.pk, self.third.pk])
+        counts = {
+            kink.pk: kink.facet_count
+            for category in response.context['kink_categories'] for kink in category.kink_options
+        }
+        self.assertEqual((counts[self.bondage.pk], counts[self.roleplay.pk]), (1, 2))
+
+        response = self.client.get(url, {'exclude_kinks': [self.bondage.pk]})
+        self.assertEqual([character.pk for character in response.context['characters']], [self.third.pk])
+
+    def test_kink_update_view_query_count(self):
+        """Test that saving or clearing a large kink sheet does not query once per kink."""
+        category = KinkCategory.objects.create(name='Bulk')
+        kinks = [Kink.objects.create(category=category, name=f'Kink {i}') for i in range(60)]
+        sheet = {f'kink_{kink.pk}': 'yes' for kink in kinks}
+        sheet[f'kink_{self.bondage.pk}'] = 'no'
+        sheet['kink_999999'] = 'yes'
+        url = reverse('characters:kink_update', args=[self.first.pk])
+
+        self.client.login(username='owner', password='testpassword')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, sheet)
+
+        self.assertLess(len(queries), 20)
+        self.assertEqual(
+            dict(CharacterKink.objects.filter(character=self.first, kink__in=[self.bondage, self.roleplay])
+                 .values_list('kink_id', 'rating')),
+            {self.bondage.pk: 'no'}
+        )
+        self.assertEqual(CharacterKink.objects.filter(character=self.first).count(), 61)
+
+        # Dropping all but one kink deletes the other 60 at once
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {f'kink_{self.roleplay.pk}': 'fave'})
+
+        self.assertLess(len(queries), 20)
+        self.assertEqual(
+            list(CharacterKink.objects.filter(character=self.first).values_list('kink_id', 'rating')),
+            [(self.roleplay.pk, 'fave')]
+        )
+        self.assertEqual(self.match(any_of=[self.bondage.pk, kinks[0].pk]), [self.second.pk])
+        self.assertEqual(self.match(any_of=[self.roleplay.pk], rating='fave'), [self.first.pk, self.third.pk])
+
+
+class CharacterDetailCacheTests(TestCase):
+    """
+    Tests for the cached fragments of the character detail page.
+    """
+
+    def setUp(self):
+        """Set up a character with kinks and a comment."""
+        cache.clear()
+        local_detail_cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        self.character = Character.objects.create(user=self.owner, name='Aria', gender='female', species='elf')
+        category = KinkCategory.objects.create(name='General')
+        self.kink = Kink.objects.create(category=category, name='Roleplay')
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterKink.objects.create(character=self.character, kink=self.kink, rating='yes')
+            CharacterComment.objects.create(character=self.character, author=self.owner, content='Hello')
+
+    def test_cached_fragment_needs_no_queries(self):
+        """Test that a built fragment is served without touching the database."""
+        detail = get_character_detail(self.character)
+        self.assertEqual(detail['kinks_by_category']['General'][0]['rating'], 'yes')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_character_detail(self.character), detail)
+
+        local_detail_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_character_detail(self.character), detail)
+
+    def test_related_changes_invalidate_fragment(self):
+        """Test that custom kink, comment and image changes rebuild the fragment."""
+        get_character_detail(self.character)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomKink.objects.create(character=self.character, name='Stargazing', rating='fave')
+        detail = get_character_detail(self.character)
+        self.assertEqual(len(detail['kinks_by_category']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterComment.objects.get(character=self.character).delete()
+        self.assertEqual(get_character_detail(self.character)['comments'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterImage.objects.create(character=self.character, image='characters/aria.png')
+        self.assertEqual(len(get_character_detail(self.character)['images']), 1)
+
+    def test_changes_in_other_processes_invalidate_fragment(self):
+        """Test that a version bumped by another process is seen without a local signal."""
+        get_character_detail(self.character)
+
+        # Another process changes the kink and bumps the shared version
+        CharacterKink.objects.filter(character=self.character).update(rating='no')
+        CacheVersion.objects.update_or_create(key=version_key(self.character.pk), defaults={'version': 42})
+        # This process reads the version again once its check interval is over
+        cache.delete(version_key(self.character.pk))
+
+        detail = get_character_detail(self.character)
+        self.assertEqual(detail['kinks_by_category']['General'][0]['rating'], 'no')
+
+    def test_detail_page_renders_cached_comments(self):
+        """Test that visitors get the cached comments and owners also see hidden ones."""
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterComment.objects.create(
+                character=self.character, author=self.owner, content='Hidden remark', is_hidden=True
+            )
+        url = reverse('characters:character_detail', kwargs={'pk': self.character.pk})
+
+        self.client.force_login(User.objects.create_user(username='visitor', password='testpassword'))
+        response = self.client.get(url)
+        self.assertContains(response, 'Hello')
+        self.assertNotContains(response, 'Hidden remark')
+        self.assertTrue(response.context['can_rate'])
+
+        self.client.force_login(self.owner)
+        response = self.client.get(url)
+        self.assertContains(response, 'Hidden remark')
+        self.assertFalse(response.context['can_rate'])
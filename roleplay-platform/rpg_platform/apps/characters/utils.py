@@ -156,22 +156,16 @@ def get_popular_characters(exclude_ids=None, limit=10):
     if exclude_ids:
         queryset = queryset.exclude(id__in=exclude_ids)
 
-    # Annotate with average rating and comment count
-    queryset = queryset.annotate(
-        avg_rating=Avg('ratings__rating'),
-        rating_count=Count('ratings'),
-        comment_count=Count('comments')
-    )
-
-    # Calculate a popularity score: rating_count * avg_rating + comment_count
+    # Calculate a popularity score from the stored aggregates:
+    # rating_count * average_rating + comment_count
     queryset = queryset.annotate(
         popularity_score=ExpressionWrapper(
-            (F('avg_rating') * F('rating_count')) + F('comment_count'),
+            (F('average_rating') * F('rating_count')) + F('comment_count'),
             output_field=FloatField()
         )
     )
 
-    # Filter out characters with no ratings (null avg_rating)
+    # Filter out characters with no ratings
     queryset = queryset.filter(rating_count__gt=0)
 
     # Order by popularity score
@@ -199,11 +193,5 @@ def recommend_characters_by_kinks(kink_ids, exclude_ids=None, limit=10):
         ))
     )
 
-    # Also annotate with average rating and total rating count
-    queryset = queryset.annotate(
-        avg_rating=Avg('ratings__rating'),
-        rating_count=Count('ratings')
-    )
-
     # Order by matching kink count (descending) and then average rating (descending)
-    return queryset.order_by('-matching_kink_count', '-avg_rating')[:limit]
+    return queryset.order_by('-matching_kink_count', '-average_rating')[:limit]
@@ -3,6 +3,7 @@ from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db import transaction
 from django.db.models import Q, Prefetch, F, Subquery, OuterRef, Count
 from django.http import JsonResponse, HttpResponseForbidden
 from django.views.generic import (
@@ -23,6 +24,12 @@ from rpg_platform.apps.characters.models import (
     KinkCategory, Kink, CharacterKink, CustomKink,
     CharacterImage, CharacterRating, CharacterComment
 )
+from rpg_platform.apps.characters.detail_cache import get_character_detail
+from rpg_platform.apps.characters.facets import (
+    bitmap_from_ids, get_facet_index, ids_filter
+)
+from rpg_platform.apps.characters.signals import character_kinks_changed
+from rpg_platform.apps.characters.search import attach_highlights, search_characters
 from rpg_platform.apps.characters.forms import (
     CharacterForm,
     CharacterImageForm,
@@ -61,13 +68,10 @@ class CharacterListView(ListView):
     def get_queryset(self):
         queryset = super().get_queryset().filter(public=True)
 
-        # Filter by search terms if provided
+        # Filter by search terms if provided, ranked by relevance
         search_term = self.request.GET.get('search', '')
         if search_term:
-            queryset = queryset.filter(
-                models.Q(name__icontains=search_term) |
-                models.Q(species__icontains=search_term)
-            )
+            queryset = search_characters(queryset, search_term)
 
         # Filter by gender if provided
         gender = self.request.GET.get('gender', '')
@@ -79,9 +83,11 @@ class CharacterListView(ListView):
         if species:
             queryset = queryset.filter(species__icontains=species)
 
-        # Sort results
-        sort_by = self.request.GET.get('sort', 'created_at')
-        if sort_by.startswith('-'):
+        # Sort results; searches are ordered by relevance unless a sort is chosen
+        sort_by = self.request.GET.get('sort', '' if search_term else 'created_at')
+        if not sort_by:
+            pass
+        elif sort_by.startswith('-'):
             sort_field = sort_by[1:]
             if hasattr(Character, sort_field):
                 queryset = queryset.order_by(sort_by)
@@ -96,7 +102,11 @@ class CharacterListView(ListView):
         context['search_term'] = self.request.GET.get('search', '')
         context['gender_filter'] = self.request.GET.get('gender', '')
         context['species_filter'] = self.request.GET.get('species', '')
-        context['sort_by'] = self.request.GET.get('sort', 'created_at')
+        context['sort_by'] = self.request.GET.get('sort', '' if context['search_term'] else 'created_at')
+
+        if context['search_term']:
+            attach_highlights(context['characters'], context['search_term'])
+
         return context
 
 
@@ -126,11 +136,7 @@ class CharacterDetailView(DetailView):
         """
         obj = super().get_object(queryset)
 
-        if obj.is_friends_only:
-            # If character is friends-only, check if the user is authenticated and a friend
-            if not self.request.user.is_authenticated or not obj.user.is_friend_with(self.request.user):
-                raise Http404(_("Character not found"))
-        elif not obj.public and not self.request.user == obj.user:
+        if not obj.is_visible_to(self.request.user):
             raise Http404(_("Character not found"))
 
         return obj
@@ -142,12 +148,8 @@ class CharacterDetailView(DetailView):
         base_qs = super().get_queryset()
 
         if self.request.user.is_authenticated:
-            # Authenticated users can see their own characters and public/friends-only characters
-            return base_qs.filter(Q(
-                Q(user=self.request.user) |  # Own characters
-                Q(public=True) |  # Public characters
-                (Q(is_friends_only=True) & Q(user__friendships__friend=self.request.user))
-            ))
+            # Authenticated users can see their own characters and public characters
+            return base_qs.filter(Q(user=self.request.user) | Q(public=True))
         else:
             """
             Unauthenticated users can only see public characters
@@ -204,52 +206,23 @@ class CharacterDetailView(DetailView):
         context = super().get_context_data(**kwargs)
         character = self.object
 
-        # Get all images for the character
-        context['images'] = CharacterImage.objects.filter(character=character).order_by('-is_primary', 'order')
-
-        # Organize kinks by category
-        kinks_by_category = {}
-
-        # Add standard kinks
-        character_kinks = CharacterKink.objects.filter(character=character).select_related('kink__category')
-        for character_kink in character_kinks:
-            category_name = character_kink.kink.category.name
-            if category_name not in kinks_by_category:
-                kinks_by_category[category_name] = []
-
-            kinks_by_category[category_name].append({
-                'name': character_kink.kink.name,
-                'rating': character_kink.rating,
-                'description': character_kink.kink.description
-            })
-
-        # Add custom kinks
-        custom_kinks = CustomKink.objects.filter(character=character)
-        for custom_kink in custom_kinks:
-            category_name = custom_kink.category or _('Other')
-            if category_name not in kinks_by_category:
-                kinks_by_category[category_name] = []
-
-            kinks_by_category[category_name].append({
-                'name': custom_kink.name,
-                'rating': custom_kink.rating,
-                'description': custom_kink.description,
-                'is_custom': True
-            })
-
-        context['kinks_by_category'] = kinks_by_category
+        # Gallery, kinks and comments come from the per-character fragment cache
+        context.update(get_character_detail(character))
+
+        # Owners also see the comments they hid, which the cached fragment leaves out
+        if self.request.user == character.user:
+            context['comments'] = character.get_visible_comments(self.request.user)
+
+        context['can_rate'] = character.can_user_rate(self.request.user)
+        context['can_comment'] = character.can_user_comment(self.request.user)
 
         # Add ratings and comments to context
         context['ratings'] = CharacterRating.objects.filter(character=character)
 
-        # Calculate average rating
-        if context['ratings'].exists():
-            total_rating = sum(rating.value for rating in context['ratings'])
-            context['average_rating'] = total_rating / context['ratings'].count()
-            context['rating_count'] = context['ratings'].count()
-        else:
-            context['average_rating'] = 0
-            context['rating_count'] = 0
+        # Rating aggregates are stored on the character
+        context['average_rating'] = character.get_average_rating()
+        context['rating_count'] = character.rating_count
+        context['rating_histogram'] = character.get_rating_histogram()
 
         # Get user's rating if they have rated this character
         if self.request.user.is_authenticated:
@@ -258,13 +231,6 @@ class CharacterDetailView(DetailView):
             except CharacterRating.DoesNotExist:
                 context['user_rating'] = None
 
-        # Get comments
-        context['comments'] = CharacterComment.objects.filter(
-            character=character,
-            parent=None,
-            is_approved=True
-        ).select_related('user').prefetch_related('replies')
-
         # Add forms for comments and ratings if user is authenticated
         if self.request.user.is_authenticated:
             context['comment_form'] = CharacterCommentForm()
@@ -431,30 +397,55 @@ class CharacterKinkUpdateView(LoginRequiredMixin, UserPassesTestMixin, View):
     def post(self, request, *args, **kwargs):
         character = self.get_character()
 
-        # Process all form fields to extract kink preferences
+        valid_ratings = {value for value, _ in CharacterKink.RATING_CHOICES}
+
+        # Collect submitted ratings, skipping malformed fields
+        submitted = {}
+        for key, value in request.POST.items():
+            if key.startswith('kink_') and value in valid_ratings:
+                try:
+                    submitted[int(key[5:])] = value  # Remove 'kink_' prefix
+                except ValueError:
+                    pass
+
         with transaction.atomic():
-            # Delete existing kink preferences (we'll recreate them)
-            CharacterKink.objects.filter(character=character).delete()
-
-            # Create new kink preferences
-            created_count = 0
-            for key, value in request.POST.items():
-                if key.startswith('kink_') and value:
-                    # Extract kink ID from field name
-                    try:
-                        kink_id = int(key[5:])  # Remove 'kink_' prefix
-                        kink = Kink.objects.get(pk=kink_id)
-
-                        # Create the character kink preference
-                        CharacterKink.objects.create(
-                            character=character,
-                            kink=kink,
-                            rating=value
-                        )
-                        created_count += 1
-                    except (ValueError, Kink.DoesNotExist):
-                        # Skip invalid kink IDs
-                        pass
+            # Drop unknown kink ids with a single query
+            known_ids = set(Kink.objects.filter(pk__in=submitted).values_list('pk', flat=True))
+            new_ratings = {kink_id: rating for kink_id, rating in submitted.items() if kink_id in known_ids}
+
+            existing = {
+                character_kink.kink_id: character_kink
+                for character_kink in CharacterKink.objects.filter(character=character).only('id', 'kink_id', 'rating')
+            }
+
+            # Apply the difference between the stored and submitted sheets
+            to_create, to_update = [], []
+            for kink_id, rating in new_ratings.items():
+                character_kink = existing.get(kink_id)
+                if character_kink is None:
+                    to_create.append(CharacterKink(character=character, kink_id=kink_id, rating=rating))
+                elif character_kink.rating != rating:
+                    character_kink.rating = rating
+                    to_update.append(character_kink)
+            to_delete = [character_kink for kink_id, character_kink in existing.items() if kink_id not in new_ratings]
+
+            # A raw delete is one query and sends no post_delete per row;
+            # nothing references kink ratings, so there is nothing to cascade
+            if to_delete:
+                CharacterKink.objects.filter(pk__in=[character_kink.pk for character_kink in to_delete])._raw_delete(
+                    CharacterKink.objects.db
+                )
+            CharacterKink.objects.bulk_update(to_update, ['rating'], batch_size=500)
+            CharacterKink.objects.bulk_create(to_create, batch_size=500)
+
+            if to_create or to_update or to_delete:
+                ratings = {character_kink.kink_id: None for character_kink in to_delete}
+                ratings.update(
+                    (character_kink.kink_id, character_kink.rating) for character_kink in to_create + to_update
+                )
+                character_kinks_changed.send(sender=Character, character_id=character.pk, ratings=ratings)
+
+        created_count = len(new_ratings)
 
         messages.success(request, _("Successfully updated {} kink preferences.").format(created_count))
         return redirect('characters:character_detail', pk=character.pk)
@@ -845,19 +836,16 @@ class CharacterSearchView(TemplateView):
             has_images = form.cleaned_data.get('has_images', False)
             kinks = form.cleaned_data.get('kinks', [])
             kink_rating = form.cleaned_data.get('kink_rating', '')
+            kink_mode = form.cleaned_data.get('kink_mode') or 'any'
+            exclude_kinks = form.cleaned_data.get('exclude_kinks', [])
             sort_by = form.cleaned_data.get('sort_by', 'name')
 
             # Base queryset - public characters only
             queryset = Character.objects.filter(public=True)
 
-            # Apply search filters
+            # Apply full-text search, ranked by relevance
             if search_query:
-                queryset = queryset.filter(
-                    Q(name__icontains=search_query) |
-                    Q(species__icontains=search_query) |
-                    Q(personality__icontains=search_query) |
-                    Q(appearance__icontains=search_query)
-                )
+                queryset = search_characters(queryset, search_query)
 
             if gender:
                 # If gender is one of the common values, filter exactly
@@ -879,18 +867,33 @@ class CharacterSearchView(TemplateView):
             if has_images:
                 queryset = queryset.filter(images__isnull=False).distinct()
 
-            if kinks:
-                kink_filter = Q()
-                for kink in kinks:
-                    kink_filter |= Q(kinks__kink=kink)
-
-                if kink_rating:
-                    kink_filter &= Q(kinks__rating=kink_rating)
-
-                queryset = queryset.filter(kink_filter).distinct()
+            # Evaluate kink filters and counts on the facet bitmaps
+            kink_ids = [kink.pk for kink in kinks]
+            exclude_ids = [kink.pk for kink in exclude_kinks]
+            kink_counts = {}
+
+            if kink_ids:
+                facets = get_facet_index()
+                matches = facets.select(
+                    any_of=kink_ids if kink_mode != 'all' else (),
+                    all_of=kink_ids if kink_mode == 'all' else (),
+                    none_of=exclude_ids,
+                    rating=kink_rating or None
+                )
+                queryset = queryset.filter(ids_filter(matches))
+
+                # Only the characters having the selected kinks are read
+                found = bitmap_from_ids(queryset.values_list('id', flat=True))
+                kink_counts = facets.counts(found, rating=kink_rating or None)
+            elif exclude_ids:
+                queryset = queryset.exclude(
+                    id__in=CharacterKink.objects.filter(kink_id__in=exclude_ids).values('character_id')
+                )
 
-            # Apply sorting
-            if sort_by:
+            # Apply sorting; searches default to relevance order
+            if sort_by == 'relevance' or (search_query and not sort_by):
+                pass
+            elif sort_by:
                 queryset = queryset.order_by(sort_by)
 
             # Paginate results
@@ -903,8 +906,22 @@ class CharacterSearchView(TemplateView):
             except EmptyPage:
                 characters = paginator.page(paginator.num_pages)
 
+            if search_query:
+                attach_highlights(characters, search_query)
+
             context['characters'] = characters
             context['count'] = queryset.count()
+        else:
+            kink_counts = {}
+
+        # Kink options grouped by category, with the number of matches for each
+        kink_categories = KinkCategory.objects.prefetch_related(
+            Prefetch('kinks', queryset=Kink.objects.order_by('name'), to_attr='kink_options')
+        ).order_by('order', 'name')
+        for category in kink_categories:
+            for kink in category.kink_options:
+                kink.facet_count = kink_counts.get(kink.pk)
+        context['kink_categories'] = kink_categories
 
         return context
 
@@ -949,13 +966,14 @@ class CharacterCommentCreateView(LoginRequiredMixin, CreateView):
         # Create notification for character owner
         if character.user != self.request.user:
             from rpg_platform.apps.notifications.models import Notification
-            Notification.objects.create(
-                user=character.user,
-                notification_type='character_comment',
+            Notification.create_notification(
+                character.user,
+                'character_comment',
                 actor=self.request.user,
                 verb=_('commented on your character'),
                 action_object_id=character.id,
-                target_id=form.instance.id
+                target_id=form.instance.id,
+                url=reverse('characters:character_detail', kwargs={'pk': character.pk})
             )
 
         messages.success(self.request, _("Your comment has been posted."))
@@ -1099,13 +1117,14 @@ class CharacterRatingCreateView(LoginRequiredMixin, View):
         # Create notification for character owner if this is a new rating
         if created and character.user != request.user:
             from rpg_platform.apps.notifications.models import Notification
-            Notification.objects.create(
-                user=character.user,
-                notification_type='character_like',
+            Notification.create_notification(
+                character.user,
+                'character_like',
                 actor=request.user,
                 verb=_('rated your character'),
                 action_object_id=character.id,
-                target_id=rating.id
+                target_id=rating.id,
+                url=reverse('characters:character_detail', kwargs={'pk': character.pk})
             )
 
         # Success message
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='key')),
+                ('version', models.BigIntegerField(verbose_name='version')),
+            ],
+            options={
+                'verbose_name': 'cache version',
+                'verbose_name_plural': 'cache versions',
+            },
+        ),
+    ]
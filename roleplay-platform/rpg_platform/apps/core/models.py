@@ -0,0 +1,19 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class CacheVersion(models.Model):
+    """
+    Version of a group of cached entries, shared by every process
+
+    See ``rpg_platform.utils.cache``.
+    """
+    key = models.CharField(_('key'), max_length=255, primary_key=True)
+    version = models.BigIntegerField(_('version'))
+
+    class Meta:
+        verbose_name = _('cache version')
+        verbose_name_plural = _('cache versions')
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
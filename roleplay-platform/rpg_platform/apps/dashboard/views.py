@@ -7,6 +7,7 @@ import logging
 # Import models from other apps
 from rpg_platform.apps.characters.models import Character
 from rpg_platform.apps.messages.models import ChatRoom
+from rpg_platform.apps.messages.summaries import inbox_rooms
 from rpg_platform.apps.accounts.models import Friendship, FriendRequest, UserActivity
 from rpg_platform.apps.notifications.models import Notification
 from rpg_platform.apps.recommendations.models import CharacterRecommendation
@@ -35,7 +36,7 @@ def home(request):
     # Chat stats - with error handling
     try:
         context['chatroom_count'] = ChatRoom.objects.filter(participants=user).count()
-        context['chat_rooms'] = ChatRoom.objects.filter(participants=user).prefetch_related('participants').order_by('-updated_at')[:5] #corrected line
+        context['chat_rooms'] = inbox_rooms(user).prefetch_related('participants')[:5]
     except (OperationalError, ProgrammingError) as e:
         logger.warning(f"Error retrieving chat room data: {str(e)}")
         context['chatroom_count'] = 0
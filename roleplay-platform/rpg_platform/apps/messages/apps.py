@@ -5,4 +5,7 @@ from django.utils.translation import gettext_lazy as _
 class MessagesConfig(AppConfig):
     name = 'rpg_platform.apps.messages'
     label = 'my_messages'
-    verbose_name = _('Messages')
\ No newline at end of file
+    verbose_name = _('Messages')
+
+    def ready(self):
+        import rpg_platform.apps.messages.signals  # noqa
@@ -0,0 +1,148 @@
+import asyncio
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.utils import timezone
+
+from .models import ChatMessage, ChatRoom
+from .summaries import mark_room_read
+from .writer import get_writer
+
+# Longest message accepted from a client, in characters
+MAX_MESSAGE_LENGTH = 10000
+
+# Seconds read receipts are gathered before the read cursor is moved once
+READ_MARK_DELAY = 1.0
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer for the messages of a chat room
+
+    Messages are broadcast to the room group as soon as they arrive and
+    stored in the background by the event loop's ``ChatMessageWriter``, so a
+    busy room costs one ``bulk_create`` per batch instead of an INSERT and a
+    room UPDATE per message.
+    """
+
+    async def connect(self):
+        """Join the room group if the user takes part in the room"""
+        self.user = self.scope['user']
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+
+        if self.user.is_anonymous or not await self.is_participant():
+            await self.close()
+            return
+
+        self.mark_read_task = None
+        self.room_group_name = f'chat_{self.room_id}'
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'user_presence',
+            'event': 'user_connect',
+            'user_id': self.user.id,
+            'username': self.user.username
+        })
+
+    async def disconnect(self, close_code):
+        """Leave the room group and store the messages still buffered"""
+        if not hasattr(self, 'room_group_name'):
+            return
+
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'user_presence',
+            'event': 'user_disconnect',
+            'user_id': self.user.id,
+            'username': self.user.username
+        })
+        await get_writer().flush()
+
+        if self.mark_read_task is not None:
+            self.mark_read_task.cancel()
+            await self.mark_read()
+
+    async def receive(self, text_data):
+        """Handle messages sent by the client"""
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+
+        message_type = data.get('type')
+
+        if message_type == 'chat_message':
+            await self.send_chat_message(data.get('message'))
+
+        elif message_type == 'read_message':
+            # Receipts arrive for every message shown; move the cursor once per delay
+            if self.mark_read_task is None:
+                self.mark_read_task = asyncio.ensure_future(self.mark_read_later())
+
+        elif message_type == 'typing':
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'typing',
+                'user_id': self.user.id,
+                'username': self.user.username
+            })
+
+    async def send_chat_message(self, content):
+        """Broadcast a message to the room and queue it for storage"""
+        if not isinstance(content, str) or not content.strip():
+            return
+        content = content[:MAX_MESSAGE_LENGTH]
+
+        message = ChatMessage(
+            chat_room_id=self.room_id,
+            sender_id=self.user.id,
+            content=content,
+            timestamp=timezone.now()
+        )
+
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_message',
+            # Not stored yet; history loaded later has the ids
+            'message_id': None,
+            'message': content,
+            'sender_id': self.user.id,
+            'sender_username': self.user.username,
+            'character': None,
+            'timestamp': message.timestamp.isoformat()
+        })
+
+        get_writer().add(message)
+
+    async def chat_message(self, event):
+        """Send a room message to the client"""
+        await self.send(text_data=json.dumps(event))
+
+    async def typing(self, event):
+        """Tell the client someone else is typing"""
+        if event['user_id'] != self.user.id:
+            await self.send(text_data=json.dumps(event))
+
+    async def user_presence(self, event):
+        """Tell the client someone joined or left the room"""
+        await self.send(text_data=json.dumps({
+            'type': event['event'],
+            'user_id': event['user_id'],
+            'username': event['username']
+        }))
+
+    async def mark_read_later(self):
+        await asyncio.sleep(READ_MARK_DELAY)
+        self.mark_read_task = None
+        await self.mark_read()
+
+    @database_sync_to_async
+    def mark_read(self):
+        """Move the user's read cursor to the room's latest message"""
+        mark_room_read(self.room_id, self.user.id)
+
+    @database_sync_to_async
+    def is_participant(self):
+        """Check whether the user takes part in the room"""
+        return ChatRoom.objects.filter(pk=self.room_id, participants=self.user).exists()
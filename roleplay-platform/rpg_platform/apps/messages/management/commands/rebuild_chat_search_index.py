@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.messages.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Index every chat message again for search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-optimize', action='store_true',
+            help='Skip merging the index into one segment afterwards'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rebuild_index(optimize=not options['no_optimize'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the chat search index in {elapsed:.2f}s"))
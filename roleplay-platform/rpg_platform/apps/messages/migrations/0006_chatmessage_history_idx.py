@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_messages', '0005_chatmessage_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['chat_room', 'timestamp', 'id'], name='chatmessage_history_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+
+def backfill_summaries(apps, schema_editor):
+    """Summarize the messages of existing rooms; existing history counts as read"""
+    ChatRoom = apps.get_model('my_messages', 'ChatRoom')
+    ChatMessage = apps.get_model('my_messages', 'ChatMessage')
+    ChatRoomSummary = apps.get_model('my_messages', 'ChatRoomSummary')
+    ChatReadState = apps.get_model('my_messages', 'ChatReadState')
+
+    stats = {
+        row['chat_room']: row
+        for row in ChatMessage.objects.values('chat_room').annotate(count=Count('id'), last_id=Max('id'))
+    }
+    last_messages = ChatMessage.objects.in_bulk([row['last_id'] for row in stats.values()])
+
+    ChatRoomSummary.objects.bulk_create([
+        ChatRoomSummary(
+            room_id=room_id,
+            last_message_id=row['last_id'],
+            last_sender_id=last_messages[row['last_id']].sender_id,
+            last_message_preview=' '.join(last_messages[row['last_id']].content.split())[:255],
+            last_message_at=last_messages[row['last_id']].timestamp,
+            message_count=row['count'],
+        )
+        for room_id, row in stats.items()
+    ], batch_size=1000)
+
+    ChatReadState.objects.bulk_create([
+        ChatReadState(
+            room_id=participant.chatroom_id,
+            user_id=participant.user_id,
+            last_read_message_id=stats.get(participant.chatroom_id, {}).get('last_id') or 0,
+        )
+        for participant in ChatRoom.participants.through.objects.all()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('my_messages', '0006_chatmessage_history_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatRoomSummary',
+            fields=[
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='my_messages.chatroom')),
+                ('last_message_id', models.BigIntegerField(blank=True, null=True)),
+                ('last_message_preview', models.CharField(blank=True, max_length=255)),
+                ('last_message_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='my_messages.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='chatreadstate',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='unique_chat_read_state'),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_private_pairs(apps, schema_editor):
+    """
+    Set the user pair of existing private rooms with two participants.
+
+    Earlier duplicates of a pair keep working as rooms but only the oldest
+    becomes the pair's private room.
+    """
+    ChatRoom = apps.get_model('my_messages', 'ChatRoom')
+    Participant = ChatRoom.participants.through
+
+    participants = {}
+    for room_id, user_id in Participant.objects.filter(
+        chatroom__room_type='private'
+    ).values_list('chatroom_id', 'user_id').iterator():
+        participants.setdefault(room_id, []).append(user_id)
+
+    claimed = set()
+    for room_id in sorted(participants):
+        user_ids = sorted(participants[room_id])
+        if len(user_ids) != 2 or tuple(user_ids) in claimed:
+            continue
+        claimed.add(tuple(user_ids))
+        ChatRoom.objects.filter(pk=room_id).update(min_user_id=user_ids[0], max_user_id=user_ids[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('my_messages', '0007_chat_room_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='max_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='min_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_private_pairs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('room_type', 'private')), fields=('min_user', 'max_user'), name='unique_private_room_pair'),
+        ),
+    ]
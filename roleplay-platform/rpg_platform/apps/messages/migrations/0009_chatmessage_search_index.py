@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:05
+
+from django.db import migrations
+
+from rpg_platform.apps.messages.search import create_index, drop_index
+
+
+def forwards(apps, schema_editor):
+    create_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_messages', '0008_chatroom_private_pair'),
+    ]
+
+    operations = [
+        # FTS5 index over message content, see ``search``
+        migrations.RunPython(forwards, backwards),
+    ]
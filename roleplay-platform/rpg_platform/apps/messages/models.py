@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from rpg_platform.apps.accounts.models import User
 
 class ChatRoom(models.Model):
@@ -8,21 +9,97 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     room_type = models.CharField(max_length=50, default='general')
+    # The two users of a private room, lower id first
+    min_user = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    max_user = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # One private room per pair of users, see ``get_or_create_private``
+            models.UniqueConstraint(
+                fields=['min_user', 'max_user'],
+                condition=models.Q(room_type='private'),
+                name='unique_private_room_pair'
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         """Update the updated_at field each time a message is added."""
         super().save(*args, **kwargs)
 
+    @classmethod
+    def get_or_create_private(cls, user, other_user):
+        """
+        Return ``(room, created)`` for the private room of two users.
+
+        The room is found by its ordered pair of user ids, and created with
+        its participants in one transaction; when two requests create it at
+        once, the unique pair makes the later one read the earlier room.
+        """
+        min_user, max_user = sorted([user, other_user], key=lambda participant: participant.pk)
+        pair = {'room_type': 'private', 'min_user': min_user, 'max_user': max_user}
+
+        room = cls.objects.filter(**pair).first()
+        if room is not None:
+            return room, False
+
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(name=f"Chat with {other_user.username}", **pair)
+                room.participants.add(min_user, max_user)
+            return room, True
+        except IntegrityError:
+            return cls.objects.get(**pair), False
+
 class ChatMessage(models.Model):
     chat_room = models.ForeignKey(ChatRoom, related_name='chat_messages', on_delete=models.CASCADE, )
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, which is before it is stored, see ``writer``
+    timestamp = models.DateTimeField(default=timezone.now)
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.chat_room.save()
+    class Meta:
+        indexes = [
+            # Keyset pagination of room history, see ``pagination``
+            models.Index(fields=['chat_room', 'timestamp', 'id'], name='chatmessage_history_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        self.chat_room.save()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        """Update the room summary and unread counts with a new message."""
+        from .summaries import record_messages
+
+        is_new = self.pk is None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new:
+                record_messages([self])
+
+
+class ChatRoomSummary(models.Model):
+    """
+    Latest message and message count of a room
+
+    Updated with one UPDATE per room by every write of messages, see
+    ``summaries``, so room lists don't look at the messages at all.
+    """
+    room = models.OneToOneField(ChatRoom, related_name='summary', on_delete=models.CASCADE, primary_key=True)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_sender = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    message_count = models.PositiveIntegerField(default=0)
+
+
+class ChatReadState(models.Model):
+    """
+    Read cursor and unread message count of a participant in a room
+    """
+    room = models.ForeignKey(ChatRoom, related_name='read_states', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='chat_read_states', on_delete=models.CASCADE)
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_chat_read_state'),
+        ]
\ No newline at end of file
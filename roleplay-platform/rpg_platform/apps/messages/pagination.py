@@ -0,0 +1,108 @@
+"""
+Keyset pagination of chat history.
+
+A room's messages are paged newest first by ``(timestamp, id)``. Each page
+is found by seeking the ``(chat_room, timestamp, id)`` index to the oldest
+message of the previous page instead of counting rows, so opening a room or
+scrolling back costs one short index range read however long the room's
+history is. Positions are handed to clients as opaque cursors.
+"""
+import base64
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatMessage
+
+# Messages per page, and in the window rendered with the room
+DEFAULT_HISTORY_PAGE_SIZE = 50
+
+# Largest page a client may ask for
+MAX_HISTORY_PAGE_SIZE = 200
+
+
+def get_page_size():
+    return getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', DEFAULT_HISTORY_PAGE_SIZE)
+
+
+def clamp_page_size(limit):
+    """Page size asked for by a client, within ``1..MAX_HISTORY_PAGE_SIZE``"""
+    try:
+        return max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return get_page_size()
+
+
+def encode_cursor(message):
+    """Cursor of the messages older than ``message``"""
+    position = f"{message.timestamp.isoformat()}|{message.pk}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return ``(timestamp, id)`` from a cursor.
+
+    Raises ``ValueError`` for cursors that were not made by ``encode_cursor``.
+    """
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    if timestamp is None:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    return timestamp, pk
+
+
+def paginate_history(queryset, before=None, limit=None):
+    """
+    Return ``(messages, next_cursor)`` for the page of ``queryset`` before a cursor.
+
+    Messages are newest first; without a cursor the most recent page is
+    returned. ``next_cursor`` is ``None`` on the oldest page. Raises
+    ``ValueError`` for invalid cursors.
+    """
+    limit = limit or get_page_size()
+
+    if before:
+        timestamp, pk = decode_cursor(before)
+        # The inclusive bound on timestamp alone is what the index seeks on
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(pk__lt=pk), timestamp__lte=timestamp)
+
+    # One extra row tells whether there are older messages
+    messages = list(queryset.order_by('-timestamp', '-pk')[:limit + 1])
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    return messages, encode_cursor(messages[-1]) if has_more else None
+
+
+def serialize_message(message, user):
+    """Message data sent to the room's clients"""
+    return {
+        'id': message.pk,
+        'message': message.content,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.username,
+        'is_self': message.sender_id == user.id,
+        'character': None,
+        'created_at': message.timestamp.isoformat(),
+        'read': False,
+    }
+
+
+def get_history_page(room, user, before=None, limit=None):
+    """Return a page of a room's history as sent to clients"""
+    messages, next_cursor = paginate_history(
+        ChatMessage.objects.filter(chat_room=room).select_related('sender'), before, limit
+    )
+    return {
+        'messages': [serialize_message(message, user) for message in messages],
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+    }
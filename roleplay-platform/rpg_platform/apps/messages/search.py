@@ -0,0 +1,193 @@
+"""
+Full-text search of chat history.
+
+Messages are indexed by the SQLite FTS5 table ``my_messages_chatmessage_fts``,
+an external-content index over the message table kept up to date by
+triggers on it, so a message is indexed in the transaction that stores it
+however it is written, one by one or in the socket's batches. The room of
+each message is indexed too: searches are scoped to the rooms of the user,
+or to one of them, inside the FTS query, so only messages the user may read
+are matched and ranked, and no message row is read except those of the
+page. Results are ranked with bm25, newest first among equals, and come with
+a snippet of the message with the matched terms highlighted.
+
+Django copies SQLite tables to a new one for some schema changes, which
+drops their triggers; a migration altering ``ChatMessage`` has to create
+them again with ``create_index``, and ``rebuild_chat_search_index`` repairs
+an index that fell behind.
+"""
+import re
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.utils.html import escape
+
+from .models import ChatMessage, ChatRoom
+
+FTS_TABLE = 'my_messages_chatmessage_fts'
+
+# Results per page
+DEFAULT_SEARCH_PAGE_SIZE = 20
+
+# Largest page a client may ask for
+MAX_SEARCH_PAGE_SIZE = 50
+
+# Words of a query that are searched for, the rest is ignored
+MAX_SEARCH_TERMS = 16
+
+# Words of a long message shown around its matches
+SNIPPET_TOKENS = 24
+
+# Put around matches by the index, replaced with <mark> once the snippet is escaped
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+INDEX_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, chat_room_id,
+        content='my_messages_chatmessage', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON my_messages_chatmessage BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content, chat_room_id) VALUES (new.id, new.content, new.chat_room_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON my_messages_chatmessage BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content, chat_room_id)
+        VALUES ('delete', old.id, old.content, old.chat_room_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content, chat_room_id
+    ON my_messages_chatmessage BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content, chat_room_id)
+        VALUES ('delete', old.id, old.content, old.chat_room_id);
+        INSERT INTO {FTS_TABLE}(rowid, content, chat_room_id) VALUES (new.id, new.content, new.chat_room_id);
+    END
+    """,
+]
+
+DROP_INDEX_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def is_supported(using=None):
+    return (using or connection).vendor == 'sqlite'
+
+
+def create_index(schema_editor):
+    """Create the index and its triggers if missing, and index every message"""
+    if not is_supported(schema_editor.connection):
+        return
+    for sql in INDEX_SQL:
+        schema_editor.execute(sql)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_index(schema_editor):
+    if not is_supported(schema_editor.connection):
+        return
+    for sql in DROP_INDEX_SQL:
+        schema_editor.execute(sql)
+
+
+def rebuild_index(optimize=True):
+    """Index every message again, and merge the index into one segment"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def get_page_size():
+    return getattr(settings, 'CHAT_SEARCH_PAGE_SIZE', DEFAULT_SEARCH_PAGE_SIZE)
+
+
+def clamp_page_size(limit):
+    """Page size asked for by a client, within ``1..MAX_SEARCH_PAGE_SIZE``"""
+    try:
+        return max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return get_page_size()
+
+
+def search_terms(query):
+    """Words of a query; FTS operators typed by users are searched as text"""
+    return re.findall(r'\w+', query or '')[:MAX_SEARCH_TERMS]
+
+
+def match_expression(terms, room_ids):
+    """
+    FTS query for messages of the rooms containing every term.
+
+    Terms are whole words; prefixes would scan every word they start.
+    """
+    words = ' '.join(f'"{term}"' for term in terms)
+    rooms = ' OR '.join(f'"{room_id}"' for room_id in room_ids)
+    return f'content : ({words}) AND chat_room_id : ({rooms})'
+
+
+def render_snippet(snippet):
+    """Escape a snippet of the index and mark its matches"""
+    return escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search_messages(user, query, room_id=None, page=1, limit=None):
+    """
+    Return ``(messages, has_more)`` for a page of the messages matching ``query``.
+
+    Only the rooms ``user`` takes part in are searched, or only ``room_id``
+    if given. Messages are best match first and have a ``snippet``, HTML
+    of the message with its matches in ``<mark>``.
+    """
+    if not is_supported():
+        raise NotSupportedError("Chat search needs SQLite with FTS5")
+
+    limit = limit or get_page_size()
+    terms = search_terms(query)
+
+    rooms = ChatRoom.objects.filter(participants=user)
+    if room_id is not None:
+        rooms = rooms.filter(pk=room_id)
+    room_ids = list(rooms.values_list('pk', flat=True))
+
+    if not terms or not room_ids:
+        return [], False
+
+    with connection.cursor() as cursor:
+        # The room column is only there to scope searches, it doesn't weigh in the rank
+        cursor.execute(
+            f"""
+            SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', %s)
+            FROM {FTS_TABLE}
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY bm25({FTS_TABLE}, 1.0, 0.0), rowid DESC
+            LIMIT %s OFFSET %s
+            """,
+            [
+                MATCH_START, MATCH_END, SNIPPET_TOKENS, match_expression(terms, room_ids),
+                limit + 1, (max(page, 1) - 1) * limit,
+            ]
+        )
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    found = ChatMessage.objects.select_related('sender').in_bulk([pk for pk, _ in rows])
+    messages = []
+    for pk, snippet in rows:
+        message = found.get(pk)
+        if message is not None:
+            message.snippet = render_snippet(snippet)
+            messages.append(message)
+
+    return messages, has_more
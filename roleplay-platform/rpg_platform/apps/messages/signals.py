@@ -0,0 +1,32 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from rpg_platform.apps.messages.models import ChatReadState, ChatRoom
+from rpg_platform.apps.messages.summaries import add_read_states
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def sync_read_states(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Give participants a read cursor when they join a room, and drop it when they leave
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # Rooms added to or removed from a user
+        if action == 'post_add':
+            for room_id in pk_set:
+                add_read_states(room_id, [instance.pk])
+        elif action == 'post_remove':
+            ChatReadState.objects.filter(user=instance, room_id__in=pk_set).delete()
+        else:
+            ChatReadState.objects.filter(user=instance).delete()
+        return
+
+    if action == 'post_add':
+        add_read_states(instance.pk, pk_set)
+    elif action == 'post_remove':
+        ChatReadState.objects.filter(room=instance, user_id__in=pk_set).delete()
+    else:
+        ChatReadState.objects.filter(room=instance).delete()
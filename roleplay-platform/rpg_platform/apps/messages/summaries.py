@@ -0,0 +1,116 @@
+"""
+Room summaries and per-participant unread counts.
+
+Every write of messages updates, per room, the ``ChatRoomSummary`` row with
+one UPDATE and the ``ChatReadState`` rows of all its participants with
+another, in the same transaction as the messages. Room lists then read the
+latest message and the user's unread count of every room in one query,
+see ``inbox_rooms``, instead of looking at the messages.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FilteredRelation, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import ChatReadState, ChatRoom, ChatRoomSummary
+
+PREVIEW_LENGTH = ChatRoomSummary._meta.get_field('last_message_preview').max_length
+
+
+def preview(content):
+    content = ' '.join(content.split())
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def update_summary(room_id, room_messages):
+    """Count new messages of a room and remember the latest of them"""
+    last = max(room_messages, key=lambda message: (message.timestamp, message.pk))
+    latest = {
+        'last_message_id': last.pk,
+        'last_sender_id': last.sender_id,
+        'last_message_preview': preview(last.content),
+        'last_message_at': last.timestamp,
+    }
+
+    # A batch stored late by another process doesn't replace a newer message
+    newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=last.timestamp)
+    summaries = ChatRoomSummary.objects.filter(room_id=room_id)
+    changes = {
+        field: Case(
+            When(newer, then=Value(value)), default=F(field),
+            output_field=ChatRoomSummary._meta.get_field(field)
+        )
+        for field, value in latest.items()
+    }
+
+    if summaries.update(message_count=F('message_count') + len(room_messages), **changes):
+        return
+
+    try:
+        with transaction.atomic():
+            ChatRoomSummary.objects.create(room_id=room_id, message_count=len(room_messages), **latest)
+    except IntegrityError:
+        # Created concurrently by another write
+        summaries.update(message_count=F('message_count') + len(room_messages), **changes)
+
+
+def count_unread(room_id, room_messages):
+    """Add new messages of a room to the unread counts of the participants who didn't send them"""
+    sent = Counter(message.sender_id for message in room_messages)
+    own = Case(
+        *[When(user_id=sender_id, then=Value(count)) for sender_id, count in sent.items()],
+        default=Value(0)
+    )
+    ChatReadState.objects.filter(room_id=room_id).update(
+        unread_count=F('unread_count') + len(room_messages) - own
+    )
+
+
+def record_messages(messages):
+    """Apply stored messages to their rooms' summaries and unread counts"""
+    by_room = {}
+    for message in messages:
+        by_room.setdefault(message.chat_room_id, []).append(message)
+
+    for room_id, room_messages in by_room.items():
+        update_summary(room_id, room_messages)
+        count_unread(room_id, room_messages)
+
+
+def add_read_states(room_id, user_ids):
+    """Start read cursors of new participants at the room's latest message"""
+    last_message_id = ChatRoomSummary.objects.filter(room_id=room_id).values_list(
+        'last_message_id', flat=True
+    ).first() or 0
+    ChatReadState.objects.bulk_create(
+        [ChatReadState(room_id=room_id, user_id=user_id, last_read_message_id=last_message_id) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+
+
+def mark_room_read(room_id, user_id):
+    """Move a participant's read cursor to the room's latest message"""
+    last_message_id = Coalesce(
+        Subquery(ChatRoomSummary.objects.filter(room_id=room_id).values('last_message_id')[:1]),
+        Value(0)
+    )
+    ChatReadState.objects.filter(room_id=room_id, user_id=user_id).update(
+        last_read_message_id=last_message_id, unread_count=0
+    )
+
+
+def inbox_rooms(user):
+    """
+    Rooms of a user, most recently active first, in one query.
+
+    Rooms are annotated with ``unread_count``, ``last_message_time``,
+    ``last_message_preview`` and ``last_sender_username``.
+    """
+    return ChatRoom.objects.filter(participants=user).annotate(
+        own_read_state=FilteredRelation('read_states', condition=Q(read_states__user=user)),
+        unread_count=Coalesce(F('own_read_state__unread_count'), Value(0)),
+        last_message_time=F('summary__last_message_at'),
+        last_message_preview=F('summary__last_message_preview'),
+        last_sender_username=F('summary__last_sender__username'),
+    ).order_by(F('summary__last_message_at').desc(nulls_last=True), '-updated_at', '-pk')
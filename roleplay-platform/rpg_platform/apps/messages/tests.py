@@ -0,0 +1,300 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ChatMessage, ChatRoom
+from .routing import websocket_urlpatterns
+from .search import search_messages
+from .summaries import inbox_rooms, mark_room_read
+from .writer import ChatMessageWriter, persist_messages
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_WRITE_INTERVAL=0.05)
+class ChatConsumerTests(TransactionTestCase):
+    """
+    Tests for the chat socket and its write-behind storage.
+    """
+
+    def setUp(self):
+        """Set up a room with two participants and an outsider."""
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+        self.outsider = User.objects.create_user(username='eve', password='testpassword')
+        self.room = ChatRoom.objects.create(name='Tavern')
+        self.room.participants.add(self.alice, self.bob)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.pk}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return connected, communicator
+
+    def test_messages_are_broadcast_then_stored_in_order(self):
+        """Test that messages reach the room at once and are stored in one batch."""
+        async def run():
+            _, alice = await self.connect(self.alice)
+            _, bob = await self.connect(self.bob)
+            joined = await bob.receive_json_from()
+            self.assertEqual(joined, {'type': 'user_connect', 'user_id': self.bob.id, 'username': 'bob'})
+
+            for text in ('Hail', 'and well', 'met'):
+                await alice.send_json_to({'type': 'chat_message', 'message': text})
+
+            frames = [await bob.receive_json_from(timeout=1) for _ in range(3)]
+            await alice.disconnect()
+            await bob.disconnect()
+            return frames
+
+        frames = async_to_sync(run)()
+
+        self.assertEqual([frame['message'] for frame in frames], ['Hail', 'and well', 'met'])
+        self.assertEqual(frames[0]['sender_username'], 'alice')
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('pk').values_list('content', flat=True)),
+            ['Hail', 'and well', 'met']
+        )
+
+    def test_outsiders_are_rejected(self):
+        """Test that only participants can open the room's socket."""
+        async def run():
+            connected, communicator = await self.connect(self.outsider)
+            await communicator.disconnect()
+            return connected
+
+        self.assertFalse(async_to_sync(run)())
+
+    def test_full_buffer_is_flushed_at_once(self):
+        """Test that the writer flushes as soon as a batch is full."""
+        async def run():
+            writer = ChatMessageWriter(batch_size=2, interval=60)
+            for text in ('one', 'two'):
+                writer.add(ChatMessage(chat_room_id=self.room.pk, sender_id=self.alice.pk, content=text))
+            writer.timer.cancel()
+
+            await asyncio.sleep(0.1)
+            async with writer.lock:
+                return await ChatMessage.objects.acount(), len(writer.pending)
+
+        self.assertEqual(async_to_sync(run)(), (2, 0))
+
+    def test_failing_batches_are_stored_one_by_one(self):
+        """Test that a batch failing every flush is eventually stored row by row instead of retried forever."""
+        async def run():
+            writer = ChatMessageWriter(batch_size=100, interval=60)
+            with mock.patch('rpg_platform.apps.messages.writer.persist_messages', side_effect=OperationalError):
+                writer.add(ChatMessage(chat_room_id=self.room.pk, sender_id=self.alice.pk, content='Hail'))
+                writer.timer.cancel()
+                writer.timer = None
+
+                for _ in range(writer.attempts):
+                    await writer.flush()
+                    if writer.timer is not None:
+                        writer.timer.cancel()
+                        writer.timer = None
+
+            return await ChatMessage.objects.acount(), len(writer.pending), writer.failures
+
+        self.assertEqual(async_to_sync(run)(), (1, 0, 0))
+
+
+class ChatHistoryTests(TestCase):
+    """
+    Tests for the cursor-paginated history of a room.
+    """
+
+    def setUp(self):
+        """Set up a room with messages sharing timestamps."""
+        self.user = User.objects.create_user(username='alice', password='testpassword')
+        self.room = ChatRoom.objects.create(name='Tavern')
+        self.room.participants.add(self.user)
+
+        now = timezone.now()
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                chat_room=self.room, sender=self.user, content=f'Post {i}',
+                timestamp=now if i < 4 else now + timedelta(seconds=1)
+            )
+            for i in range(7)
+        ])
+        self.expected = list(
+            ChatMessage.objects.order_by('-timestamp', '-pk').values_list('pk', flat=True)
+        )
+
+    def test_pages_walk_back_through_history(self):
+        """Test that following cursors visits every message once, newest first."""
+        self.client.force_login(self.user)
+        url = reverse('messages:messages_api', kwargs={'pk': self.room.pk})
+
+        seen = []
+        params = {'limit': 3}
+        while True:
+            page = self.client.get(url, params).json()
+            seen.extend(message['id'] for message in page['messages'])
+            if not page['has_more']:
+                break
+            params['before'] = page['next_cursor']
+
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(self.client.get(url, {'before': 'nonsense'}).status_code, 404)
+
+    def test_only_participants_read_history(self):
+        """Test that the history of a room is hidden from other users."""
+        self.client.force_login(User.objects.create_user(username='eve', password='testpassword'))
+        response = self.client.get(reverse('messages:messages_api', kwargs={'pk': self.room.pk}))
+        self.assertEqual(response.status_code, 404)
+
+        for name in ('messages:room_detail', 'messages:room_detail_new'):
+            response = self.client.get(reverse(name, kwargs={'pk': self.room.pk}))
+            self.assertEqual(response.status_code, 404)
+
+
+class ChatRoomSummaryTests(TestCase):
+    """
+    Tests for room summaries and unread counts.
+    """
+
+    def setUp(self):
+        """Set up a room with two participants."""
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+        self.room = ChatRoom.objects.create(name='Tavern')
+        self.room.participants.add(self.alice, self.bob)
+
+    def unread(self, user):
+        return self.room.read_states.get(user=user).unread_count
+
+    def test_messages_update_summary_and_unread_counts(self):
+        """Test that each message counts as unread for the participants who didn't send it."""
+        ChatMessage.objects.create(chat_room=self.room, sender=self.alice, content='Hail')
+        last = ChatMessage.objects.create(chat_room=self.room, sender=self.bob, content='Well   met')
+
+        self.room.summary.refresh_from_db()
+        self.assertEqual(self.room.summary.message_count, 2)
+        self.assertEqual(self.room.summary.last_message_id, last.pk)
+        self.assertEqual(self.room.summary.last_message_preview, 'Well met')
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (1, 1))
+
+        mark_room_read(self.room.pk, self.alice.pk)
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertEqual(self.room.read_states.get(user=self.alice).last_read_message_id, last.pk)
+
+    def test_new_participants_start_with_nothing_unread(self):
+        """Test that joining a room doesn't count its earlier messages."""
+        ChatMessage.objects.create(chat_room=self.room, sender=self.alice, content='Hail')
+        carol = User.objects.create_user(username='carol', password='testpassword')
+        self.room.participants.add(carol)
+
+        self.assertEqual(self.unread(carol), 0)
+
+    def test_inbox_is_read_in_one_query(self):
+        """Test that the inbox rows of a user come from a single query."""
+        quiet = ChatRoom.objects.create(name='Library')
+        quiet.participants.add(self.bob)
+        ChatMessage.objects.create(chat_room=self.room, sender=self.alice, content='Hail')
+
+        with self.assertNumQueries(1):
+            rooms = [
+                (room.name, room.unread_count, room.last_sender_username, room.last_message_preview)
+                for room in inbox_rooms(self.bob)
+            ]
+
+        self.assertEqual(rooms, [('Tavern', 1, 'alice', 'Hail'), ('Library', 0, None, None)])
+
+
+class PrivateRoomTests(TestCase):
+    """
+    Tests for the private room of a pair of users.
+    """
+
+    def setUp(self):
+        """Set up two users."""
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+
+    def test_pair_has_one_room_whoever_opens_it(self):
+        """Test that both users of a pair get the same room, found with one query."""
+        room, created = ChatRoom.get_or_create_private(self.bob, self.alice)
+        self.assertTrue(created)
+        self.assertEqual((room.min_user, room.max_user), (self.alice, self.bob))
+        self.assertEqual(set(room.participants.all()), {self.alice, self.bob})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(ChatRoom.get_or_create_private(self.alice, self.bob), (room, False))
+
+    def test_view_redirects_to_existing_room(self):
+        """Test that opening a chat with a user twice leads to the same room."""
+        self.client.force_login(self.alice)
+        url = reverse('messages:create_private_room', kwargs={'username': 'bob'})
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(ChatRoom.objects.filter(room_type='private').count(), 1)
+        self.assertEqual(first.url, second.url)
+
+
+class ChatSearchTests(TestCase):
+    """
+    Tests for full-text search of chat history.
+    """
+
+    def setUp(self):
+        """Set up a room of two users and a room of somebody else."""
+        self.alice = User.objects.create_user(username='alice', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', password='testpassword')
+        self.tavern = ChatRoom.objects.create(name='Tavern')
+        self.tavern.participants.add(self.alice, self.bob)
+        self.keep = ChatRoom.objects.create(name='Keep')
+        self.keep.participants.add(self.bob)
+
+        ChatMessage.objects.create(chat_room=self.tavern, sender=self.bob, content='The <b>dragon</b> sleeps')
+        ChatMessage.objects.create(chat_room=self.keep, sender=self.bob, content='A dragon guards the keep')
+
+    def test_search_is_scoped_to_rooms_of_the_user(self):
+        """Test that users only find messages of their rooms, with escaped highlights."""
+        results, has_more = search_messages(self.alice, 'DRAGON')
+
+        self.assertFalse(has_more)
+        self.assertEqual([message.content for message in results], ['The <b>dragon</b> sleeps'])
+        self.assertEqual(results[0].snippet, 'The &lt;b&gt;<mark>dragon</mark>&lt;/b&gt; sleeps')
+
+        self.assertEqual(len(search_messages(self.bob, 'dragon')[0]), 2)
+        self.assertEqual(len(search_messages(self.bob, 'dragon', room_id=self.keep.pk)[0]), 1)
+        self.assertEqual(search_messages(self.alice, 'dragon', room_id=self.keep.pk), ([], False))
+
+    def test_batched_and_deleted_messages_are_indexed(self):
+        """Test that the index follows messages written in batches and deleted."""
+        persist_messages([
+            ChatMessage(chat_room=self.tavern, sender=self.alice, content=f'Roll {i} for the dragon')
+            for i in range(3)
+        ])
+        ChatMessage.objects.filter(content__startswith='The').delete()
+
+        first, has_more = search_messages(self.alice, 'dragon', limit=2)
+        second, _ = search_messages(self.alice, 'dragon', page=2, limit=2)
+
+        self.assertTrue(has_more)
+        self.assertEqual(len({message.pk for message in first + second}), 3)
+
+    def test_api_rejects_rooms_of_others(self):
+        """Test that searching a room needs taking part in it."""
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('messages:search_api'), {'q': '"dragon*'})
+        self.assertEqual([result['room_id'] for result in response.json()['results']], [self.tavern.pk])
+
+        response = self.client.get(reverse('messages:room_search_api', kwargs={'pk': self.keep.pk}), {'q': 'dragon'})
+        self.assertEqual(response.status_code, 404)
@@ -5,12 +5,15 @@ app_name = 'messages'
 
 urlpatterns = [
     path('rooms/', views.ChatRoomListView.as_view(), name='room_list'),
+    path('rooms/search/', views.search_api, name='search_api'),
     path('rooms/create/', views.ChatRoomCreateView.as_view(), name='room_create'),
     path('rooms/<int:pk>/', views.ChatRoomDetailView.as_view(), name='room_detail'),
     path('rooms/<int:pk>/new/', views.ChatRoomDetailNewView.as_view(), name='room_detail_new'),
     path('rooms/<int:pk>/update/', views.ChatRoomUpdateView.as_view(), name='room_update'),
     path('rooms/<int:pk>/delete/', views.ChatRoomDeleteView.as_view(), name='room_delete'),
     path('rooms/<int:pk>/send/', views.send_message, name='send_message'),
+    path('rooms/<int:pk>/messages/', views.messages_api, name='messages_api'),
+    path('rooms/<int:pk>/search/', views.search_api, name='room_search_api'),
     path('rooms/<int:pk>/agreements/', views.SceneBoundaryAgreementView.as_view(), name='scene_boundary_agreement'),
     path('rooms/<int:pk>/agreements/create/', views.SceneBoundaryFormView.as_view(), name='scene_boundary_create'),
 
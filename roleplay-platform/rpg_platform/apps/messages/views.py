@@ -4,12 +4,15 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy, reverse
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 
 from rpg_platform.apps.accounts.models import User
 from .models import ChatRoom, ChatMessage
+from . import search
+from .pagination import clamp_page_size, get_history_page, serialize_message
+from .summaries import inbox_rooms, mark_room_read
 
 # List view for chat rooms
 class ChatRoomListView(LoginRequiredMixin, ListView):
@@ -18,7 +21,7 @@ class ChatRoomListView(LoginRequiredMixin, ListView):
     context_object_name = 'rooms'
 
     def get_queryset(self):
-        return ChatRoom.objects.filter(participants=self.request.user)
+        return inbox_rooms(self.request.user).prefetch_related('participants')
 
 # Detail view for a chat room
 class ChatRoomDetailView(LoginRequiredMixin, DetailView):
@@ -26,9 +29,15 @@ class ChatRoomDetailView(LoginRequiredMixin, DetailView):
     template_name = 'messages/chatroom_detail.html'
     context_object_name = 'room'
 
+    def get_queryset(self):
+        # Rooms of other users are not found rather than forbidden
+        return ChatRoom.objects.filter(participants=self.request.user)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['messages'] = ChatMessage.objects.filter(chat_room=self.object).order_by('created_at')
+        # Only the most recent messages; older ones are fetched on scroll
+        context['initial_history'] = get_history_page(self.object, self.request.user)
+        mark_room_read(self.object.pk, self.request.user.pk)
         return context
 
 # New style detail view for a chat room
@@ -37,11 +46,62 @@ class ChatRoomDetailNewView(LoginRequiredMixin, DetailView):
     template_name = 'messages/chatroom_detail_new.html'
     context_object_name = 'room'
 
+    def get_queryset(self):
+        # Rooms of other users are not found rather than forbidden
+        return ChatRoom.objects.filter(participants=self.request.user)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['messages'] = ChatMessage.objects.filter(chat_room=self.object).order_by('created_at')
+        # Only the most recent messages; older ones are fetched on scroll
+        context['initial_history'] = get_history_page(self.object, self.request.user)
+        mark_room_read(self.object.pk, self.request.user.pk)
         return context
 
+# Page of a chat room's history, older than the ``before`` cursor
+@login_required
+def messages_api(request, pk):
+    room = get_object_or_404(ChatRoom, pk=pk, participants=request.user)
+
+    try:
+        page = get_history_page(
+            room,
+            request.user,
+            before=request.GET.get('before'),
+            limit=clamp_page_size(request.GET.get('limit'))
+        )
+    except ValueError:
+        raise Http404(_("Invalid cursor"))
+
+    return JsonResponse(page)
+
+# Messages matching a search, in all of the user's rooms or in one of them
+@login_required
+def search_api(request, pk=None):
+    if pk is not None:
+        get_object_or_404(ChatRoom, pk=pk, participants=request.user)
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    results, has_more = search.search_messages(
+        request.user,
+        request.GET.get('q', ''),
+        room_id=pk,
+        page=page,
+        limit=search.clamp_page_size(request.GET.get('limit'))
+    )
+
+    return JsonResponse({
+        'results': [
+            {**serialize_message(message, request.user), 'room_id': message.chat_room_id, 'snippet': message.snippet}
+            for message in results
+        ],
+        'page': page,
+        'has_more': has_more,
+    })
+
 # Create a new message in a chat room
 @login_required
 def send_message(request, pk):
@@ -53,7 +113,7 @@ def send_message(request, pk):
             message = ChatMessage.objects.create(
                 sender=request.user,
                 chat_room=room,
-                message=content
+                content=content
             )
             # Return JSON response for AJAX requests
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -62,8 +122,8 @@ def send_message(request, pk):
                     'message': {
                         'id': message.id,
                         'sender': message.sender.username,
-                        'content': message.message,
-                        'timestamp': message.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                        'content': message.content,
+                        'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
                     }
                 })
             return redirect('messages:room_detail', pk=pk)
@@ -132,32 +192,12 @@ def create_private_room(request, username):
             messages.error(request, _("You cannot create a chat room with yourself."))
             return redirect('dashboard:home')
 
-        # Check if a private room already exists between these users
-        existing_rooms = ChatRoom.objects.filter(
-            room_type='private',
-            participants=request.user
-        ).filter(
-            participants=other_user
-        ).distinct()
-
-        if existing_rooms.exists():
-            # Return the first existing room
-            return redirect('messages:room_detail', pk=existing_rooms.first().pk)
-
-        # Create a new private room
-        new_room = ChatRoom.objects.create(
-            name=f"Chat with {other_user.username}",
-            room_type='private'
-        )
-
-        # Add both users as participants
-        new_room.participants.add(request.user, other_user)
+        room, created = ChatRoom.get_or_create_private(request.user, other_user)
 
-        # Success message
-        messages.success(request, _(f"Chat room with {other_user.username} created successfully."))
+        if created:
+            messages.success(request, _(f"Chat room with {other_user.username} created successfully."))
 
-        # Redirect to the new room
-        return redirect('messages:room_detail', pk=new_room.pk)
+        return redirect('messages:room_detail', pk=room.pk)
 
     except Exception as e:
         messages.error(request, _(f"Error creating chat room: {str(e)}"))
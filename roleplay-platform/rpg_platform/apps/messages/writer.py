@@ -0,0 +1,134 @@
+"""
+Write-behind persistence of chat messages.
+
+The chat socket broadcasts a message to its room as soon as it arrives and
+hands the row to the ``ChatMessageWriter`` of its event loop, which inserts
+buffered messages with one ``bulk_create`` once ``CHAT_WRITE_BATCH_SIZE``
+messages are waiting or ``CHAT_WRITE_INTERVAL`` seconds after the first of
+them, and updates the summaries and unread counts of the rooms written to
+with a couple of UPDATEs per room, see ``summaries``.
+Flushes run one at a time, so messages are stored in the order they were
+sent. A batch that fails is retried with the next flush; after
+``CHAT_WRITE_ATTEMPTS`` failures in a row its messages are stored one by one
+and those that still fail are dropped, so one bad row or a lasting database
+error can't hold the buffer forever. Messages still buffered when the
+process dies are lost, so sockets flush when they disconnect.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .models import ChatMessage
+from .summaries import record_messages
+
+logger = logging.getLogger(__name__)
+
+# Buffered messages that trigger a flush
+DEFAULT_WRITE_BATCH_SIZE = 100
+
+# Seconds a message waits at most before being flushed
+DEFAULT_WRITE_INTERVAL = 0.2
+
+# Failed flushes in a row after which messages are stored one by one
+DEFAULT_WRITE_ATTEMPTS = 3
+
+_writers = {}
+
+
+def persist_messages(messages):
+    """Insert chat messages and update the summaries of the rooms they were sent to"""
+    try:
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+            record_messages(messages)
+        return
+    except IntegrityError:
+        pass
+
+    # A room or sender was deleted meanwhile; store the others one by one
+    persist_each(messages)
+
+
+def persist_each(messages, errors=IntegrityError):
+    """Insert chat messages one at a time, dropping those failing with ``errors``"""
+    for message in messages:
+        message.pk = None
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create([message])
+                record_messages([message])
+        except errors:
+            logger.warning(
+                f"Dropping chat message of user {message.sender_id} to room {message.chat_room_id}",
+                exc_info=True
+            )
+
+
+class ChatMessageWriter:
+    """
+    Buffer of chat messages waiting to be inserted, for one event loop
+    """
+
+    def __init__(self, batch_size=None, interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', DEFAULT_WRITE_BATCH_SIZE)
+        self.interval = interval if interval is not None else getattr(
+            settings, 'CHAT_WRITE_INTERVAL', DEFAULT_WRITE_INTERVAL
+        )
+        self.attempts = getattr(settings, 'CHAT_WRITE_ATTEMPTS', DEFAULT_WRITE_ATTEMPTS)
+        self.pending = []
+        self.failures = 0
+        self.timer = None
+        self.lock = asyncio.Lock()
+
+    def add(self, message):
+        """Buffer an unsaved ``ChatMessage``"""
+        self.pending.append(message)
+
+        if len(self.pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self.timer is None:
+            self.timer = asyncio.ensure_future(self.flush_after_interval())
+
+    async def flush_after_interval(self):
+        await asyncio.sleep(self.interval)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Insert everything buffered so far"""
+        async with self.lock:
+            messages, self.pending = self.pending, []
+            if not messages:
+                return
+
+            try:
+                await database_sync_to_async(persist_messages)(messages)
+            except Exception:
+                self.failures += 1
+                if self.failures < self.attempts:
+                    # Keep the messages for the next flush rather than losing them
+                    logger.exception(f"Storing {len(messages)} chat messages failed, retrying")
+                    self.pending[:0] = messages
+                    if self.timer is None:
+                        self.timer = asyncio.ensure_future(self.flush_after_interval())
+                    return
+
+                logger.exception(f"Storing {len(messages)} chat messages failed {self.failures} times, storing them one by one")
+                await database_sync_to_async(persist_each)(messages, errors=DatabaseError)
+
+            self.failures = 0
+
+
+def get_writer():
+    """Return the writer of the running event loop"""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        # Forget writers of event loops that were closed
+        for other in [other for other in _writers if other.is_closed()]:
+            del _writers[other]
+        writer = _writers[loop] = ChatMessageWriter()
+    return writer
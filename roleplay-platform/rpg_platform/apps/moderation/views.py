@@ -224,11 +224,8 @@ class CharacterListView(ModeratorRequiredMixin, ListView):
             elif privacy_status == 'private':
                 queryset = queryset.filter(public=False)
 
-        # Annotate with stats
+        # Annotate with stats; rating and comment counts are stored on the character
         queryset = queryset.annotate(
-            comment_count=Count('comments', distinct=True),
-            rating_count=Count('ratings', distinct=True),
-            avg_rating=Avg('ratings__rating'),
             report_count=Count('reports', distinct=True)
         )
 
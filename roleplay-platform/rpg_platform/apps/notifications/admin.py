@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 
-from .models import Notification, NotificationCategory, NotificationPreference
+from .models import (
+    Notification, NotificationCategory, NotificationOutbox, NotificationPreference, UnreadNotificationCounter
+)
 
 
 @admin.register(NotificationCategory)
@@ -62,3 +64,18 @@ class NotificationAdmin(admin.ModelAdmin):
             'classes': ('collapse',),
         }),
     )
+
+
+@admin.register(UnreadNotificationCounter)
+class UnreadNotificationCounterAdmin(admin.ModelAdmin):
+    list_display = ('user', 'category', 'unread')
+    list_filter = ('category',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'category', 'unread')
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'group', 'created_at', 'available_at', 'attempts', 'locked_by')
+    search_fields = ('group',)
+    readonly_fields = ('group', 'message', 'created_at', 'locked_at', 'locked_by', 'attempts', 'last_error')
@@ -0,0 +1,162 @@
+"""
+Aggregation of notifications about the same target.
+
+A popular character gets a rating or comment notification for every visitor.
+Instead of a new row each time, a notification of an aggregated type is
+folded into the user's unread notification of the same type and target
+from within the aggregation window, if there is one: the row is updated in
+place with the latest actor, a count of actors and a few sample actors in
+``extra_data``, and moves back to the top of the list. Clients are told
+with a ``new_notification`` event for the same id, which the notification
+socket coalesces with earlier events for that id.
+
+Row locks are not available on SQLite, so concurrent folds are kept apart
+without them: a notification that can be folded into holds an
+``aggregation_key``, unique among the user's unread notifications, so only
+one of two concurrent first notifications is created and the other is
+folded into it, and a fold is a conditional UPDATE on the ``created_at``
+it read, retried on the current row when another fold got there first.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Notification
+
+# Notification types folded per target
+DEFAULT_AGGREGATED_TYPES = ('character_like', 'character_rating', 'character_comment')
+
+# Seconds since the last activity on a notification during which it is folded into
+DEFAULT_AGGREGATION_WINDOW = 6 * 60 * 60
+
+# Most recent actors kept on an aggregated notification
+SAMPLE_ACTORS = 3
+
+# Folds lost to concurrent ones before a separate notification is created
+MAX_FOLD_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def get_aggregated_types():
+    return getattr(settings, 'NOTIFICATION_AGGREGATED_TYPES', DEFAULT_AGGREGATED_TYPES)
+
+
+def get_aggregation_window():
+    return timedelta(seconds=getattr(
+        settings, 'NOTIFICATION_AGGREGATION_WINDOW', DEFAULT_AGGREGATION_WINDOW
+    ))
+
+
+def is_aggregated(notification_type, kwargs):
+    """Whether a new notification can be folded into an earlier one"""
+    return (
+        notification_type in get_aggregated_types()
+        and kwargs.get('actor') is not None
+        and kwargs.get('action_object_id') is not None
+        and not kwargs.get('read', False)
+        and not kwargs.get('is_deleted', False)
+    )
+
+
+def actor_sample(actor):
+    return {'id': actor.pk, 'username': actor.username}
+
+
+def aggregation_key(notification_type, action_object_id):
+    """Key shared by the notifications folded together"""
+    return f"{notification_type}:{action_object_id}"
+
+
+def fold_actor(notification, actor):
+    """Return the ``extra_data`` of a notification with ``actor`` folded in"""
+    # Older notifications of these types don't have the aggregate yet
+    extra_data = notification.extra_data or {}
+    samples = extra_data.get('actors') or (
+        [{'id': notification.actor_id, 'username': notification.actor.username}] if notification.actor_id else []
+    )
+    actor_count = extra_data.get('actor_count', len(samples))
+
+    # An actor still among the samples is not counted twice
+    if all(sample['id'] != actor.pk for sample in samples):
+        actor_count += 1
+    samples = [actor_sample(actor)] + [sample for sample in samples if sample['id'] != actor.pk]
+
+    return {**extra_data, 'actor_count': actor_count, 'actors': samples[:SAMPLE_ACTORS]}
+
+
+def notify_aggregated(user, notification_type, verb, **kwargs):
+    """
+    Create a notification, or fold it into a recent one about the same target.
+
+    ``kwargs`` must already have its defaults applied. Returns the created
+    or updated notification.
+    """
+    from .changelog import record_changes
+
+    actor = kwargs['actor']
+    key = aggregation_key(notification_type, kwargs['action_object_id'])
+
+    new_extra_data = dict(kwargs.pop('extra_data', None) or {})
+    new_extra_data.update(actor_count=1, actors=[actor_sample(actor)])
+
+    for _ in range(MAX_FOLD_ATTEMPTS):
+        now = timezone.now()
+        existing = (
+            Notification.objects.select_related('actor')
+            .filter(user=user, aggregation_key=key, read=False, is_deleted=False)
+            .first()
+        )
+
+        if existing is not None and existing.created_at < now - get_aggregation_window():
+            # Too old to fold into, the new notification takes over the key
+            Notification.objects.filter(pk=existing.pk, created_at=existing.created_at).update(aggregation_key=None)
+            existing = None
+
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    return Notification.objects.create(
+                        user=user,
+                        notification_type=notification_type,
+                        verb=verb,
+                        extra_data=new_extra_data,
+                        aggregation_key=key,
+                        **kwargs
+                    )
+            except IntegrityError:
+                # Another notification about the target was created concurrently
+                continue
+
+        extra_data = fold_actor(existing, actor)
+        target_id = kwargs.get('target_id', existing.target_id)
+
+        with transaction.atomic():
+            # Only applies if no other fold, read or delete changed the row since it was read
+            folded = Notification.objects.filter(
+                pk=existing.pk, created_at=existing.created_at, read=False, is_deleted=False
+            ).update(actor=actor, target_id=target_id, created_at=now, extra_data=extra_data)
+            if not folded:
+                continue
+
+            existing.actor = actor
+            existing.target_id = target_id
+            existing.created_at = now
+            existing.extra_data = extra_data
+
+            version = record_changes(existing.user_id, 'created', [existing.pk])
+            existing.send_notification(version)
+
+        return existing
+
+    logger.warning(f"Creating a separate {notification_type} notification for user {user.pk} after losing {MAX_FOLD_ATTEMPTS} folds")
+    return Notification.objects.create(
+        user=user,
+        notification_type=notification_type,
+        verb=verb,
+        extra_data=new_extra_data,
+        **kwargs
+    )
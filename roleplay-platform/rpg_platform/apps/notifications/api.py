@@ -5,6 +5,7 @@ from rpg_platform.utils.api_views import BaseAPIView
 from rpg_platform.utils.serializers import BaseModelSerializer
 from rpg_platform.utils.permissions import IsOwnerOrReadOnly
 from .models import Notification, NotificationCategory
+from .pagination import NotificationKeysetPagination
 
 
 class NotificationSerializer(BaseModelSerializer):
@@ -44,15 +45,14 @@ class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsOwnerOrReadOnly]
+    # Pages are always newest first, so there is no ordering filter
+    pagination_class = NotificationKeysetPagination
     filter_backends = [
         DjangoFilterBackend,
         filters.SearchFilter,
-        filters.OrderingFilter,
     ]
     filterset_fields = ["notification_type", "category", "read"]
     search_fields = ["description", "verb"]
-    ordering_fields = ["created_at", "priority"]
-    ordering = ["-created_at"]
 
     def get_queryset(self):
         """
@@ -0,0 +1,92 @@
+"""
+Process-local caches of notification categories and preferences.
+
+Every new notification needs its category and the in-app preference of its
+user for that category. Both are kept in each process and reloaded when their
+version moves: the signal handlers in ``notifications.signals`` bump the
+version once a change commits. Versions are stored in the database, see
+``utils.cache``, so the process making the change picks it up on its next
+lookup and every other process, the outbox dispatcher and socket servers
+included, within ``CACHE_VERSION_CHECK_INTERVAL`` seconds.
+"""
+import threading
+
+from django.conf import settings
+
+from rpg_platform.utils.cache import LocalLRUCache, bump_version, get_version
+
+from .models import NotificationCategory, NotificationPreference
+
+CATEGORY_VERSION_KEY = "notifications:category_version"
+
+# Users whose preferences are kept in each process
+DEFAULT_PREFERENCE_CACHE_SIZE = 10000
+
+_lock = threading.Lock()
+_categories = None
+
+_preferences = LocalLRUCache(
+    getattr(settings, 'NOTIFICATION_PREFERENCE_CACHE_SIZE', DEFAULT_PREFERENCE_CACHE_SIZE)
+)
+
+
+def preference_version_key(user_id):
+    return f"notifications:preference_version:{user_id}"
+
+
+def get_categories():
+    """Return ``{key: category}`` for all categories, reloading them after changes"""
+    global _categories
+
+    version = get_version(CATEGORY_VERSION_KEY)
+    categories = _categories
+
+    if categories is None or categories[0] != version:
+        with _lock:
+            if _categories is categories:
+                _categories = (version, {category.key: category for category in NotificationCategory.objects.all()})
+            categories = _categories
+
+    return categories[1]
+
+
+def get_category(key):
+    """Return the category with a key, creating the default categories if it is missing"""
+    category = get_categories().get(key)
+
+    if category is None:
+        NotificationCategory.create_defaults()
+        category = NotificationCategory.objects.filter(key=key).first()
+
+    return category
+
+
+def ensure_default_categories():
+    """Create the default categories unless they all exist already"""
+    default_keys = {default['key'] for default in NotificationCategory.get_default_categories()}
+    if not default_keys <= get_categories().keys():
+        NotificationCategory.create_defaults()
+
+
+def invalidate_categories():
+    """Make every process reload the categories"""
+    bump_version(CATEGORY_VERSION_KEY)
+
+
+def get_in_app_preferences(user_id):
+    """Return ``{category_id: in_app}`` for the preferences a user has"""
+    key = (user_id, get_version(preference_version_key(user_id)))
+
+    preferences = _preferences.get(key)
+    if preferences is None:
+        preferences = dict(
+            NotificationPreference.objects.filter(user_id=user_id).values_list('category_id', 'in_app')
+        )
+        _preferences.set(key, preferences)
+
+    return preferences
+
+
+def invalidate_preferences(user_id):
+    """Make every process reload the preferences of a user"""
+    bump_version(preference_version_key(user_id))
@@ -0,0 +1,89 @@
+"""
+Per-user change log of notifications, for delta sync on reconnect.
+
+The methods of ``Notification`` that publish websocket events also log the
+change as ``NotificationChange`` rows in the same transaction, and include
+the id of the row in the event as the ``version``. A reconnecting client
+sends the last version it saw and gets only the notifications created, read
+and deleted since then, read with one range scan of the ``(user, id)``
+index, instead of a full reload. Hard deletes (admin, cascades, retention)
+are not logged.
+"""
+from django.conf import settings
+
+from .models import NotificationChange
+
+# Changes sent as a delta before a reconnecting client is resynced in full
+DEFAULT_DELTA_LIMIT = 500
+
+
+def get_delta_limit():
+    return getattr(settings, 'NOTIFICATION_DELTA_LIMIT', DEFAULT_DELTA_LIMIT)
+
+
+def record_changes(user_id, kind, notification_ids):
+    """Log a change of some notifications of a user, returns the new version"""
+    changes = NotificationChange.objects.bulk_create([
+        NotificationChange(user_id=user_id, notification_id=notification_id, kind=kind)
+        for notification_id in notification_ids
+    ])
+    return changes[-1].pk if changes else None
+
+
+def record_created(notifications, batch_size=1000):
+    """Log new notifications of any users, returns ``{notification_id: version}``"""
+    changes = NotificationChange.objects.bulk_create(
+        [
+            NotificationChange(user_id=notification.user_id, notification_id=notification.pk, kind='created')
+            for notification in notifications
+        ],
+        batch_size=batch_size
+    )
+    return {change.notification_id: change.pk for change in changes}
+
+
+def get_latest_version(user_id):
+    """Version of a user's notifications, 0 if nothing was logged"""
+    return NotificationChange.objects.filter(user_id=user_id).order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+
+
+def get_delta(user_id, since, limit=None):
+    """
+    Return the changes of a user's notifications after version ``since``.
+
+    The delta maps ``created``, ``read`` and ``deleted`` to notification ids
+    and ``version`` to the new version. Returns ``None`` when there are more
+    than ``limit`` changes, in which case a full resync is cheaper, or when
+    the entry of version ``since`` was removed by ``retention``, in which
+    case changes may be missing.
+    """
+    limit = limit or get_delta_limit()
+
+    # Versions are ids of the user's own entries, so the one of ``since`` is read too
+    rows = list(
+        NotificationChange.objects.filter(user_id=user_id, id__gte=since)
+        .order_by('id')
+        .values_list('id', 'notification_id', 'kind')[:limit + 2]
+    )
+    if since:
+        if not rows or rows[0][0] != since:
+            return None
+        rows = rows[1:]
+
+    if len(rows) > limit:
+        return None
+
+    changed = {'created': {}, 'read': {}, 'deleted': {}}
+    for _, notification_id, kind in rows:
+        changed[kind][notification_id] = None
+
+    # Notifications deleted since are only reported as deleted
+    deleted = changed['deleted']
+    return {
+        'version': rows[-1][0] if rows else since,
+        'created': [pk for pk in changed['created'] if pk not in deleted],
+        'read': [pk for pk in changed['read'] if pk not in deleted],
+        'deleted': list(deleted),
+    }
@@ -1,11 +1,16 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.utils import timezone
 
 User = get_user_model()
 
+# Seconds over which events for one socket are batched into a single frame
+DEFAULT_PUSH_WINDOW = 0.25
+
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for real-time notifications"""
@@ -14,6 +19,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """Connect to the WebSocket and join the user's notification group"""
         self.user = self.scope['user']
 
+        # Events waiting for the next coalesced push
+        self.pending_events = []
+        self.counts_stale = False
+        self.flush_task = None
+        self.push_window = getattr(settings, 'NOTIFICATION_PUSH_WINDOW', DEFAULT_PUSH_WINDOW)
+
         # Check if user is authenticated
         if self.user.is_anonymous:
             await self.close()
@@ -31,11 +42,14 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         # Accept the connection
         await self.accept()
 
-        # Send initial data to the client
-        await self.send_initial_data()
+        # Send initial data to the client, or what changed since it last saw
+        await self.send_initial_data(self.get_since_version())
 
     async def disconnect(self, close_code):
         """Leave the notification group on disconnect"""
+        if getattr(self, 'flush_task', None):
+            self.flush_task.cancel()
+
         if hasattr(self, 'notification_group_name'):
             await self.channel_layer.group_discard(
                 self.notification_group_name,
@@ -54,7 +68,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             await self.mark_all_as_read(category_id)
 
             # Send updated counts
-            await self.send_notification_counts()
+            self.schedule_push()
 
         elif message_type == 'mark_read':
             # Mark a specific notification as read
@@ -63,7 +77,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 await self.mark_notification_read(notification_id)
 
                 # Send updated counts
-                await self.send_notification_counts()
+                self.schedule_push()
 
         elif message_type == 'delete_notification':
             # Delete a specific notification
@@ -72,16 +86,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 await self.delete_notification(notification_id)
 
                 # Send updated counts
-                await self.send_notification_counts()
+                self.schedule_push()
 
         elif message_type == 'get_notifications':
             # Fetch notifications for a specific category
             category_id = data.get('category_id')
-            page = data.get('page', 1)
+            cursor = data.get('cursor')
             limit = data.get('limit', 10)
 
             # Fetch and send notifications
-            await self.send_notifications(category_id, page, limit)
+            await self.send_notifications(category_id, cursor, limit)
 
         elif message_type == 'get_notification_counts':
             # Send updated counts
@@ -89,47 +103,116 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
     async def new_notification(self, event):
         """Send notification to WebSocket when a new notification is created"""
-        # Forward the notification data to the client
-        await self.send(text_data=json.dumps({
+        # An aggregated notification updated again within the window is only
+        # sent once, with its latest data
+        notification_id = event['notification']['id']
+        self.pending_events = [
+            pending for pending in self.pending_events
+            if pending['type'] != 'new_notification' or pending['notification']['id'] != notification_id
+        ]
+
+        # Forward the notification data to the client with the next push
+        self.schedule_push({
             'type': 'new_notification',
-            'notification': event['notification']
-        }))
-
-        # Also send the updated unread count
-        await self.send_notification_counts()
+            'notification': event['notification'],
+            'version': event.get('version')
+        })
 
     async def notification_read(self, event):
         """Send notification read update to WebSocket"""
-        await self.send(text_data=json.dumps({
+        self.schedule_push({
             'type': 'notification_read',
-            'notification_id': event['notification_id']
-        }))
-
-        # Also send the updated unread count
-        await self.send_notification_counts()
+            'notification_id': event['notification_id'],
+            'version': event.get('version')
+        })
 
     async def notifications_marked_read(self, event):
         """Send notification when multiple notifications are marked as read"""
-        await self.send(text_data=json.dumps({
+        self.schedule_push({
             'type': 'notifications_marked_read',
-            'notification_ids': event['notification_ids']
-        }))
-
-        # Also send the updated unread count
-        await self.send_notification_counts()
+            'notification_ids': event['notification_ids'],
+            'version': event.get('version')
+        })
 
     async def notification_deleted(self, event):
         """Send notification when a notification is deleted"""
-        await self.send(text_data=json.dumps({
+        self.schedule_push({
             'type': 'notification_deleted',
-            'notification_id': event['notification_id']
-        }))
+            'notification_id': event['notification_id'],
+            'version': event.get('version')
+        })
+
+    def schedule_push(self, event=None):
+        """
+        Queue an event for the client and mark the unread counts as stale.
+
+        Everything queued within one push window is sent as a single frame
+        followed by the counts, which are recomputed once per window.
+        """
+        if event is not None:
+            self.pending_events.append(event)
+        self.counts_stale = True
+
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_after_window())
+
+    async def flush_after_window(self):
+        """Wait for the push window to close, then send everything queued"""
+        try:
+            await asyncio.sleep(self.push_window)
+        finally:
+            self.flush_task = None
+        await self.flush_pending()
 
-        # Also send the updated unread count
-        await self.send_notification_counts()
+    async def flush_pending(self):
+        """Send queued events and fresh counts in one frame"""
+        events, self.pending_events = self.pending_events, []
+
+        if self.counts_stale:
+            self.counts_stale = False
+            events.append(await self.get_notification_counts_event())
+
+        if not events:
+            return
+
+        if len(events) == 1:
+            await self.send(text_data=json.dumps(events[0]))
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'batch',
+                'events': events
+            }))
+
+    def get_since_version(self):
+        """Change log version the client last saw, from the ``since`` query parameter"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['since'][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def send_initial_data(self, since=None):
+        """
+        Send initial data when client connects.
+
+        A client that reconnects with the version it last saw only gets the
+        changes since then, unless there are too many of them.
+        """
+        if since is not None:
+            delta = await self.get_delta(since)
+            if delta is not None:
+                await self.send(text_data=json.dumps({'type': 'sync', 'full': False, **delta}))
+                if delta['created'] or delta['read'] or delta['deleted']:
+                    await self.send_notification_counts()
+                return
+
+        # Read the version first, so changes made while loading are resent
+        await self.send(text_data=json.dumps({
+            'type': 'sync',
+            'full': True,
+            'version': await self.get_latest_version()
+        }))
 
-    async def send_initial_data(self):
-        """Send initial data when client connects"""
         # Send notification counts
         await self.send_notification_counts()
 
@@ -141,71 +224,72 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         }))
 
         # Send recent notifications
-        await self.send_notifications(None, 1, 5)
+        await self.send_notifications(None, None, 5)
 
     async def send_notification_counts(self):
         """Send counts of unread notifications to the client"""
-        # Get total unread count
-        total_count = await self.get_unread_count()
+        await self.send(text_data=json.dumps(await self.get_notification_counts_event()))
 
-        # Get counts by category
-        category_counts = await self.get_unread_counts_by_category()
+    async def get_notification_counts_event(self):
+        """Build the unread counts message"""
+        # Total and per-category counts come from the same counter rows
+        total_count, category_counts = await self.get_notification_counts()
 
-        # Send the counts to the client
-        await self.send(text_data=json.dumps({
+        return {
             'type': 'notification_counts',
             'total_count': total_count,
             'category_counts': category_counts
-        }))
+        }
 
-    async def send_notifications(self, category_id, page, limit):
-        """Send notifications to the client, optionally filtered by category"""
-        notifications = await self.get_notifications(category_id, page, limit)
+    async def send_notifications(self, category_id, cursor, limit):
+        """Send a page of notifications to the client, optionally filtered by category"""
+        notifications = await self.get_notifications(category_id, cursor, limit)
 
         await self.send(text_data=json.dumps({
             'type': 'notifications_list',
             'notifications': notifications['results'],
-            'page': page,
-            'has_more': notifications['has_more'],
-            'total_pages': notifications['total_pages'],
-            'total_count': notifications['total_count'],
+            'cursor': cursor,
+            'next_cursor': notifications['next_cursor'],
+            'has_more': notifications['next_cursor'] is not None,
             'category_id': category_id
         }))
 
     @database_sync_to_async
-    def get_unread_count(self):
-        """Get count of unread notifications for the user"""
-        from .models import Notification
-        return Notification.get_unread_count(self.user)
+    def get_delta(self, since):
+        """Get the changes of the user's notifications after a version"""
+        from .changelog import get_delta
+        return get_delta(self.user.id, since)
 
     @database_sync_to_async
-    def get_unread_counts_by_category(self):
-        """Get counts of unread notifications by category"""
-        from .models import Notification, NotificationCategory
-
-        # Get all categories
-        categories = NotificationCategory.objects.all()
+    def get_latest_version(self):
+        """Get the version of the user's notifications"""
+        from .changelog import get_latest_version
+        return get_latest_version(self.user.id)
 
-        counts = {}
-        for category in categories:
-            counts[category.id] = Notification.get_unread_count(self.user, category)
+    @database_sync_to_async
+    def get_notification_counts(self):
+        """Get the total unread count and counts by category with one query"""
+        from .counters import get_unread_counts
 
-        return counts
+        counts = get_unread_counts(self.user)
+        total = sum(counts.values())
+        counts.pop(None, None)
+        return total, counts
 
     @database_sync_to_async
     def get_categories_with_counts(self):
         """Get notification categories with their unread counts"""
-        from .models import NotificationCategory, Notification
+        from .cache import ensure_default_categories, get_categories
+        from .counters import get_unread_counts
 
         # Ensure default categories exist
-        NotificationCategory.create_defaults()
+        ensure_default_categories()
 
-        categories = NotificationCategory.objects.all().order_by('order', 'name')
+        categories = sorted(get_categories().values(), key=lambda category: (category.order, category.name))
+        counts = get_unread_counts(self.user)
 
         results = []
         for category in categories:
-            count = Notification.get_unread_count(self.user, category)
-
             results.append({
                 'id': category.id,
                 'name': category.name,
@@ -213,7 +297,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'description': category.description,
                 'icon': category.icon,
                 'color': category.color,
-                'unread_count': count
+                'unread_count': counts.get(category.id, 0)
             })
 
         return results
@@ -265,28 +349,30 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return False
 
     @database_sync_to_async
-    def get_notifications(self, category_id=None, page=1, limit=10):
-        """Get notifications with pagination, optionally filtered by category"""
+    def get_notifications(self, category_id=None, cursor=None, limit=10):
+        """Get a page of notifications after ``cursor``, optionally filtered by category"""
         from .models import Notification
-        from django.core.paginator import Paginator
+        from .pagination import clamp_page_size, paginate_notifications
 
         # Start with non-deleted notifications for this user
         query = Notification.objects.filter(
             user=self.user,
             is_deleted=False
-        ).select_related('actor', 'category').order_by('-created_at')
+        ).select_related('actor', 'category')
 
         # Filter by category if provided
         if category_id:
             query = query.filter(category_id=category_id)
 
-        # Paginate the results
-        paginator = Paginator(query, limit)
-        current_page = paginator.get_page(page)
+        # Paginate the results, restarting from the top for unknown cursors
+        try:
+            current_page = paginate_notifications(query, cursor, clamp_page_size(limit, 10))
+        except ValueError:
+            current_page = paginate_notifications(query, None, clamp_page_size(limit, 10))
 
         # Convert notification objects to dict for JSON serialization
         results = []
-        for notification in current_page.object_list:
+        for notification in current_page:
             # Get actor data if available
             actor_data = None
             if notification.actor:
@@ -329,7 +415,5 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         return {
             'results': results,
-            'has_more': current_page.has_next(),
-            'total_pages': paginator.num_pages,
-            'total_count': paginator.count
+            'next_cursor': current_page.next_cursor
         }
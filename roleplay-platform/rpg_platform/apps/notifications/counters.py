@@ -0,0 +1,150 @@
+"""
+Materialized unread notification counters.
+
+Every change that makes a notification unread or stops it from being unread
+is applied as a relative UPDATE on the ``UnreadNotificationCounter`` row of
+its user and category, inside the same transaction as the change. Unread
+counts are then read from the user's counter rows with a single indexed
+query, however many notifications the user has.
+``reconcile_unread_counters`` recalculates the counters from scratch.
+"""
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+from .models import Notification, UnreadNotificationCounter
+
+User = get_user_model()
+
+
+def adjust_unread_counter(user_id, category_id, delta):
+    """Add ``delta`` to the unread counter of a user and category"""
+    if not delta:
+        return
+
+    counters = UnreadNotificationCounter.objects.filter(user_id=user_id, category_id=category_id)
+
+    if delta < 0:
+        # Never let a drifted counter fail the change; reconciling fixes drift
+        counters.update(unread=Greatest(F('unread') + delta, Value(0)))
+        return
+
+    if counters.update(unread=F('unread') + delta):
+        return
+
+    try:
+        with transaction.atomic():
+            UnreadNotificationCounter.objects.create(user_id=user_id, category_id=category_id, unread=delta)
+    except IntegrityError:
+        # Created concurrently by another change
+        counters.update(unread=F('unread') + delta)
+
+
+def increment_unread_counters(user_ids, category_id):
+    """Count one new unread notification of a category for each of ``user_ids``"""
+    counters = UnreadNotificationCounter.objects.filter(user_id__in=user_ids, category_id=category_id)
+    existing = set(counters.select_for_update().values_list('user_id', flat=True))
+
+    if existing:
+        counters.filter(user_id__in=existing).update(unread=F('unread') + 1)
+
+    missing = [user_id for user_id in user_ids if user_id not in existing]
+    try:
+        with transaction.atomic():
+            UnreadNotificationCounter.objects.bulk_create([
+                UnreadNotificationCounter(user_id=user_id, category_id=category_id, unread=1)
+                for user_id in missing
+            ])
+    except IntegrityError:
+        # Some were created concurrently, fall back to one upsert per user
+        for user_id in missing:
+            adjust_unread_counter(user_id, category_id, 1)
+
+
+def apply_counter_change(user_id, old_state, new_state):
+    """
+    Apply the change of one notification's counter state.
+
+    States are ``(counted, category_id)`` pairs as returned by
+    ``Notification.get_counter_state``; ``old_state`` is ``None`` for a new
+    notification.
+    """
+    if old_state == new_state:
+        return
+
+    if old_state and old_state[0]:
+        adjust_unread_counter(user_id, old_state[1], -1)
+    if new_state and new_state[0]:
+        adjust_unread_counter(user_id, new_state[1], 1)
+
+
+def get_unread_counts(user):
+    """
+    Return ``{category_id: unread}`` for a user, ``None`` for uncategorized.
+
+    Categories whose counter dropped back to zero are included, so clients
+    can clear their badges.
+    """
+    user_id = getattr(user, 'pk', user)
+    return dict(
+        UnreadNotificationCounter.objects.filter(user_id=user_id).values_list('category_id', 'unread')
+    )
+
+
+def compute_unread_counts(user_ids):
+    """Count unread notifications per ``(user_id, category_id)`` from the notifications table"""
+    rows = Notification.objects.filter(
+        user_id__in=user_ids, read=False, is_deleted=False
+    ).values('user_id', 'category_id').annotate(unread=Count('id')).order_by()
+
+    return {(row['user_id'], row['category_id']): row['unread'] for row in rows}
+
+
+def reconcile_unread_counters(user_ids=None, batch_size=1000):
+    """
+    Recalculate unread counters and fix those that drifted.
+
+    Returns the number of counters changed or created.
+    """
+    if user_ids is None:
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True).iterator()
+
+    fixed = 0
+    batch = []
+    for user_id in user_ids:
+        batch.append(user_id)
+        if len(batch) >= batch_size:
+            fixed += _reconcile_batch(batch)
+            batch = []
+    if batch:
+        fixed += _reconcile_batch(batch)
+
+    return fixed
+
+
+def _reconcile_batch(user_ids):
+    with transaction.atomic():
+        actual = compute_unread_counts(user_ids)
+        counters = {
+            (counter.user_id, counter.category_id): counter
+            for counter in UnreadNotificationCounter.objects.select_for_update().filter(user_id__in=user_ids)
+        }
+
+        changed = []
+        for key, counter in counters.items():
+            unread = actual.get(key, 0)
+            if counter.unread != unread:
+                counter.unread = unread
+                changed.append(counter)
+
+        created = [
+            UnreadNotificationCounter(user_id=user_id, category_id=category_id, unread=unread)
+            for (user_id, category_id), unread in actual.items()
+            if (user_id, category_id) not in counters
+        ]
+
+        UnreadNotificationCounter.objects.bulk_update(changed, ['unread'])
+        UnreadNotificationCounter.objects.bulk_create(created)
+
+    return len(changed) + len(created)
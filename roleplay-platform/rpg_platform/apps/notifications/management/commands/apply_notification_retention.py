@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.notifications.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = 'Purge deleted notifications, archive old read ones and compact the change log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows removed per transaction'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.05,
+            help='Seconds to sleep between batches, letting other writers in'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Directory of the archive segments (default: NOTIFICATION_ARCHIVE_DIR)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        results = apply_retention(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            directory=options['archive_dir'],
+        )
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {results['purged']} deleted and archived {results['archived']} read notifications, "
+            f"removed {results['compacted']} change log entries in {elapsed:.2f}s"
+        ))
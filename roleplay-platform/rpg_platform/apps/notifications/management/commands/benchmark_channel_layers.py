@@ -0,0 +1,122 @@
+import asyncio
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from rpg_platform.utils.channel_layers import SQLiteChannelLayer
+
+ECHO_CHANNEL = 'benchmark.echo'
+
+
+def echo_worker(path, count):
+    """Send every message received on the echo channel back to its sender"""
+    async def run():
+        layer = SQLiteChannelLayer(path=path)
+        for _ in range(count):
+            message = await layer.receive(ECHO_CHANNEL)
+            await layer.send(message['reply_to'], message)
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput and latency of the SQLite and in-memory channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Messages sent in the throughput test')
+        parser.add_argument('--group-size', type=int, default=100, help='Channels in the fan-out group')
+        parser.add_argument('--round-trips', type=int, default=200, help='Round trips in the latency tests')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / 'channels.sqlite3')
+            layers = {
+                'in-memory': lambda: InMemoryChannelLayer(capacity=options['messages']),
+                'sqlite': lambda: SQLiteChannelLayer(path=path, capacity=options['messages']),
+            }
+
+            for name, make_layer in layers.items():
+                results = asyncio.run(self.run_benchmarks(make_layer(), options))
+                self.stdout.write(self.style.SUCCESS(name))
+                for label, value in results:
+                    self.stdout.write(f"  {label:<28}{value}")
+
+            self.stdout.write(self.style.SUCCESS('sqlite, across processes'))
+            latencies = self.cross_process_latencies(path, options['round_trips'])
+            self.stdout.write(f"  {'round trip':<28}{self.format_latencies(latencies)}")
+
+    async def run_benchmarks(self, layer, options):
+        results = []
+
+        # Throughput on one channel
+        count = options['messages']
+        started = time.monotonic()
+        for i in range(count):
+            await layer.send('benchmark.throughput', {'type': 'benchmark', 'n': i})
+        sent = time.monotonic()
+        for _ in range(count):
+            await layer.receive('benchmark.throughput')
+        received = time.monotonic()
+        results.append(('send', f"{count / (sent - started):,.0f} msg/s"))
+        results.append(('receive', f"{count / (received - sent):,.0f} msg/s"))
+
+        # Fan-out to a group of process-specific channels
+        channels = [await layer.new_channel() for _ in range(options['group_size'])]
+        for channel in channels:
+            await layer.group_add('benchmark', channel)
+        started = time.monotonic()
+        await layer.group_send('benchmark', {'type': 'benchmark'})
+        await asyncio.gather(*(layer.receive(channel) for channel in channels))
+        elapsed = time.monotonic() - started
+        results.append((f"group of {len(channels)}", f"{elapsed * 1000:.1f} ms"))
+
+        # Latency of a round trip through an echo task
+        async def echo():
+            for _ in range(options['round_trips']):
+                message = await layer.receive(ECHO_CHANNEL)
+                await layer.send(message['reply_to'], message)
+
+        reply_to = await layer.new_channel()
+        echo_task = asyncio.ensure_future(echo())
+        latencies = []
+        for _ in range(options['round_trips']):
+            started = time.monotonic()
+            await layer.send(ECHO_CHANNEL, {'type': 'benchmark', 'reply_to': reply_to})
+            await layer.receive(reply_to)
+            latencies.append(time.monotonic() - started)
+        await echo_task
+        results.append(('round trip', self.format_latencies(latencies)))
+
+        await layer.flush()
+        return results
+
+    def cross_process_latencies(self, path, round_trips):
+        worker = multiprocessing.get_context('spawn').Process(target=echo_worker, args=(path, round_trips))
+        worker.start()
+
+        async def run():
+            layer = SQLiteChannelLayer(path=path)
+            reply_to = await layer.new_channel()
+            latencies = []
+            for _ in range(round_trips):
+                started = time.monotonic()
+                await layer.send(ECHO_CHANNEL, {'type': 'benchmark', 'reply_to': reply_to})
+                await layer.receive(reply_to)
+                latencies.append(time.monotonic() - started)
+            return latencies
+
+        try:
+            return asyncio.run(run())
+        finally:
+            worker.join()
+
+    def format_latencies(self, latencies):
+        latencies = sorted(latencies)
+        median = statistics.median(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        return f"median {median * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms"
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.notifications.outbox import dispatch_loop
+
+
+class Command(BaseCommand):
+    help = 'Send queued notification websocket events to the channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=0.1,
+            help='Seconds to sleep when the outbox is empty'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of events claimed at a time'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the outbox is drained instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting notification dispatcher")
+        dispatch_loop(
+            poll_interval=options['poll_interval'],
+            batch_size=options['batch_size'],
+            once=options['once'],
+        )
+        self.stdout.write(self.style.SUCCESS("Notification dispatcher stopped"))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.notifications.counters import reconcile_unread_counters
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the unread notification counters of users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', type=int,
+            help='Only reconcile these users (default: all users)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of users reconciled per transaction'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        fixed = reconcile_unread_counters(
+            options['user_ids'] or None,
+            batch_size=options['batch_size']
+        )
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed {fixed} unread notification counters in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,44 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.notifications.models import Notification
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Send a system notification to every active user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('verb', help='Announcement headline')
+        parser.add_argument('--description', default='', help='Announcement text')
+        parser.add_argument('--url', default='/', help='Link opened from the notification')
+        parser.add_argument(
+            '--priority', default='normal', choices=[value for value, _ in Notification.PRIORITY_LEVELS],
+            help='Notification priority'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of notifications inserted per query'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        user_ids = User.objects.filter(is_active=True).values_list('pk', flat=True)
+
+        notifications = Notification.bulk_notify(
+            user_ids,
+            'system',
+            options['verb'],
+            batch_size=options['batch_size'],
+            description=options['description'],
+            url=options['url'],
+            priority=options['priority'],
+        )
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {len(notifications)} notifications in {elapsed:.2f}s"
+        ))
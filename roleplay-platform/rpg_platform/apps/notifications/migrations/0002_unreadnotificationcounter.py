@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_unread_counters(apps, schema_editor):
+    from django.db.models import Count
+
+    Notification = apps.get_model('notifications', 'Notification')
+    UnreadNotificationCounter = apps.get_model('notifications', 'UnreadNotificationCounter')
+
+    rows = Notification.objects.filter(read=False, is_deleted=False).values(
+        'user_id', 'category_id'
+    ).annotate(unread=Count('id')).order_by()
+
+    UnreadNotificationCounter.objects.bulk_create(
+        [
+            UnreadNotificationCounter(user_id=row['user_id'], category_id=row['category_id'], unread=row['unread'])
+            for row in rows.iterator()
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadNotificationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread', models.PositiveIntegerField(default=0, verbose_name='Unread')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to='notifications.notificationcategory', verbose_name='Category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_notification_counters', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Unread Notification Counter',
+                'verbose_name_plural': 'Unread Notification Counters',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='unreadnotificationcounter',
+            constraint=models.UniqueConstraint(fields=('user', 'category'), name='unique_unread_counter'),
+        ),
+        migrations.AddConstraint(
+            model_name='unreadnotificationcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user',), name='unique_uncategorized_unread_counter'),
+        ),
+        migrations.RunPython(build_unread_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_unreadnotificationcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100, verbose_name='Group')),
+                ('message', models.JSONField(verbose_name='Message')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Available At')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Locked At')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='Locked By')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+            ],
+            options={
+                'verbose_name': 'Notification Outbox Event',
+                'verbose_name_plural': 'Notification Outbox',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['available_at', 'id'], name='notificatio_availab_491528_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'created_at', 'id'], name='notification_keyset_idx'),
+        ),
+    ]
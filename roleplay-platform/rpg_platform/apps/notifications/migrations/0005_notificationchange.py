@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0004_notification_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_id', models.PositiveBigIntegerField(verbose_name='Notification ID')),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('read', 'Read'), ('deleted', 'Deleted')], max_length=10, verbose_name='Kind')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_changes', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Notification Change',
+                'verbose_name_plural': 'Notification Changes',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='notificatio_user_id_23531f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+
+def set_aggregation_keys(apps, schema_editor):
+    """Let new notifications fold into the latest unread one about their target"""
+    from rpg_platform.apps.notifications.aggregation import aggregation_key, get_aggregated_types
+
+    Notification = apps.get_model('notifications', 'Notification')
+
+    seen = set()
+    keyed = []
+    for pk, user_id, notification_type, action_object_id in Notification.objects.filter(
+        notification_type__in=get_aggregated_types(),
+        action_object_id__isnull=False,
+        actor__isnull=False,
+        read=False,
+        is_deleted=False,
+    ).order_by('-created_at', '-id').values_list('pk', 'user_id', 'notification_type', 'action_object_id').iterator():
+        key = aggregation_key(notification_type, action_object_id)
+        if (user_id, key) not in seen:
+            seen.add((user_id, key))
+            keyed.append(Notification(pk=pk, aggregation_key=key))
+
+    Notification.objects.bulk_update(keyed, ['aggregation_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='aggregation_key',
+            field=models.CharField(blank=True, editable=False, help_text='Set while later notifications about the same target can be folded into this one', max_length=64, null=True, verbose_name='Aggregation Key'),
+        ),
+        migrations.RunPython(set_aggregation_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False), ('read', False)), fields=('user', 'aggregation_key'), name='notification_aggregation_key_unique'),
+        ),
+    ]
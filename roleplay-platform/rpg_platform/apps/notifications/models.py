@@ -1,10 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 import json
+from collections import Counter
 
 User = get_user_model()
 
@@ -176,6 +176,38 @@ class NotificationPreference(models.Model):
 
         return cls.objects.filter(user=user)
 
+    @staticmethod
+    def in_app_allows(in_app, priority):
+        """Check whether an in-app setting lets a notification of a priority through"""
+        if in_app == 'none':
+            return False
+        elif in_app == 'important' and priority != 'high':
+            return False
+
+        return True
+
+    @classmethod
+    def in_app_recipients(cls, user_ids, category, priority):
+        """
+        Return the ids among ``user_ids`` who want in-app notifications of a
+        category and priority, creating default preferences where missing.
+        """
+        in_app = dict(
+            cls.objects.filter(user_id__in=user_ids, category=category).values_list('user_id', 'in_app')
+        )
+
+        missing = [user_id for user_id in user_ids if user_id not in in_app]
+        cls.objects.bulk_create(
+            [cls(user_id=user_id, category=category) for user_id in missing],
+            ignore_conflicts=True
+        )
+
+        default = cls._meta.get_field('in_app').default
+        return [
+            user_id for user_id in user_ids
+            if cls.in_app_allows(in_app.get(user_id, default), priority)
+        ]
+
 
 class Notification(models.Model):
     """
@@ -239,15 +271,38 @@ class Notification(models.Model):
     read_at = models.DateTimeField(_('Read At'), null=True, blank=True)
     is_deleted = models.BooleanField(_('Deleted'), default=False)
     extra_data = models.JSONField(_('Extra Data'), default=dict, blank=True)
+    aggregation_key = models.CharField(
+        _('Aggregation Key'),
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Set while later notifications about the same target can be folded into this one')
+    )
 
     class Meta:
         verbose_name = _('Notification')
         verbose_name_plural = _('Notifications')
         ordering = ['-created_at']
+        constraints = [
+            # One notification to fold into per target, see ``aggregation``
+            models.UniqueConstraint(
+                fields=['user', 'aggregation_key'],
+                condition=Q(read=False, is_deleted=False),
+                name='notification_aggregation_key_unique'
+            ),
+        ]
         indexes = [
             models.Index(fields=['user', 'read']),
             models.Index(fields=['user', 'category']),
             models.Index(fields=['notification_type']),
+            # Keyset pagination of the lists, see ``pagination``. Partial
+            # rather than on is_deleted, which SQLite can't seek on
+            models.Index(
+                fields=['user', 'created_at', 'id'],
+                condition=Q(is_deleted=False),
+                name='notification_keyset_idx'
+            ),
         ]
 
     def __str__(self):
@@ -255,25 +310,62 @@ class Notification(models.Model):
             return f"{self.actor.username} {self.verb}"
         return f"System: {self.verb}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember how the loaded row counts towards the unread counters
+        instance._counter_state = instance.get_counter_state()
+        return instance
+
+    def get_counter_state(self):
+        """Return whether the notification counts as unread, and in which category"""
+        return (not self.read and not self.is_deleted, self.category_id)
+
     def save(self, *args, **kwargs):
         """
-        Override save to send WebSocket notification on create
+        Override save to queue a WebSocket notification on create
         """
+        from .changelog import record_changes
+        from .counters import apply_counter_change, reconcile_unread_counters
+
         is_new = self.pk is None
 
         # If category is not set, try to infer from notification_type
         if is_new and not self.category:
             self.set_category_from_type()
 
-        # Save the object
-        super().save(*args, **kwargs)
+        # Save the object and its unread counter change together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            new_state = self.get_counter_state()
+            if is_new:
+                old_state = None
+            elif hasattr(self, '_counter_state'):
+                old_state = self._counter_state
+            else:
+                # Saved without being loaded first, so the previous state is unknown
+                old_state = new_state
+                reconcile_unread_counters([self.user_id])
+
+            apply_counter_change(self.user_id, old_state, new_state)
 
-        # Send WebSocket notification for new notifications
-        if is_new:
-            self.send_notification()
+            # Log and queue a WebSocket notification for new notifications
+            if is_new:
+                version = record_changes(self.user_id, 'created', [self.pk])
+                self.send_notification(version)
+
+        self._counter_state = new_state
 
     def set_category_from_type(self):
         """Set the category based on notification type"""
+        category = self.category_for_type(self.notification_type)
+        if category:
+            self.category = category
+
+    @classmethod
+    def category_for_type(cls, notification_type):
+        """Return the category notifications of a type belong to"""
         type_to_category = {
             'message': 'messages',
             'friend_request': 'friends',
@@ -287,31 +379,40 @@ class Notification(models.Model):
             'moderation': 'moderation',
         }
 
-        category_key = type_to_category.get(self.notification_type, 'system')
+        from .cache import get_category
 
-        try:
-            self.category = NotificationCategory.objects.get(key=category_key)
-        except NotificationCategory.DoesNotExist:
-            # If category doesn't exist, try to create defaults
-            NotificationCategory.create_defaults()
-            try:
-                self.category = NotificationCategory.objects.get(key=category_key)
-            except NotificationCategory.DoesNotExist:
-                pass
+        return get_category(type_to_category.get(notification_type, 'system'))
 
-    def send_notification(self):
+    def send_notification(self, version=None):
         """
-        Send a real-time notification via WebSockets.
+        Queue a real-time notification via WebSockets in the outbox.
         Also check user preferences to see if notification should be sent.
+        ``version`` is the change log version of the new notification.
         """
+        from .outbox import enqueue_event
+
         # Check user preferences for this notification
         if not self.should_send_notification():
             return
 
-        channel_layer = get_channel_layer()
+        # Send to the user's notification group
+        enqueue_event(
+            f'notifications_{self.user_id}',
+            {
+                'type': 'new_notification',
+                'notification': self.get_websocket_data(),
+                'version': version
+            }
+        )
+
+    @property
+    def other_actors_count(self):
+        """Actors of an aggregated notification besides the latest one"""
+        return max((self.extra_data or {}).get('actor_count', 1) - 1, 0)
 
-        # Prepare notification data
-        notification_data = {
+    def get_websocket_data(self):
+        """Notification data sent to the user's websocket clients"""
+        return {
             'id': self.pk,
             'type': self.notification_type,
             'category': {
@@ -333,79 +434,75 @@ class Notification(models.Model):
             'priority': self.priority,
             'created_at': self.created_at.isoformat(),
             'read': self.read,
+            'other_actors_count': self.other_actors_count,
             'extra_data': self.extra_data
         }
 
-        # Send to the user's notification group
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{self.user.id}',
-            {
-                'type': 'new_notification',
-                'notification': notification_data
-            }
-        )
-
     def should_send_notification(self):
         """Check if notification should be sent based on user preferences"""
+        from .cache import get_in_app_preferences, invalidate_preferences
+
         if not self.category:
             return True
 
-        try:
-            # Get user preference for this category
-            preference = NotificationPreference.objects.get(
-                user=self.user,
-                category=self.category
-            )
-
-            # Check in-app notification setting
-            if preference.in_app == 'none':
-                return False
-            elif preference.in_app == 'important' and self.priority != 'high':
-                return False
+        # Check the in-app setting of the user's preference for this category
+        in_app = get_in_app_preferences(self.user_id).get(self.category_id)
+        if in_app is not None:
+            return NotificationPreference.in_app_allows(in_app, self.priority)
 
-            return True
-
-        except NotificationPreference.DoesNotExist:
-            # If no preference exists, create default and return True
-            NotificationPreference.get_or_create_for_user(self.user, self.category)
-            return True
+        # If no preference exists, create default and return True
+        NotificationPreference.objects.get_or_create(user_id=self.user_id, category=self.category)
+        invalidate_preferences(self.user_id)
+        return True
 
     def mark_as_read(self):
-        """Mark the notification as read and send WebSocket update"""
+        """Mark the notification as read and queue a WebSocket update"""
+        from .changelog import record_changes
+        from .outbox import enqueue_event
+
         if not self.read:
-            self.read = True
-            self.read_at = timezone.now()
-            self.save(update_fields=['read', 'read_at'])
-
-            # Send WebSocket update
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f'notifications_{self.user.id}',
-                {
-                    'type': 'notification_read',
-                    'notification_id': self.pk
-                }
-            )
+            with transaction.atomic():
+                self.read = True
+                self.read_at = timezone.now()
+                self.save(update_fields=['read', 'read_at'])
+                version = record_changes(self.user_id, 'read', [self.pk])
+
+                # Queue WebSocket update
+                enqueue_event(
+                    f'notifications_{self.user_id}',
+                    {
+                        'type': 'notification_read',
+                        'notification_id': self.pk,
+                        'version': version
+                    }
+                )
 
     def delete_notification(self):
         """Mark notification as deleted (soft delete)"""
-        self.is_deleted = True
-        self.save(update_fields=['is_deleted'])
+        from .changelog import record_changes
+        from .outbox import enqueue_event
 
-        # Send WebSocket update
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{self.user.id}',
-            {
-                'type': 'notification_deleted',
-                'notification_id': self.pk
-            }
-        )
+        with transaction.atomic():
+            self.is_deleted = True
+            self.save(update_fields=['is_deleted'])
+            version = record_changes(self.user_id, 'deleted', [self.pk])
+
+            # Queue WebSocket update
+            enqueue_event(
+                f'notifications_{self.user_id}',
+                {
+                    'type': 'notification_deleted',
+                    'notification_id': self.pk,
+                    'version': version
+                }
+            )
 
     @classmethod
     def mark_all_as_read(cls, user, category=None):
         """Mark all unread notifications for a user as read"""
-        from django.utils import timezone
+        from .changelog import record_changes
+        from .counters import adjust_unread_counter
+        from .outbox import enqueue_event
 
         now = timezone.now()
 
@@ -416,49 +513,45 @@ class Notification(models.Model):
         if category:
             query = query.filter(category=category)
 
-        # Update all notifications
-        query.update(read=True, read_at=now)
-
-        # Get the notification IDs to send WebSocket updates
-        notification_ids = list(query.values_list('id', flat=True))
-
-        # Send WebSocket updates
-        if notification_ids:
-            channel_layer = get_channel_layer()
-
-            # Send a bulk update message instead of individual messages
-            async_to_sync(channel_layer.group_send)(
-                f'notifications_{user.id}',
-                {
-                    'type': 'notifications_marked_read',
-                    'notification_ids': notification_ids
-                }
-            )
+        with transaction.atomic():
+            # Lock the rows first so counters drop by exactly what was updated
+            rows = list(query.select_for_update().values_list('id', 'category_id'))
+            notification_ids = [row[0] for row in rows]
+
+            # Update all notifications
+            cls.objects.filter(id__in=notification_ids).update(read=True, read_at=now)
+
+            read_by_category = Counter(row[1] for row in rows)
+            for category_id, count in read_by_category.items():
+                adjust_unread_counter(user.id, category_id, -count)
+
+            # Queue a bulk update message instead of individual messages
+            if notification_ids:
+                version = record_changes(user.id, 'read', notification_ids)
+                enqueue_event(
+                    f'notifications_{user.id}',
+                    {
+                        'type': 'notifications_marked_read',
+                        'notification_ids': notification_ids,
+                        'version': version
+                    }
+                )
 
     @classmethod
     def get_unread_count(cls, user, category=None):
         """Get the count of unread notifications for a user"""
-        query = cls.objects.filter(user=user, read=False, is_deleted=False)
+        from .counters import get_unread_counts
+
+        counts = get_unread_counts(user)
 
         if category:
-            query = query.filter(category=category)
+            return counts.get(category.id, 0)
 
-        return query.count()
+        return sum(counts.values())
 
     @classmethod
-    def create_notification(cls, user, notification_type, verb, **kwargs):
-        """
-        Factory method to create a notification with proper defaults
-
-        Args:
-            user (User): The user to notify
-            notification_type (str): Type of notification
-            verb (str): Action verb
-            **kwargs: Additional notification attributes
-
-        Returns:
-            Notification: The created notification instance
-        """
+    def apply_defaults(cls, notification_type, kwargs):
+        """Fill in the priority and URL of new notification attributes"""
         # Determine priority based on notification type if not provided
         if 'priority' not in kwargs:
             priority_map = {
@@ -511,6 +604,30 @@ class Notification(models.Model):
 
             kwargs['url'] = url
 
+    @classmethod
+    def create_notification(cls, user, notification_type, verb, **kwargs):
+        """
+        Factory method to create a notification with proper defaults
+
+        Args:
+            user (User): The user to notify
+            notification_type (str): Type of notification
+            verb (str): Action verb
+            **kwargs: Additional notification attributes
+
+        Notifications of the aggregated types are folded into a recent
+        unread notification about the same target, see ``aggregation``.
+
+        Returns:
+            Notification: The created or updated notification instance
+        """
+        from .aggregation import is_aggregated, notify_aggregated
+
+        cls.apply_defaults(notification_type, kwargs)
+
+        if is_aggregated(notification_type, kwargs):
+            return notify_aggregated(user, notification_type, verb, **kwargs)
+
         # Create the notification
         return cls.objects.create(
             user=user,
@@ -518,3 +635,176 @@ class Notification(models.Model):
             verb=verb,
             **kwargs
         )
+
+    @classmethod
+    def bulk_notify(cls, users, notification_type, verb, batch_size=1000, **kwargs):
+        """
+        Create the same notification for many users at once
+
+        The category, defaults and preferences are resolved once for all
+        recipients, and rows and their websocket events are inserted with
+        ``bulk_create``.
+
+        Args:
+            users: Users or user ids to notify
+            notification_type (str): Type of notification
+            verb (str): Action verb
+            batch_size (int): Rows inserted per query
+            **kwargs: Additional notification attributes
+
+        Returns:
+            list: The created notification instances
+        """
+        from .changelog import record_created
+        from .counters import increment_unread_counters
+        from .outbox import enqueue_events
+
+        cls.apply_defaults(notification_type, kwargs)
+        if 'category' not in kwargs:
+            kwargs['category'] = cls.category_for_type(notification_type)
+        category = kwargs['category']
+
+        # Deduplicate while keeping the caller's order
+        user_ids = list(dict.fromkeys(getattr(user, 'pk', user) for user in users))
+        counted = not kwargs.get('read', False) and not kwargs.get('is_deleted', False)
+
+        notifications = []
+        with transaction.atomic():
+            for start in range(0, len(user_ids), batch_size):
+                batch_ids = user_ids[start:start + batch_size]
+                notifications.extend(cls.objects.bulk_create([
+                    cls(user_id=user_id, notification_type=notification_type, verb=verb, **kwargs)
+                    for user_id in batch_ids
+                ]))
+                if counted:
+                    increment_unread_counters(batch_ids, category.id if category else None)
+
+            recipients = set(user_ids)
+            if category:
+                recipients = set()
+                for start in range(0, len(user_ids), batch_size):
+                    recipients.update(NotificationPreference.in_app_recipients(
+                        user_ids[start:start + batch_size], category, kwargs['priority']
+                    ))
+
+            versions = record_created(notifications, batch_size=batch_size)
+            enqueue_events(
+                [
+                    (f'notifications_{notification.user_id}', {
+                        'type': 'new_notification',
+                        'notification': notification.get_websocket_data(),
+                        'version': versions[notification.pk]
+                    })
+                    for notification in notifications
+                    if notification.user_id in recipients
+                ],
+                batch_size=batch_size
+            )
+
+        return notifications
+
+
+class UnreadNotificationCounter(models.Model):
+    """
+    Number of unread, not deleted notifications of a user in a category
+
+    Maintained by ``Notification.save`` and ``Notification.mark_all_as_read``
+    so unread counts are read from a few rows instead of counted. The
+    ``reconcile_notification_counters`` command recalculates them.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='unread_notification_counters',
+        verbose_name=_('User')
+    )
+    category = models.ForeignKey(
+        NotificationCategory,
+        on_delete=models.CASCADE,
+        related_name='unread_counters',
+        verbose_name=_('Category'),
+        null=True,
+        blank=True
+    )
+    unread = models.PositiveIntegerField(_('Unread'), default=0)
+
+    class Meta:
+        verbose_name = _('Unread Notification Counter')
+        verbose_name_plural = _('Unread Notification Counters')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_unread_counter'),
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=Q(category__isnull=True),
+                name='unique_uncategorized_unread_counter'
+            ),
+        ]
+
+    def __str__(self):
+        category = self.category.name if self.category else _('Uncategorized')
+        return f"{self.user.username} - {category}: {self.unread}"
+
+
+class NotificationChange(models.Model):
+    """
+    Entry of a user's notification change log
+
+    The id of the latest entry is the version of the user's notifications,
+    so clients that reconnect with the version they last saw are sent only
+    the changes after it. Written in the same transaction as the change.
+    """
+    KINDS = [
+        ('created', _('Created')),
+        ('read', _('Read')),
+        ('deleted', _('Deleted')),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='notification_changes',
+        verbose_name=_('User')
+    )
+    notification_id = models.PositiveBigIntegerField(_('Notification ID'))
+    kind = models.CharField(_('Kind'), max_length=10, choices=KINDS)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Notification Change')
+        verbose_name_plural = _('Notification Changes')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: notification {self.notification_id} {self.kind}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    WebSocket event waiting to be sent to a channel layer group
+
+    Written in the same transaction as the change it announces, so events of
+    rolled back changes are never sent, and drained by the
+    ``dispatch_notification_outbox`` command.
+    """
+    group = models.CharField(_('Group'), max_length=100)
+    message = models.JSONField(_('Message'))
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+    available_at = models.DateTimeField(_('Available At'), default=timezone.now)
+    locked_at = models.DateTimeField(_('Locked At'), null=True, blank=True)
+    locked_by = models.CharField(_('Locked By'), max_length=100, blank=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last Error'), blank=True)
+
+    class Meta:
+        verbose_name = _('Notification Outbox Event')
+        verbose_name_plural = _('Notification Outbox')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.message.get('type')} -> {self.group}"
@@ -0,0 +1,214 @@
+"""
+Transactional outbox for notification websocket events.
+
+Model methods never talk to the channel layer themselves: they write the
+events they want to send as ``NotificationOutbox`` rows in the same
+transaction as the change, so events of rolled back changes are never
+published and request threads never wait on channel layer I/O. The
+``dispatch_notification_outbox`` command drains the outbox in batches and
+retries failed sends with exponential backoff.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+# Channel layer sends in flight at once while draining a batch
+DEFAULT_SEND_CONCURRENCY = 500
+
+# Seconds after which a batch claimed by a dispatcher is considered abandoned
+DEFAULT_LOCK_TIMEOUT = 60
+
+# Events failing more often than this are dropped
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def get_lock_timeout():
+    return timedelta(seconds=getattr(
+        settings, 'NOTIFICATION_OUTBOX_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT
+    ))
+
+
+def get_max_attempts():
+    return getattr(settings, 'NOTIFICATION_OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+
+def default_dispatcher_id():
+    """Identifier stored on events claimed by this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_event(group, message):
+    """Queue a message for a channel layer group, in the current transaction"""
+    NotificationOutbox.objects.create(group=group, message=message)
+
+
+def enqueue_events(events, batch_size=1000):
+    """Queue many ``(group, message)`` pairs, in the current transaction"""
+    NotificationOutbox.objects.bulk_create(
+        [NotificationOutbox(group=group, message=message) for group, message in events],
+        batch_size=batch_size
+    )
+
+
+def claim_events(dispatcher_id, limit=500):
+    """
+    Lock up to ``limit`` due events for this dispatcher, oldest first.
+
+    Claiming is a single conditional UPDATE, so several dispatchers can drain
+    the same table without sending an event twice. Events of a group are
+    sent in order: an event is not claimed while an earlier one of its group
+    is held by another dispatcher or waits for a retry.
+    """
+    now = timezone.now()
+    unlocked = Q(locked_at__isnull=True) | Q(locked_at__lt=now - get_lock_timeout())
+
+    # Earlier events of the same group that this claim can't take along
+    held = NotificationOutbox.objects.filter(
+        group=OuterRef('group'), pk__lt=OuterRef('pk')
+    ).filter(
+        (~unlocked & ~Q(locked_at=now, locked_by=dispatcher_id)) | Q(available_at__gt=now)
+    )
+    claimable = unlocked & ~Exists(held)
+
+    candidates = list(
+        NotificationOutbox.objects.filter(claimable, available_at__lte=now)
+        .order_by('pk')
+        .values_list('pk', flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+
+    NotificationOutbox.objects.filter(claimable, pk__in=candidates).update(
+        locked_at=now, locked_by=dispatcher_id
+    )
+
+    return list(
+        NotificationOutbox.objects.filter(pk__in=candidates, locked_at=now, locked_by=dispatcher_id)
+        .order_by('pk')
+    )
+
+
+def send_events(events, channel_layer=None):
+    """
+    Send outbox events to the channel layer.
+
+    Groups are sent to concurrently, but the events of one group keep their
+    order: after a failure the rest of that group's events in the batch wait
+    for the failed one to be retried. Returns ``(sent, failed)`` where ``failed`` maps events to the
+    exception they raised.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    by_group = {}
+    for event in events:
+        by_group.setdefault(event.group, []).append(event)
+
+    sent = []
+    failed = {}
+
+    async def send_all():
+        semaphore = asyncio.Semaphore(getattr(
+            settings, 'NOTIFICATION_OUTBOX_SEND_CONCURRENCY', DEFAULT_SEND_CONCURRENCY
+        ))
+
+        async def send_group(group, group_events):
+            for event in group_events:
+                try:
+                    async with semaphore:
+                        await channel_layer.group_send(group, event.message)
+                except Exception as e:
+                    failed[event] = e
+                    return
+                sent.append(event)
+
+        await asyncio.gather(*(send_group(group, group_events) for group, group_events in by_group.items()))
+
+    async_to_sync(send_all)()
+    return sent, failed
+
+
+def fail_event(event, error):
+    """
+    Release a failed event for a retry with exponential backoff, or drop it.
+
+    Returns when the event will be retried, ``None`` if it was dropped.
+    """
+    attempts = event.attempts + 1
+
+    if attempts >= get_max_attempts():
+        logger.error(f"Dropping notification event for {event.group} after {attempts} attempts: {error}")
+        NotificationOutbox.objects.filter(pk=event.pk).delete()
+        return None
+
+    available_at = timezone.now() + timedelta(seconds=2 ** attempts)
+    NotificationOutbox.objects.filter(pk=event.pk).update(
+        locked_at=None,
+        locked_by='',
+        attempts=attempts,
+        last_error=str(error)[:2000],
+        available_at=available_at
+    )
+    return available_at
+
+
+def dispatch_outbox(dispatcher_id=None, limit=500, channel_layer=None):
+    """
+    Claim and send a batch of due events.
+
+    Returns the number of events claimed.
+    """
+    dispatcher_id = dispatcher_id or default_dispatcher_id()
+    events = claim_events(dispatcher_id, limit=limit)
+    if not events:
+        return 0
+
+    sent, failed = send_events(events, channel_layer)
+    done = {event.pk for event in sent} | {event.pk for event in failed}
+
+    NotificationOutbox.objects.filter(pk__in=[event.pk for event in sent]).delete()
+    for event, error in failed.items():
+        logger.warning(f"Sending notification event to {event.group} failed: {error}")
+        retry_at = fail_event(event, error) or timezone.now()
+
+        # Events held back behind the failure are retried after it
+        NotificationOutbox.objects.filter(
+            pk__in=[other.pk for other in events if other.group == event.group and other.pk not in done]
+        ).update(locked_at=None, locked_by='', available_at=retry_at)
+
+    return len(events)
+
+
+def dispatch_loop(poll_interval=0.1, batch_size=500, once=False):
+    """Drain the outbox to the channel layer until interrupted"""
+    from django.db import close_old_connections
+
+    dispatcher_id = default_dispatcher_id()
+    logger.info(f"Notification dispatcher {dispatcher_id} started")
+
+    try:
+        while True:
+            close_old_connections()
+            dispatched = dispatch_outbox(dispatcher_id, limit=batch_size)
+
+            if once and not dispatched:
+                break
+
+            # Keep draining while there is work, otherwise back off
+            if not dispatched:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+    logger.info(f"Notification dispatcher {dispatcher_id} stopped")
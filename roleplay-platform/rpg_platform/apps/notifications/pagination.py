@@ -0,0 +1,162 @@
+"""
+Keyset pagination of notification lists.
+
+Pages are ordered newest first by ``(created_at, id)`` and a page is found by
+filtering on the position of the last row of the previous page instead of
+counting and skipping rows, so with the ``(user, created_at, id)`` index of
+not deleted notifications every page costs one short index range read however
+deep it is.
+Positions are handed to clients as opaque cursors.
+"""
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Notifications per page when the client doesn't ask for a size
+DEFAULT_PAGE_SIZE = 20
+
+# Largest page a client may ask for
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage:
+    """
+    One page of notifications with the cursors of its neighbours
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(notification, reverse=False):
+    """Cursor of the page after (or, if ``reverse``, before) a notification"""
+    position = f"{'p' if reverse else 'n'}|{notification.created_at.isoformat()}|{notification.pk}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return ``(reverse, created_at, id)`` from a cursor.
+
+    Raises ``ValueError`` for cursors that were not made by ``encode_cursor``.
+    """
+    try:
+        direction, created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    if created_at is None or direction not in ('n', 'p'):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    return direction == 'p', created_at, pk
+
+
+def clamp_page_size(limit, default=DEFAULT_PAGE_SIZE):
+    """Page size asked for by a client, within ``1..MAX_PAGE_SIZE``"""
+    try:
+        return max(1, min(int(limit), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def paginate_notifications(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return the ``KeysetPage`` of ``queryset`` at ``cursor``, newest first.
+
+    Without a cursor the first page is returned. Raises ``ValueError`` for
+    invalid cursors.
+    """
+    reverse = False
+    if cursor:
+        reverse, created_at, pk = decode_cursor(cursor)
+        # The inclusive bound on created_at alone is what the index seeks on
+        if reverse:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(pk__gt=pk), created_at__gte=created_at)
+        else:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(pk__lt=pk), created_at__lte=created_at)
+
+    ordering = ('created_at', 'pk') if reverse else ('-created_at', '-pk')
+
+    # One extra row tells whether there is a page beyond this one
+    items = list(queryset.order_by(*ordering)[:limit + 1])
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    if reverse:
+        items.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(cursor), has_more
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if items and has_older else None,
+        previous_cursor=encode_cursor(items[0], reverse=True) if items and has_newer else None,
+    )
+
+
+class NotificationKeysetPagination(BasePagination):
+    """
+    DRF pagination of notifications with ``cursor`` and ``limit`` parameters
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = clamp_page_size(request.query_params.get(self.page_size_query_param), DEFAULT_PAGE_SIZE)
+
+        try:
+            self.page = paginate_notifications(
+                queryset, request.query_params.get(self.cursor_query_param), limit
+            )
+        except ValueError:
+            raise NotFound('Invalid cursor')
+
+        return self.page.items
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.page.next_cursor)),
+            ('previous', self.get_link(self.page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
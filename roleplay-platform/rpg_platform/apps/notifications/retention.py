@@ -0,0 +1,184 @@
+"""
+Retention of notifications and their change log.
+
+Three passes, each run in short batches of one transaction so no lock is
+held for long:
+
+* soft-deleted notifications are hard-deleted once they are
+  ``NOTIFICATION_DELETED_RETENTION_DAYS`` old;
+* read notifications older than the TTL of their category, or else of their
+  priority, are written to a gzipped JSON lines segment file under
+  ``NOTIFICATION_ARCHIVE_DIR`` and then removed from the table;
+* change log entries older than ``NOTIFICATION_CHANGE_RETENTION_DAYS`` are
+  removed. Clients that reconnect with a version from before that get a
+  full resync instead of a delta.
+
+Unread notifications are never removed, so the unread counters don't change.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Notification, NotificationCategory, NotificationChange
+
+# Days read notifications are kept, by priority
+DEFAULT_RETENTION_DAYS = {'low': 30, 'normal': 90, 'high': 180}
+
+# Days read notifications of these category keys are kept, overriding the priority
+DEFAULT_CATEGORY_RETENTION_DAYS = {}
+
+# Days soft-deleted notifications are kept before being hard-deleted
+DEFAULT_DELETED_RETENTION_DAYS = 7
+
+# Days change log entries are kept for delta sync
+DEFAULT_CHANGE_RETENTION_DAYS = 30
+
+
+def get_archive_dir():
+    return Path(getattr(
+        settings, 'NOTIFICATION_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'notifications'
+    ))
+
+
+def days_ago(days, now=None):
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archivable_filter(now=None):
+    """
+    Return the ``Q`` matching read notifications past their TTL.
+
+    A category's TTL, if it has one, wins over the TTL of the priority.
+    """
+    retention_days = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    category_days = getattr(settings, 'NOTIFICATION_CATEGORY_RETENTION_DAYS', DEFAULT_CATEGORY_RETENTION_DAYS)
+
+    categories = dict(
+        NotificationCategory.objects.filter(key__in=category_days).values_list('id', 'key')
+    )
+
+    expired = Q(pk__in=[])
+    for category_id, key in categories.items():
+        expired |= Q(category_id=category_id, created_at__lt=days_ago(category_days[key], now))
+    for priority, days in retention_days.items():
+        expired |= Q(priority=priority, created_at__lt=days_ago(days, now)) & ~Q(category_id__in=categories)
+
+    return Q(read=True, is_deleted=False) & expired
+
+
+def write_segment(rows, directory=None):
+    """
+    Write notification rows to a gzipped JSON lines segment file.
+
+    Segments are named after the first and last id they hold and written to
+    a temporary file first, so a segment file is always complete. Returns
+    its path.
+    """
+    directory = Path(directory or get_archive_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+
+    path = directory / f"notifications-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.jsonl.gz"
+    temporary = path.with_name(path.name + '.tmp')
+
+    with gzip.open(temporary, 'wt', encoding='utf-8') as segment:
+        for row in rows:
+            segment.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+    os.replace(temporary, path)
+
+    return path
+
+
+def read_segment(path):
+    """Return the notification rows of an archive segment"""
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        return [json.loads(line) for line in segment]
+
+
+def run_in_batches(step, batch_size, pause):
+    """
+    Call ``step(after, limit)`` until it handles fewer than ``limit`` rows.
+
+    ``step`` returns the ids it handled, in order; the next batch starts
+    after the last of them, so rows kept by earlier batches are not scanned
+    again. Returns the total number of rows handled.
+    """
+    total = 0
+    after = 0
+    while True:
+        ids = step(after, batch_size)
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+        after = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def purge_deleted(batch_size=1000, pause=0, now=None):
+    """Hard-delete old soft-deleted notifications, returns how many"""
+    cutoff = days_ago(getattr(
+        settings, 'NOTIFICATION_DELETED_RETENTION_DAYS', DEFAULT_DELETED_RETENTION_DAYS
+    ), now)
+
+    def step(after, limit):
+        with transaction.atomic():
+            ids = list(
+                Notification.objects.filter(is_deleted=True, created_at__lt=cutoff, pk__gt=after)
+                .order_by('pk').values_list('pk', flat=True)[:limit]
+            )
+            Notification.objects.filter(pk__in=ids).delete()
+        return ids
+
+    return run_in_batches(step, batch_size, pause)
+
+
+def archive_read(batch_size=1000, pause=0, now=None, directory=None):
+    """Move read notifications past their TTL to archive segments, returns how many"""
+    expired = archivable_filter(now)
+
+    def step(after, limit):
+        with transaction.atomic():
+            rows = list(Notification.objects.filter(expired, pk__gt=after).order_by('pk').values()[:limit])
+            ids = [row['id'] for row in rows]
+            if rows:
+                write_segment(rows, directory)
+                Notification.objects.filter(pk__in=ids).delete()
+        return ids
+
+    return run_in_batches(step, batch_size, pause)
+
+
+def compact_changes(batch_size=1000, pause=0, now=None):
+    """Remove old change log entries, returns how many"""
+    cutoff = days_ago(getattr(
+        settings, 'NOTIFICATION_CHANGE_RETENTION_DAYS', DEFAULT_CHANGE_RETENTION_DAYS
+    ), now)
+
+    def step(after, limit):
+        ids = list(
+            NotificationChange.objects.filter(created_at__lt=cutoff, pk__gt=after)
+            .order_by('pk').values_list('pk', flat=True)[:limit]
+        )
+        NotificationChange.objects.filter(pk__in=ids).delete()
+        return ids
+
+    return run_in_batches(step, batch_size, pause)
+
+
+def apply_retention(batch_size=1000, pause=0, now=None, directory=None):
+    """Run every retention pass, returns ``{pass: rows}``"""
+    now = now or timezone.now()
+    return {
+        'purged': purge_deleted(batch_size, pause, now),
+        'archived': archive_read(batch_size, pause, now, directory),
+        'compacted': compact_changes(batch_size, pause, now),
+    }
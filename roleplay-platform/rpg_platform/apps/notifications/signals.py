@@ -1,9 +1,12 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
 from rpg_platform.apps.accounts.models import FriendRequest
-from rpg_platform.apps.notifications.models import Notification
+from rpg_platform.apps.notifications.cache import invalidate_categories, invalidate_preferences
+from rpg_platform.apps.notifications.counters import apply_counter_change
+from rpg_platform.apps.notifications.models import Notification, NotificationCategory, NotificationPreference
 
 User = get_user_model()
 
@@ -21,3 +24,30 @@ def create_friend_request_notification(sender, instance, created, **kwargs):
             verb='sent you a friend request',
             action_object_id=instance.id
         )
+
+
+@receiver(post_delete, sender=Notification)
+def update_unread_counter_on_delete(sender, instance, **kwargs):
+    """
+    Uncount a hard-deleted notification that was still unread
+    """
+    apply_counter_change(instance.user_id, instance.get_counter_state(), None)
+
+
+@receiver(post_save, sender=NotificationCategory)
+@receiver(post_delete, sender=NotificationCategory)
+def invalidate_category_cache(sender, instance, **kwargs):
+    """
+    Reload the cached categories in every process once the change commits
+    """
+    transaction.on_commit(invalidate_categories)
+
+
+@receiver(post_save, sender=NotificationPreference)
+@receiver(post_delete, sender=NotificationPreference)
+def invalidate_preference_cache(sender, instance, **kwargs):
+    """
+    Reload the cached preferences of the user once the change commits
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_preferences(user_id))
@@ -0,0 +1,532 @@
+import asyncio
+import json
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from rpg_platform.apps.core.models import CacheVersion
+from rpg_platform.utils.channel_layers import SQLiteChannelLayer
+
+from .cache import get_categories, preference_version_key
+from .changelog import get_delta
+from .consumers import NotificationConsumer
+from .counters import get_unread_counts, reconcile_unread_counters
+from .models import (
+    Notification, NotificationCategory, NotificationChange, NotificationOutbox, NotificationPreference,
+    UnreadNotificationCounter
+)
+from .outbox import claim_events, dispatch_outbox
+from .pagination import paginate_notifications
+from .retention import apply_retention, read_segment
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class UnreadCounterTests(TestCase):
+    """
+    Tests for the materialized unread notification counters.
+    """
+
+    def setUp(self):
+        """Set up a user and the default categories."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.friends = NotificationCategory.objects.get(key='friends')
+        self.system = NotificationCategory.objects.get(key='system')
+
+    def notify(self, notification_type='friend_request'):
+        return Notification.create_notification(self.user, notification_type, 'did something')
+
+    def test_counters_follow_notification_changes(self):
+        """Test that creating, reading and deleting notifications keeps counters exact."""
+        first, second, third = self.notify(), self.notify(), self.notify('system')
+        self.assertEqual(get_unread_counts(self.user), {self.friends.id: 2, self.system.id: 1})
+
+        Notification.objects.get(pk=first.pk).mark_as_read()
+        Notification.objects.get(pk=third.pk).delete_notification()
+        second.delete()
+
+        self.assertEqual(get_unread_counts(self.user), {self.friends.id: 0, self.system.id: 0})
+        self.assertEqual(Notification.get_unread_count(self.user), 0)
+
+    def test_mark_all_as_read_by_category(self):
+        """Test that marking a category as read only clears that category."""
+        self.notify()
+        self.notify()
+        self.notify('system')
+
+        Notification.mark_all_as_read(self.user, self.friends)
+
+        self.assertEqual(Notification.get_unread_count(self.user, self.friends), 0)
+        self.assertEqual(Notification.get_unread_count(self.user), 1)
+
+    def test_steady_state_creation_reads_nothing(self):
+        """Test that cached categories and preferences leave only the writes of a new notification."""
+        self.notify()
+        self.notify()
+        with self.assertNumQueries(6):
+            # The notification, its counter, its change log row and its event
+            self.notify()
+
+        # Changed preferences are reloaded once and then honoured
+        preference = NotificationPreference.objects.get(user=self.user, category=self.friends)
+        preference.in_app = 'none'
+        with self.captureOnCommitCallbacks(execute=True):
+            preference.save()
+        self.notify()
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+
+    def test_preferences_changed_by_other_processes(self):
+        """Test that a preference changed and bumped by another process is honoured here."""
+        self.notify()
+
+        # Another process saves the preference and bumps its shared version
+        NotificationPreference.objects.filter(user=self.user, category=self.friends).update(in_app='none')
+        CacheVersion.objects.filter(key=preference_version_key(self.user.id)).update(version=F('version') + 1)
+
+        # This process reads the version again once its check interval is over
+        cache.delete(preference_version_key(self.user.id))
+        self.notify()
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+    def test_reconcile_fixes_drift(self):
+        """Test that reconciling recalculates counters changed behind the model's back."""
+        self.notify()
+        self.notify('system')
+        Notification.objects.filter(category=self.system).update(read=True)
+        UnreadNotificationCounter.objects.filter(category=self.friends).delete()
+
+        self.assertEqual(reconcile_unread_counters([self.user.id]), 2)
+        self.assertEqual(get_unread_counts(self.user), {self.friends.id: 1, self.system.id: 0})
+        self.assertEqual(reconcile_unread_counters(), 0)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BulkNotifyTests(TestCase):
+    """
+    Tests for notifying many users at once.
+    """
+
+    def setUp(self):
+        """Set up recipients, one of whom muted system notifications."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.system = NotificationCategory.objects.get(key='system')
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword') for i in range(5)]
+        NotificationPreference.objects.create(user=self.users[0], category=self.system, in_app='none')
+
+    def test_bulk_notify(self):
+        """Test that rows, counters, preferences and websocket events are handled in bulk."""
+        channel_layer = get_channel_layer()
+        channels = [async_to_sync(channel_layer.new_channel)() for _ in self.users]
+        for user, channel in zip(self.users, channels):
+            async_to_sync(channel_layer.group_add)(f'notifications_{user.id}', channel)
+
+        # The number of queries does not depend on the number of recipients
+        get_categories()
+        with self.assertNumQueries(11):
+            notifications = Notification.bulk_notify(
+                self.users + [self.users[1]], 'system', 'Maintenance tonight'
+            )
+
+        self.assertEqual(len(notifications), 5)
+        self.assertTrue(all(n.pk and n.created_at for n in notifications))
+        self.assertEqual(Notification.get_unread_count(self.users[3]), 1)
+        self.assertEqual(NotificationPreference.objects.filter(category=self.system).count(), 5)
+
+        self.assertEqual(dispatch_outbox(), 4)
+        received = async_to_sync(channel_layer.receive)(channels[1])
+        self.assertEqual(received['notification']['verb'], 'Maintenance tonight')
+        self.assertNotIn(channels[0], channel_layer.channels)
+
+
+@override_settings(NOTIFICATION_PUSH_WINDOW=0.05, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationConsumerTests(TransactionTestCase):
+    """
+    Tests for the coalesced pushes of the notification consumer.
+    """
+
+    def setUp(self):
+        """Set up a user with a connected socket."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+
+    async def connect(self, path='/ws/notifications/', initial_frames=4):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), path)
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        # Version, counts, categories and recent notifications
+        frames = [json.loads(await communicator.receive_from()) for _ in range(initial_frames)]
+        self.frames = frames
+        return communicator
+
+    def test_burst_is_sent_as_one_frame(self):
+        """Test that a burst of events produces one frame with one count update."""
+        async def run():
+            communicator = await self.connect()
+            channel_layer = get_channel_layer()
+            for notification_id in range(1, 4):
+                await channel_layer.group_send(f'notifications_{self.user.id}', {
+                    'type': 'notification_read',
+                    'notification_id': notification_id
+                })
+
+            frame = json.loads(await communicator.receive_from(timeout=1))
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(run)()
+
+        self.assertEqual(frame['type'], 'batch')
+        self.assertEqual(
+            [event['type'] for event in frame['events']],
+            ['notification_read'] * 3 + ['notification_counts']
+        )
+
+
+    def test_reconnect_receives_delta(self):
+        """Test that a client reconnecting with its version only gets what changed."""
+        first = Notification.create_notification(self.user, 'system', 'Before')
+
+        async def run(path, initial_frames):
+            communicator = await self.connect(path, initial_frames)
+            await communicator.disconnect()
+            return self.frames
+
+        frames = async_to_sync(run)('/ws/notifications/', 4)
+        self.assertEqual(frames[0]['type'], 'sync')
+        self.assertTrue(frames[0]['full'])
+        version = frames[0]['version']
+
+        second = Notification.create_notification(self.user, 'system', 'While away')
+        Notification.objects.get(pk=first.pk).mark_as_read()
+        Notification.objects.get(pk=second.pk).delete_notification()
+
+        with self.assertNumQueries(2):
+            frames = async_to_sync(run)(f'/ws/notifications/?since={version}', 2)
+
+        self.assertFalse(frames[0]['full'])
+        self.assertEqual(frames[0]['created'], [])
+        self.assertEqual(frames[0]['read'], [first.pk])
+        self.assertEqual(frames[0]['deleted'], [second.pk])
+        self.assertEqual(frames[1]['total_count'], 0)
+
+        frames = async_to_sync(run)(f'/ws/notifications/?since={frames[0]["version"]}', 1)
+        self.assertEqual(frames[0]['created'] + frames[0]['read'] + frames[0]['deleted'], [])
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """
+    Tests for the channel layer shared by the processes of a host.
+    """
+
+    def setUp(self):
+        """Set up two layers sharing one database, as two processes would."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'channels.sqlite3'
+        self.first = SQLiteChannelLayer(path=path, capacity=2)
+        self.second = SQLiteChannelLayer(path=path, capacity=2)
+
+    def test_groups_and_capacity_are_shared(self):
+        """Test that group members and full channels are seen by every layer."""
+        async def run():
+            members = [await self.first.new_channel(), await self.second.new_channel()]
+            for channel in members:
+                await self.first.group_add('room', channel)
+            await self.second.group_send('room', {'type': 'hello'})
+            received = await asyncio.gather(self.first.receive(members[0]), self.second.receive(members[1]))
+
+            await self.first.group_discard('room', members[0])
+            await self.second.group_send('room', {'type': 'again'})
+            again = await self.second.receive(members[1])
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.first.receive(members[0]), 0.1)
+
+            await self.first.send('worker', {'type': 'job'})
+            await self.first.send('worker', {'type': 'job'})
+            with self.assertRaises(ChannelFull):
+                await self.second.send('worker', {'type': 'job'})
+            return received, again
+
+        received, again = async_to_sync(run)()
+
+        self.assertEqual(received, [{'type': 'hello'}, {'type': 'hello'}])
+        self.assertEqual(again, {'type': 'again'})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationOutboxTests(TestCase):
+    """
+    Tests for the transactional outbox of websocket events.
+    """
+
+    def setUp(self):
+        """Set up a user listening on their notification group."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.channel_layer = get_channel_layer()
+        self.channel = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(f'notifications_{self.user.id}', self.channel)
+
+    def test_events_of_rolled_back_changes_are_not_sent(self):
+        """Test that events are only queued by committed changes."""
+        notification = Notification.create_notification(self.user, 'system', 'Hello')
+        try:
+            with transaction.atomic():
+                notification.mark_as_read()
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(dispatch_outbox(), 1)
+        received = async_to_sync(self.channel_layer.receive)(self.channel)
+        self.assertEqual(received['type'], 'new_notification')
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_failed_sends_are_retried_in_order(self):
+        """Test that a failed event and the ones queued after it wait for a retry."""
+        class BrokenLayer:
+            async def group_send(self, group, message):
+                raise ConnectionError('channel layer is down')
+
+        notification = Notification.create_notification(self.user, 'system', 'Hello')
+        Notification.objects.get(pk=notification.pk).mark_as_read()
+
+        with self.assertLogs('rpg_platform.apps.notifications.outbox', 'WARNING'):
+            self.assertEqual(dispatch_outbox(channel_layer=BrokenLayer()), 2)
+
+        events = list(NotificationOutbox.objects.all())
+        self.assertEqual(events[0].attempts, 1)
+        self.assertEqual(events[1].attempts, 0)
+        self.assertTrue(all(event.available_at == events[0].available_at for event in events))
+        self.assertEqual(dispatch_outbox(), 0)
+
+    def test_later_batches_wait_for_a_failed_event_of_their_group(self):
+        """Test that an event is not claimed while an earlier one of its group waits for a retry."""
+        class BrokenLayer:
+            async def group_send(self, group, message):
+                raise ConnectionError('channel layer is down')
+
+        other = User.objects.create_user(username='other', password='testpassword')
+        notification = Notification.create_notification(self.user, 'system', 'Hello')
+        Notification.objects.get(pk=notification.pk).mark_as_read()
+        Notification.create_notification(other, 'system', 'Hello')
+        first, later, other_event = NotificationOutbox.objects.all()
+
+        with self.assertLogs('rpg_platform.apps.notifications.outbox', 'WARNING'):
+            self.assertEqual(dispatch_outbox(limit=1, channel_layer=BrokenLayer()), 1)
+
+        self.assertEqual(claim_events('second-dispatcher'), [other_event])
+        later.refresh_from_db()
+        self.assertIsNone(later.locked_at)
+
+        # Once the failed event is due again its group is claimed in order
+        NotificationOutbox.objects.filter(pk=first.pk).update(available_at=timezone.now())
+        self.assertEqual(claim_events('second-dispatcher'), [first, later])
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Tests for cursor pagination of notification lists.
+    """
+
+    def setUp(self):
+        """Set up a user with notifications sharing creation times."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        for i in range(7):
+            Notification.create_notification(self.user, 'system', f'Notification {i}')
+        # Ties on created_at are broken by id
+        Notification.objects.filter(user=self.user).update(created_at=timezone.now())
+        self.queryset = Notification.objects.filter(user=self.user, is_deleted=False)
+        self.expected = list(self.queryset.order_by('-id').values_list('id', flat=True))
+
+    def test_pages_walk_forward_and_back(self):
+        """Test that next and previous cursors visit every notification once."""
+        seen = []
+        cursors = []
+        page = paginate_notifications(self.queryset, None, 3)
+        while True:
+            seen.extend(notification.id for notification in page)
+            if not page.has_next:
+                break
+            cursors.append(page.next_cursor)
+            page = paginate_notifications(self.queryset, page.next_cursor, 3)
+
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(cursors), 2)
+
+        previous = paginate_notifications(self.queryset, page.previous_cursor, 3)
+        self.assertEqual([notification.id for notification in previous], self.expected[3:6])
+        self.assertTrue(previous.has_previous)
+
+    def test_api_uses_cursors(self):
+        """Test that the DRF endpoint pages with cursors."""
+        self.client.force_login(self.user)
+
+        response = self.client.get('/notifications/api/notifications/', {'limit': 5})
+        self.assertEqual([item['id'] for item in response.json()['results']], self.expected[:5])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([item['id'] for item in response.json()['results']], self.expected[5:])
+        self.assertIsNone(response.json()['next'])
+
+
+@override_settings(NOTIFICATION_AGGREGATION_WINDOW=3600)
+class NotificationAggregationTests(TestCase):
+    """
+    Tests for folding notifications about the same target into one.
+    """
+
+    def setUp(self):
+        """Set up a character owner and some fans."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.owner = User.objects.create_user(username='owner', password='testpassword')
+        self.fans = [User.objects.create_user(username=f'fan{i}', password='testpassword') for i in range(5)]
+
+    def rate(self, fan, character_id=7):
+        return Notification.create_notification(
+            self.owner, 'character_like', 'rated your character', actor=fan, action_object_id=character_id
+        )
+
+    def test_same_target_is_folded_in_place(self):
+        """Test that notifications about one target update a single row."""
+        first = self.rate(self.fans[0])
+        for fan in self.fans[1:] + [self.fans[4]]:
+            notification = self.rate(fan)
+        self.rate(self.fans[0], character_id=8)
+
+        self.assertEqual(notification.pk, first.pk)
+        self.assertEqual(Notification.objects.filter(user=self.owner).count(), 2)
+        self.assertEqual(Notification.get_unread_count(self.owner), 2)
+
+        notification = Notification.objects.get(pk=first.pk)
+        self.assertEqual(notification.actor, self.fans[4])
+        self.assertEqual(notification.other_actors_count, 4)
+        self.assertEqual(
+            [actor['username'] for actor in notification.extra_data['actors']], ['fan4', 'fan3', 'fan2']
+        )
+
+    def test_read_or_old_notifications_are_not_folded_into(self):
+        """Test that a new row starts once the last one was read or left the window."""
+        first = self.rate(self.fans[0])
+        Notification.objects.get(pk=first.pk).mark_as_read()
+        second = self.rate(self.fans[1])
+        Notification.objects.filter(pk=second.pk).update(created_at=timezone.now() - timedelta(hours=2))
+        third = self.rate(self.fans[2])
+
+        self.assertEqual(len({first.pk, second.pk, third.pk}), 3)
+        self.assertEqual(Notification.get_unread_count(self.owner), 2)
+
+
+    def test_concurrent_folds_are_retried(self):
+        """Test that a fold losing to a concurrent one is applied to the current row."""
+        first = self.rate(self.fans[0])
+        stale = Notification.objects.get(pk=first.pk)
+        self.rate(self.fans[1])
+
+        current = Notification.objects.select_related('actor').get(pk=first.pk)
+
+        # The fold first reads the row as it was before the other fold committed
+        with mock.patch('rpg_platform.apps.notifications.aggregation.Notification.objects.select_related') as select:
+            select.return_value.filter.return_value.first.side_effect = [stale, current]
+            self.rate(self.fans[2])
+
+        notification = Notification.objects.get(pk=first.pk)
+        self.assertEqual(notification.extra_data['actor_count'], 3)
+        self.assertEqual(Notification.objects.filter(user=self.owner).count(), 1)
+
+    def test_concurrent_first_notifications_are_not_duplicated(self):
+        """Test that a second row for the same target is refused and folded instead."""
+        first = self.rate(self.fans[0])
+
+        current = Notification.objects.select_related('actor').get(pk=first.pk)
+
+        # The fold first misses the row created by a concurrent request
+        with mock.patch('rpg_platform.apps.notifications.aggregation.Notification.objects.select_related') as select:
+            select.return_value.filter.return_value.first.side_effect = [None, current]
+            notification = self.rate(self.fans[1])
+
+        self.assertEqual(notification.pk, first.pk)
+        self.assertEqual(Notification.objects.get(pk=first.pk).extra_data['actor_count'], 2)
+        self.assertEqual(Notification.get_unread_count(self.owner), 1)
+
+
+class NotificationRetentionTests(TestCase):
+    """
+    Tests for purging, archiving and compacting old notifications.
+    """
+
+    def setUp(self):
+        """Set up a user with notifications of various ages and states."""
+        cache.clear()
+        NotificationCategory.create_defaults()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def notify(self, days_old, priority='normal', read=False, deleted=False):
+        notification = Notification.create_notification(self.user, 'system', 'Old news', priority=priority)
+        if read:
+            Notification.objects.get(pk=notification.pk).mark_as_read()
+        if deleted:
+            Notification.objects.get(pk=notification.pk).delete_notification()
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=timezone.now() - timedelta(days=days_old)
+        )
+        return notification.pk
+
+    @override_settings(NOTIFICATION_RETENTION_DAYS={'low': 10, 'normal': 60})
+    def test_retention_keeps_the_live_working_set(self):
+        """Test that only expired read and deleted notifications leave the table."""
+        kept = [
+            self.notify(100),
+            self.notify(30, read=True),
+            self.notify(5, read=True, priority='low'),
+            self.notify(1, deleted=True),
+        ]
+        archived = [self.notify(100, read=True), self.notify(20, read=True, priority='low')]
+        self.notify(8, deleted=True)
+
+        results = apply_retention(batch_size=1, directory=self.directory.name)
+
+        self.assertEqual(results, {'purged': 1, 'archived': 2, 'compacted': 0})
+        self.assertEqual(sorted(Notification.objects.values_list('pk', flat=True)), kept)
+        self.assertEqual(Notification.get_unread_count(self.user), 1)
+
+        rows = [row for path in sorted(Path(self.directory.name).iterdir()) for row in read_segment(path)]
+        self.assertEqual([row['id'] for row in rows], archived)
+        self.assertEqual(rows[0]['verb'], 'Old news')
+
+    def test_compacted_versions_need_a_full_resync(self):
+        """Test that a version whose log entry was removed gets no delta."""
+        Notification.create_notification(self.user, 'system', 'Hello')
+        version = NotificationChange.objects.get().pk
+        Notification.create_notification(self.user, 'system', 'Again')
+        self.assertEqual(len(get_delta(self.user.id, version)['created']), 1)
+
+        NotificationChange.objects.filter(pk=version).update(created_at=timezone.now() - timedelta(days=60))
+        self.assertEqual(apply_retention(directory=self.directory.name)['compacted'], 1)
+        self.assertIsNone(get_delta(self.user.id, version))
@@ -4,6 +4,8 @@ from rpg_platform.utils.routers import VersionedRouter
 from . import views
 from .api import NotificationViewSet, NotificationCategoryViewSet
 
+app_name = 'notifications'
+
 # Create a versioned router
 router = VersionedRouter()
 router.register(r"notifications", NotificationViewSet, basename="notification")
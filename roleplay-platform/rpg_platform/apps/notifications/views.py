@@ -10,7 +10,10 @@ from django.db.models import Count, Q
 from django.utils import timezone
 import logging
 
+from .cache import ensure_default_categories, get_categories
+from .counters import get_unread_counts
 from .models import Notification, NotificationCategory, NotificationPreference
+from .pagination import clamp_page_size, paginate_notifications
 
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -28,22 +31,22 @@ class NotificationCenterView(LoginRequiredMixin, TemplateView):
         # Get categories with counts
         categories = []
         all_categories = NotificationCategory.objects.all().order_by('order', 'name')
+        counts = get_unread_counts(self.request.user)
 
         for category in all_categories:
-            count = Notification.get_unread_count(self.request.user, category)
             categories.append({
                 'id': category.id,
                 'name': category.name,
                 'key': category.key,
                 'icon': category.icon,
                 'color': category.color,
-                'unread_count': count
+                'unread_count': counts.get(category.id, 0)
             })
 
         context['categories'] = categories
 
         # Total unread count
-        context['unread_count'] = Notification.get_unread_count(self.request.user)
+        context['unread_count'] = sum(counts.values())
 
         # Get active category if provided
         active_category = self.request.GET.get('category')
@@ -111,17 +114,42 @@ class NotificationListView(LoginRequiredMixin, ListView):
                     Q(verb__icontains=search)
                 )
 
-            return queryset.order_by('-created_at')
+            return queryset.order_by('-created_at', '-id')
         except Exception as e:
             logger.error(f"Error in NotificationListView.get_queryset: {str(e)}")
             messages.error(self.request, _("An error occurred while retrieving notifications. Please try again."))
             return Notification.objects.none()
 
+    def paginate_queryset(self, queryset, page_size):
+        """Paginate with cursors instead of page numbers, see ``pagination``"""
+        try:
+            page = paginate_notifications(queryset, self.request.GET.get('cursor'), page_size)
+        except ValueError:
+            raise Http404(_("Invalid page cursor."))
+
+        return None, page, page.items, page.has_next or page.has_previous
+
+    def get_page_query(self, cursor):
+        """Query string of another page, keeping the current filters"""
+        query = self.request.GET.copy()
+        query.pop('cursor', None)
+        if cursor:
+            query['cursor'] = cursor
+        return query.urlencode()
+
     def get_context_data(self, **kwargs):
         """Add additional context data for the template"""
         try:
             context = super().get_context_data(**kwargs)
 
+            # Links to the neighbouring pages
+            page = context['page_obj']
+            context['first_page_query'] = self.get_page_query(None)
+            if page.has_next:
+                context['next_page_query'] = self.get_page_query(page.next_cursor)
+            if page.has_previous:
+                context['previous_page_query'] = self.get_page_query(page.previous_cursor)
+
             # Add filter values to context
             context['current_category'] = self.request.GET.get('category', '')
             context['current_type'] = self.request.GET.get('type', '')
@@ -153,7 +181,7 @@ class NotificationPreferenceView(LoginRequiredMixin, View):
 
     def get(self, request):
         # Ensure we have preferences for all categories
-        NotificationCategory.create_defaults()
+        ensure_default_categories()
         NotificationPreference.get_or_create_for_user(request.user)
 
         # Get preferences grouped by category
@@ -264,19 +292,19 @@ def unread_count_api(request):
     """
     API endpoint to get the number of unread notifications
     """
-    count = Notification.get_unread_count(request.user)
+    counts = get_unread_counts(request.user)
 
     # Get category counts if requested
     include_categories = request.GET.get('include_categories', 'false').lower() == 'true'
 
-    response = {'count': count}
+    response = {'count': sum(counts.values())}
 
     if include_categories:
         categories = NotificationCategory.objects.all()
         category_counts = {}
 
         for category in categories:
-            category_counts[category.key] = Notification.get_unread_count(request.user, category)
+            category_counts[category.key] = counts.get(category.id, 0)
 
         response['categories'] = category_counts
 
@@ -372,8 +400,8 @@ class NotificationsAPIView(LoginRequiredMixin, View):
     def get(self, request):
         """Get notifications for the current user"""
         # Get parameters
-        limit = int(request.GET.get('limit', 10))
-        page = int(request.GET.get('page', 1))
+        limit = clamp_page_size(request.GET.get('limit'), 10)
+        cursor = request.GET.get('cursor')
         include_read = request.GET.get('include_read', 'true').lower() == 'true'
         category_id = request.GET.get('category_id')
         notification_type = request.GET.get('type')
@@ -394,17 +422,15 @@ class NotificationsAPIView(LoginRequiredMixin, View):
         if notification_type:
             query = query.filter(notification_type=notification_type)
 
-        # Order by created_at (newest first)
-        query = query.order_by('-created_at')
-
-        # Paginate
-        from django.core.paginator import Paginator
-        paginator = Paginator(query, limit)
-        page_obj = paginator.get_page(page)
+        # Paginate, newest first
+        try:
+            page_obj = paginate_notifications(query, cursor, limit)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
 
         # Format notifications for JSON response
         notifications_data = []
-        for notification in page_obj.object_list:
+        for notification in page_obj:
             actor_data = None
             if notification.actor:
                 actor_data = {
@@ -443,11 +469,10 @@ class NotificationsAPIView(LoginRequiredMixin, View):
 
         return JsonResponse({
             'notifications': notifications_data,
-            'has_next': page_obj.has_next(),
-            'has_previous': page_obj.has_previous(),
-            'current_page': page_obj.number,
-            'total_pages': paginator.num_pages,
-            'total_count': paginator.count
+            'has_next': page_obj.has_next,
+            'has_previous': page_obj.has_previous,
+            'next_cursor': page_obj.next_cursor,
+            'previous_cursor': page_obj.previous_cursor
         })
 
 
@@ -513,15 +538,16 @@ class CategoriesAPIView(LoginRequiredMixin, View):
     def get(self, request):
         """Get all notification categories with unread counts"""
         # Ensure default categories exist
-        NotificationCategory.create_defaults()
+        ensure_default_categories()
 
         # Get all categories
-        categories = NotificationCategory.objects.all().order_by('order', 'name')
+        categories = sorted(get_categories().values(), key=lambda category: (category.order, category.name))
+        counts = get_unread_counts(request.user)
 
         # Format for JSON response
         categories_data = []
         for category in categories:
-            unread_count = Notification.get_unread_count(request.user, category)
+            unread_count = counts.get(category.id, 0)
 
             categories_data.append({
                 'id': category.id,
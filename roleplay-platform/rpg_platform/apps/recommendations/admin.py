@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 
-from .models import CharacterRecommendation, UserSimilarity, UserPreference
+from .models import CharacterRecommendation, UserSimilarity, UserPreference, RecommendationJob, RecommendationRebuild, UserRatingNorm
 
 
 @admin.register(CharacterRecommendation)
@@ -30,3 +30,26 @@ class UserPreferenceAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'attribute', 'value')
     raw_id_fields = ('user',)
     readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(RecommendationJob)
+class RecommendationJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'requested_at', 'run_after', 'refresh_similarities', 'locked_at', 'locked_by', 'attempts')
+    list_filter = ('locked_at', 'run_after')
+    search_fields = ('user__username', 'locked_by')
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(UserRatingNorm)
+class UserRatingNormAdmin(admin.ModelAdmin):
+    list_display = ('user', 'sum_of_squares', 'rating_count')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(RecommendationRebuild)
+class RecommendationRebuildAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'finished_at', 'processed_users', 'total_users', 'recommendation_count')
+    list_filter = ('started_at', 'finished_at')
+    readonly_fields = ('started_at', 'completed_ranges')
@@ -0,0 +1,198 @@
+"""
+Batch regeneration of character recommendations for many users.
+
+``generate_recommendations_for_user`` runs a dozen queries per user. For a
+full rebuild the catalog-wide data (popular and recent characters, the
+attribute index of public characters) is loaded once per worker process, and
+the per-user data (ratings, comments, owned characters, preferences,
+neighbors) is loaded for a whole chunk of users at a time. The strategies
+then run in memory and results are written with chunked ``bulk_create``.
+"""
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+
+from rpg_platform.apps.characters.models import Character, CharacterComment, CharacterRating
+from .candidates import get_attribute_index, top_scored_characters
+from .models import CharacterRecommendation, UserPreference
+from .tasks import (
+    SIMILAR_USER_LIMIT, merge_recommendations, popularity_score,
+    recommendation_score_from_similar_users, similar_users_queryset
+)
+
+logger = logging.getLogger(__name__)
+
+# Catalog-wide candidates kept per worker, so users who interacted with the
+# top characters still get recommendations from further down the list
+POPULAR_CANDIDATES = 500
+RECENT_CANDIDATES = 100
+
+# Recommendations per strategy, matching the per-user strategies
+SIMILAR_RATED_RESULTS = 5
+POPULAR_RESULTS = 3
+SIMILAR_USER_RESULTS = 5
+RECENT_RESULTS = 3
+
+
+class SharedRecommendationData:
+    """
+    Catalog-wide data shared by every user of a batch rebuild
+    """
+
+    def __init__(self):
+        public = Character.objects.filter(public=True)
+
+        popular = public.filter(
+            average_rating__gte=4,
+            rating_count__gte=3
+        ).order_by('-average_rating', '-rating_count', '-comment_count').values_list(
+            'id', 'average_rating', 'rating_count'
+        )[:POPULAR_CANDIDATES]
+
+        self.popular = [
+            (character_id, popularity_score(average_rating, rating_count))
+            for character_id, average_rating, rating_count in popular
+        ]
+        self.recent = list(public.order_by('-updated_at').values_list('id', flat=True)[:RECENT_CANDIDATES])
+
+        # Builds the process-local index used by the preference strategy
+        self.index = get_attribute_index()
+        self.public_ids = set(self.index.character_ids.tolist())
+
+
+def _first_available(candidates, excluded, limit):
+    """Take the first ``limit`` candidates not in ``excluded``"""
+    results = []
+    for candidate in candidates:
+        character_id = candidate[0] if isinstance(candidate, tuple) else candidate
+        if character_id not in excluded:
+            results.append(candidate)
+            if len(results) >= limit:
+                break
+    return results
+
+
+def build_chunk_recommendations(user_ids, shared):
+    """
+    Compute recommendations for a chunk of users with a fixed number of queries.
+
+    Returns unsaved ``CharacterRecommendation`` objects.
+    """
+    excluded = defaultdict(set)
+    highly_rated = set()
+
+    for user_id, character_id, rating in CharacterRating.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'character_id', 'rating'):
+        excluded[user_id].add(character_id)
+        if rating >= 4:
+            highly_rated.add(user_id)
+
+    for user_id, character_id in CharacterComment.objects.filter(
+        author_id__in=user_ids
+    ).values_list('author_id', 'character_id'):
+        excluded[user_id].add(character_id)
+
+    for user_id, character_id in Character.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'id'):
+        excluded[user_id].add(character_id)
+
+    for user_id, character_id in CharacterRecommendation.objects.filter(
+        user_id__in=user_ids, is_dismissed=True
+    ).values_list('user_id', 'character_id'):
+        excluded[user_id].add(character_id)
+
+    preferences = defaultdict(list)
+    for user_id, attribute, value, weight in UserPreference.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'attribute', 'value', 'weight'):
+        preferences[user_id].append((attribute, value, weight))
+
+    neighbors = defaultdict(list)
+    for user_id, other_id in similar_users_queryset().filter(
+        user1_id__in=user_ids
+    ).order_by('user1_id', '-similarity_score').values_list('user1_id', 'user2_id'):
+        if len(neighbors[user_id]) < SIMILAR_USER_LIMIT:
+            neighbors[user_id].append(other_id)
+
+    neighbor_ratings = defaultdict(list)
+    neighbor_ids = {other_id for others in neighbors.values() for other_id in others}
+    for other_id, character_id, rating in CharacterRating.objects.filter(
+        user_id__in=neighbor_ids, rating__gte=4
+    ).values_list('user_id', 'character_id', 'rating'):
+        neighbor_ratings[other_id].append((character_id, rating))
+
+    recommendations = []
+
+    for user_id in user_ids:
+        user_excluded = excluded[user_id]
+        user_recommendations = []
+
+        # Strategy 1: Similar to rated characters
+        if user_id in highly_rated and preferences[user_id]:
+            for character_id, score in top_scored_characters(
+                preferences[user_id], None, SIMILAR_RATED_RESULTS, exclude=user_excluded
+            ):
+                user_recommendations.append(CharacterRecommendation(
+                    user_id=user_id, character_id=character_id,
+                    score=min(5.0, score), reason='similar_rating'
+                ))
+
+        # Strategy 2: Popular in the community
+        for character_id, score in _first_available(shared.popular, user_excluded, POPULAR_RESULTS):
+            user_recommendations.append(CharacterRecommendation(
+                user_id=user_id, character_id=character_id, score=score, reason='popular'
+            ))
+
+        # Strategy 3: Recommended by similar users
+        ratings_by_character = defaultdict(list)
+        for other_id in neighbors[user_id]:
+            for character_id, rating in neighbor_ratings[other_id]:
+                ratings_by_character[character_id].append(rating)
+
+        candidates = sorted(
+            (
+                (sum(ratings) / len(ratings), len(ratings), character_id)
+                for character_id, ratings in ratings_by_character.items()
+                if len(ratings) >= 2
+                and character_id in shared.public_ids
+                and character_id not in user_excluded
+            ),
+            key=lambda item: (-item[0], -item[1])
+        )
+        for avg_rating, count, character_id in candidates[:SIMILAR_USER_RESULTS]:
+            user_recommendations.append(CharacterRecommendation(
+                user_id=user_id, character_id=character_id,
+                score=recommendation_score_from_similar_users(avg_rating, count),
+                reason='friend_rated'
+            ))
+
+        # Strategy 4: Recently active characters
+        for character_id in _first_available(shared.recent, user_excluded, RECENT_RESULTS):
+            user_recommendations.append(CharacterRecommendation(
+                user_id=user_id, character_id=character_id, score=3.0, reason='recently_active'
+            ))
+
+        recommendations.extend(merge_recommendations(user_recommendations))
+
+    return recommendations
+
+
+def rebuild_recommendation_chunk(user_ids, shared, batch_size=1000):
+    """
+    Regenerate and store recommendations for a chunk of users.
+
+    Returns the number of recommendations written.
+    """
+    recommendations = build_chunk_recommendations(user_ids, shared)
+
+    with transaction.atomic():
+        CharacterRecommendation.objects.filter(
+            user_id__in=user_ids,
+            is_dismissed=False
+        ).delete()
+        CharacterRecommendation.objects.bulk_create(recommendations, batch_size=batch_size)
+
+    return len(recommendations)
@@ -0,0 +1,174 @@
+"""
+Inverted index from character attributes to public characters.
+
+``recommend_similar_to_rated`` scores characters by summing the weights of the
+user's ``UserPreference`` rows that match them. Instead of loading characters
+and comparing strings one by one, the catalog is indexed once per process as
+``(attribute, normalized value) -> character positions`` and a user's scores
+are accumulated with one vector addition per matching preference.
+
+The index is rebuilt lazily when its version is bumped by the signal handlers
+in ``recommendations.signals``, which only do so when an indexed field, a
+positive kink rating or the visibility of a character changed. Versions are
+stored in the database, see ``utils.cache``, so every process rebuilds within
+``CACHE_VERSION_CHECK_INTERVAL`` seconds of a change.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from rpg_platform.apps.characters.models import Character, CharacterKink
+from rpg_platform.utils.cache import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+# Character fields indexed under the preference attribute of the same name
+INDEXED_FIELDS = ('species', 'gender', 'body_type')
+
+# Kink ratings that count as a character having the kink
+POSITIVE_KINK_RATINGS = ('fave', 'yes')
+
+INDEX_VERSION_KEY = 'recommendations:attribute_index_version'
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize_value(value):
+    """Normalize an attribute value for index lookups"""
+    return ' '.join(str(value).split()).lower()
+
+
+class AttributeIndex:
+    """
+    Public characters and the positions of those having each attribute value
+    """
+
+    def __init__(self, character_ids, postings, version):
+        self.character_ids = character_ids
+        self.postings = postings
+        self.version = version
+
+    def __len__(self):
+        return len(self.character_ids)
+
+    def lookup(self, attribute, value):
+        """Positions of characters having ``value`` for ``attribute``"""
+        return self.postings.get((attribute, normalize_value(value)))
+
+    def score(self, preferences):
+        """
+        Sum preference weights for every indexed character.
+
+        ``preferences`` is an iterable of ``(attribute, value, weight)``.
+        """
+        scores = np.zeros(len(self.character_ids), dtype=np.float64)
+
+        for attribute, value, weight in preferences:
+            positions = self.lookup(attribute, value)
+            if positions is not None:
+                scores[positions] += weight
+
+        return scores
+
+
+def build_attribute_index(version=None):
+    """Build the index from the public catalog in two queries"""
+    characters = list(
+        Character.objects.filter(public=True)
+        .order_by('-created_at', '-id')
+        .values_list('id', *INDEXED_FIELDS)
+    )
+
+    character_ids = np.array([row[0] for row in characters], dtype=np.int64)
+    position_of = {character_id: i for i, character_id in enumerate(character_ids.tolist())}
+
+    postings = defaultdict(list)
+    for position, row in enumerate(characters):
+        for attribute, value in zip(INDEXED_FIELDS, row[1:]):
+            if value:
+                postings[(attribute, normalize_value(value))].append(position)
+
+    kinks = CharacterKink.objects.filter(
+        character__public=True,
+        rating__in=POSITIVE_KINK_RATINGS
+    ).values_list('character_id', 'kink__name')
+
+    for character_id, kink_name in kinks.iterator(chunk_size=10000):
+        # Characters published between the two queries are picked up next build
+        if character_id in position_of:
+            postings[('kink', normalize_value(kink_name))].append(position_of[character_id])
+
+    postings = {
+        key: np.unique(np.array(positions, dtype=np.int64))
+        for key, positions in postings.items()
+    }
+
+    logger.info(f"Built attribute index: {len(character_ids)} characters, {len(postings)} attribute values")
+
+    return AttributeIndex(character_ids, postings, version)
+
+
+def get_attribute_index():
+    """Return the process-local index, rebuilding it if it is stale"""
+    global _index
+
+    version = get_version(INDEX_VERSION_KEY)
+    index = _index
+
+    if index is None or index.version != version:
+        with _lock:
+            if _index is index:
+                _index = build_attribute_index(version)
+            index = _index
+
+    return index
+
+
+def invalidate_attribute_index():
+    """Mark the index stale in every process"""
+    bump_version(INDEX_VERSION_KEY)
+
+
+def top_scored_characters(preferences, queryset, limit, exclude=None):
+    """
+    Return the ``limit`` best ``(character_id, score)`` pairs.
+
+    Characters are ranked by summed preference weight, newest first on ties.
+    With a ``queryset`` only candidates with a positive score are checked
+    against it, a chunk at a time, so excluded characters do not shorten the
+    result. Without one, every indexed (public) character not in ``exclude``
+    is eligible and no query is made.
+    """
+    index = get_attribute_index()
+    scores = index.score(preferences)
+
+    candidates = np.flatnonzero(scores > 0)
+    if not len(candidates):
+        return []
+
+    # Positions follow catalog order, so a stable sort keeps newest first
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    exclude = exclude or set()
+    results = []
+    chunk_size = max(limit * 4, 50)
+
+    for start in range(0, len(candidates), chunk_size):
+        chunk = candidates[start:start + chunk_size]
+        chunk_ids = index.character_ids[chunk].tolist()
+
+        if queryset is not None:
+            available = set(queryset.filter(id__in=chunk_ids).values_list('id', flat=True))
+        else:
+            available = set(chunk_ids)
+
+        for position, character_id in zip(chunk, chunk_ids):
+            if character_id in available and character_id not in exclude:
+                results.append((character_id, float(scores[position])))
+                if len(results) >= limit:
+                    return results
+
+    return results
@@ -0,0 +1,224 @@
+"""
+Incremental maintenance of the statistics user similarities are scored from.
+
+A cosine similarity only depends on the norms of both users' rating vectors
+and on the dot product over the characters they both rated. Both are stored,
+norms in ``UserRatingNorm`` and per-pair dot products and co-rating counts in
+``UserRatingOverlap``, and when a single ``CharacterRating`` is created,
+changed or deleted only the rater's norm and the pairs with the other raters
+of that character are adjusted. The adjustments are relative UPDATEs run in
+the transaction of the rating, a fixed number of queries whatever the number
+of raters, so concurrent ratings cannot lose each other's changes.
+
+The stored ``UserSimilarity`` rows are then refreshed from these statistics
+by the recommendation worker, see ``tasks.refresh_user_similarities``.
+
+Rating rows changed with queryset ``update()`` bypass the signals, as do
+pairs of ratings of one character removed by the same queryset ``delete()``;
+``rebuild_rating_statistics`` recalculates everything from the ratings.
+"""
+import logging
+import math
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+
+from rpg_platform.apps.characters.models import CharacterRating
+from .models import UserRatingNorm, UserRatingOverlap
+from .similarity import MIN_COMMON_RATINGS, confidence_weight
+
+logger = logging.getLogger(__name__)
+
+
+def similarity_from_stats(dot_product, common_count, first_sum_of_squares, second_sum_of_squares):
+    """Cosine similarity with the co-rating confidence factor, from pair statistics"""
+    if common_count < MIN_COMMON_RATINGS or first_sum_of_squares <= 0 or second_sum_of_squares <= 0:
+        return 0.0
+
+    cosine = dot_product / math.sqrt(first_sum_of_squares * second_sum_of_squares)
+    return min(1.0, cosine * float(confidence_weight(common_count)))
+
+
+def _norm_from_ratings(user_id):
+    stats = CharacterRating.objects.filter(user_id=user_id).aggregate(
+        sum_of_squares=Sum(F('rating') * F('rating')),
+        rating_count=Count('id')
+    )
+    return {'sum_of_squares': float(stats['sum_of_squares'] or 0), 'rating_count': stats['rating_count']}
+
+
+def _apply_norm_change(user_id, square_delta, count_delta):
+    changes = {
+        'sum_of_squares': F('sum_of_squares') + square_delta,
+        'rating_count': F('rating_count') + count_delta,
+    }
+    if UserRatingNorm.objects.filter(user_id=user_id).update(**changes) or count_delta < 0:
+        # Deletions never create a norm, the user may be being deleted
+        return
+
+    try:
+        with transaction.atomic():
+            # The ratings already include the change
+            UserRatingNorm.objects.create(user_id=user_id, **_norm_from_ratings(user_id))
+    except IntegrityError:
+        # Created by a concurrent rating of the same user
+        UserRatingNorm.objects.filter(user_id=user_id).update(**changes)
+
+
+def _overlaps(user_id):
+    """Both directions of the stored pairs of a user"""
+    return UserRatingOverlap.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id))
+
+
+def apply_rating_change(user_id, character_id, old_rating, new_rating, pairs=True):
+    """
+    Update the rating statistics after a single rating changed.
+
+    ``old_rating`` is ``None`` for a new rating and ``new_rating`` is ``None``
+    for a deleted one. The ratings table must already reflect the change.
+    Without ``pairs`` only the rater's norm is updated.
+    """
+    if old_rating == new_rating:
+        return
+
+    old, new = old_rating or 0, new_rating or 0
+    count_delta = (new_rating is not None) - (old_rating is not None)
+
+    with transaction.atomic(savepoint=False):
+        _apply_norm_change(user_id, new * new - old * old, count_delta)
+        if not pairs:
+            return
+
+        other_ratings = CharacterRating.objects.filter(character_id=character_id).exclude(user_id=user_id)
+
+        if count_delta > 0:
+            # Pairs new to this character start empty and are counted below
+            other_ids = list(other_ratings.values_list('user_id', flat=True))
+            known = set(
+                UserRatingOverlap.objects.filter(user1_id=user_id, user2_id__in=other_ids)
+                .values_list('user2_id', flat=True)
+            )
+            UserRatingOverlap.objects.bulk_create(
+                [
+                    UserRatingOverlap(user1_id=first, user2_id=second)
+                    for other_id in other_ids if other_id not in known
+                    for first, second in ((user_id, other_id), (other_id, user_id))
+                ],
+                batch_size=500,
+                ignore_conflicts=True
+            )
+
+        # The product with each other rater's rating, read by the UPDATE itself
+        for own, other in (('user1_id', 'user2_id'), ('user2_id', 'user1_id')):
+            other_rating = Subquery(
+                other_ratings.filter(user_id=OuterRef(other)).values('rating')[:1],
+                output_field=FloatField()
+            )
+            UserRatingOverlap.objects.filter(
+                **{own: user_id, f'{other}__in': other_ratings.values('user_id')}
+            ).update(
+                dot_product=F('dot_product') + Value(float(new - old)) * other_rating,
+                common_count=F('common_count') + count_delta
+            )
+
+        if count_delta < 0:
+            _overlaps(user_id).filter(common_count__lte=0).delete()
+
+
+def remove_character_ratings(character_id):
+    """
+    Remove every rating of a character from the pair statistics at once.
+
+    Called before the ratings of a deleted character are removed: they are
+    deleted together, so the pairs between them cannot be adjusted one
+    rating at a time.
+    """
+    ratings = CharacterRating.objects.filter(character_id=character_id)
+
+    def rating_of(user_field):
+        return Subquery(ratings.filter(user_id=OuterRef(user_field)).values('rating')[:1], output_field=FloatField())
+
+    pairs = UserRatingOverlap.objects.filter(
+        user1_id__in=ratings.values('user_id'), user2_id__in=ratings.values('user_id')
+    )
+    with transaction.atomic(savepoint=False):
+        pairs.update(
+            dot_product=F('dot_product') - rating_of('user1_id') * rating_of('user2_id'),
+            common_count=F('common_count') - 1
+        )
+        pairs.filter(common_count__lte=0).delete()
+
+
+def _overlaps_from_ratings(ratings):
+    """
+    ``(user_id, other_id, dot_product, common_count)`` of every pair of
+    users sharing a character among ``ratings``
+    """
+    return (
+        ratings.values('user_id', other_id=F('character__ratings__user_id'))
+        .annotate(
+            dot_product=Sum(F('rating') * F('character__ratings__rating')),
+            common_count=Count('character__ratings')
+        )
+        .values_list('user_id', 'other_id', 'dot_product', 'common_count')
+    )
+
+
+def recompute_user_statistics(user_id):
+    """
+    Recalculate the norm and pairs of one user from the ratings.
+
+    Used when a rating was saved without its previous value being known.
+    """
+    with transaction.atomic(savepoint=False):
+        UserRatingNorm.objects.update_or_create(user_id=user_id, defaults=_norm_from_ratings(user_id))
+
+        _overlaps(user_id).delete()
+        overlaps = []
+        for first, second, dot_product, common_count in _overlaps_from_ratings(
+            CharacterRating.objects.filter(user_id=user_id)
+        ):
+            if first == second:
+                continue
+            overlaps.append(UserRatingOverlap(
+                user1_id=first, user2_id=second, dot_product=dot_product, common_count=common_count
+            ))
+            overlaps.append(UserRatingOverlap(
+                user1_id=second, user2_id=first, dot_product=dot_product, common_count=common_count
+            ))
+        UserRatingOverlap.objects.bulk_create(overlaps, batch_size=500)
+
+
+def rebuild_rating_statistics(batch_size=5000):
+    """Recalculate the stored norms and pair statistics of all users"""
+    norms = CharacterRating.objects.values('user_id').annotate(
+        sum_of_squares=Sum(F('rating') * F('rating')),
+        rating_count=Count('id')
+    )
+
+    with transaction.atomic():
+        UserRatingNorm.objects.all().delete()
+        UserRatingNorm.objects.bulk_create(
+            (
+                UserRatingNorm(
+                    user_id=item['user_id'],
+                    sum_of_squares=float(item['sum_of_squares']),
+                    rating_count=item['rating_count']
+                )
+                for item in norms.iterator()
+            ),
+            batch_size=batch_size
+        )
+
+        UserRatingOverlap.objects.all().delete()
+        UserRatingOverlap.objects.bulk_create(
+            (
+                UserRatingOverlap(user1_id=first, user2_id=second, dot_product=dot_product, common_count=common_count)
+                for first, second, dot_product, common_count
+                in _overlaps_from_ratings(CharacterRating.objects.all()).iterator()
+                if first != second
+            ),
+            batch_size=batch_size
+        )
+
+    logger.info("Rebuilt rating statistics")
@@ -0,0 +1,64 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from rpg_platform.apps.recommendations.worker import worker_loop
+
+
+class Command(BaseCommand):
+    help = 'Run worker processes that regenerate queued character recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes to start'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when the queue is empty'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Number of jobs each worker claims at a time'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no due jobs are left instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        kwargs = {
+            'poll_interval': options['poll_interval'],
+            'batch_size': options['batch_size'],
+            'once': options['once'],
+        }
+
+        if workers == 1:
+            self.stdout.write("Starting recommendation worker")
+            worker_loop(**kwargs)
+            return
+
+        # Child processes must not share the parent's database connections
+        connections.close_all()
+
+        self.stdout.write(f"Starting {workers} recommendation workers")
+        processes = [
+            multiprocessing.Process(target=worker_loop, kwargs=kwargs, daemon=True)
+            for _ in range(workers)
+        ]
+
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+        self.stdout.write(self.style.SUCCESS("Recommendation workers stopped"))
@@ -0,0 +1,98 @@
+import multiprocessing
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from rpg_platform.apps.recommendations.models import RecommendationRebuild
+from rpg_platform.apps.recommendations.tasks import rebuild_user_similarities
+from rpg_platform.apps.recommendations.worker import init_rebuild_worker, rebuild_chunk_worker
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Regenerate character recommendations for every active user in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='Number of worker processes to shard users across'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=200,
+            help='Number of users processed per task'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continue the most recent unfinished rebuild instead of starting a new one'
+        )
+        parser.add_argument(
+            '--skip-similarities', action='store_true',
+            help='Use the stored user similarities instead of recalculating them first'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        if options['resume']:
+            run = RecommendationRebuild.objects.filter(finished_at__isnull=True).first()
+            if run is None:
+                raise CommandError("There is no unfinished recommendation rebuild to resume")
+            self.stdout.write(f"Resuming rebuild started {run.started_at:%Y-%m-%d %H:%M:%S}")
+        else:
+            run = RecommendationRebuild.objects.create(chunk_size=max(1, options['chunk_size']))
+
+        # Similarities are rebuilt once per run, before any chunk is written
+        if not options['skip_similarities'] and not run.completed_ranges:
+            self.stdout.write("Recalculating user similarities")
+            rebuild_user_similarities()
+
+        user_ids = list(User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+        run.total_users = len(user_ids)
+        run.save(update_fields=['total_users'])
+
+        remaining = run.remaining_user_ids(user_ids)
+        chunks = [remaining[i:i + run.chunk_size] for i in range(0, len(remaining), run.chunk_size)]
+
+        self.stdout.write(f"Rebuilding recommendations for {len(remaining)} of {len(user_ids)} users")
+
+        processed = 0
+        for first, last, count, written in self.run_chunks(chunks, max(1, options['workers'])):
+            processed += count
+            run.completed_ranges.append([first, last])
+            run.processed_users += count
+            run.recommendation_count += written
+            run.save(update_fields=['completed_ranges', 'processed_users', 'recommendation_count'])
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{run.processed_users}/{run.total_users} users "
+                f"({processed / elapsed:.1f} users/s)"
+            )
+
+        run.finished_at = timezone.now()
+        run.save(update_fields=['finished_at'])
+
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt recommendations for {processed} users in {elapsed:.2f}s ({rate:.1f} users/s), "
+            f"{run.recommendation_count} recommendations written"
+        ))
+
+    def run_chunks(self, chunks, workers):
+        """Yield chunk results as they complete"""
+        if workers == 1 or len(chunks) <= 1:
+            init_rebuild_worker()
+            for chunk in chunks:
+                yield rebuild_chunk_worker(chunk)
+            return
+
+        # Child processes must not share the parent's database connections
+        connections.close_all()
+
+        with multiprocessing.Pool(workers, initializer=init_rebuild_worker) as pool:
+            yield from pool.imap_unordered(rebuild_chunk_worker, chunks)
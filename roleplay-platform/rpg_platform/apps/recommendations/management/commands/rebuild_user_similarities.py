@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rpg_platform.apps.recommendations.incremental import rebuild_rating_statistics
+from rpg_platform.apps.recommendations.tasks import SIMILARITY_NEIGHBORS, rebuild_user_similarities
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculate stored user similarities for all users with the vectorized engine, '
+        'and the rating statistics they are refreshed from'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbors', type=int, default=SIMILARITY_NEIGHBORS,
+            help='Number of most similar users stored per user'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rebuild_rating_statistics()
+        neighbors = rebuild_user_similarities(k=options['neighbors'])
+        elapsed = time.monotonic() - started
+
+        pair_count = sum(len(user_neighbors) for user_neighbors in neighbors.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {pair_count} similarities for {len(neighbors)} users in {elapsed:.2f}s"
+        ))
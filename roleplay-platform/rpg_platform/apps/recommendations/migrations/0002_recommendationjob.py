@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(help_text='Time of the most recent trigger for this user', verbose_name='Requested At')),
+                ('run_after', models.DateTimeField(help_text='The job will not be picked up by a worker before this time', verbose_name='Run After')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Locked At')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='Locked By')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_job', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Recommendation Job',
+                'verbose_name_plural': 'Recommendation Jobs',
+                'ordering': ['run_after'],
+                'indexes': [models.Index(fields=['locked_at', 'run_after'], name='recommendat_locked__22a309_idx')],
+            },
+        ),
+    ]
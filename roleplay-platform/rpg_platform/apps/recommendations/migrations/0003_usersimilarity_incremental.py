@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recommendations', '0002_recommendationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='common_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Co-rated Characters'),
+        ),
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='dot_product',
+            field=models.FloatField(blank=True, help_text='Sum of rating products over co-rated characters, empty if not tracked yet', null=True, verbose_name='Dot Product'),
+        ),
+        migrations.CreateModel(
+            name='UserRatingNorm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sum_of_squares', models.FloatField(default=0, verbose_name='Sum of Squared Ratings')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='Rating Count')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_norm', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'User Rating Norm',
+                'verbose_name_plural': 'User Rating Norms',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0003_usersimilarity_incremental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRebuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('chunk_size', models.PositiveIntegerField(verbose_name='Chunk Size')),
+                ('total_users', models.PositiveIntegerField(default=0, verbose_name='Total Users')),
+                ('processed_users', models.PositiveIntegerField(default=0, verbose_name='Processed Users')),
+                ('recommendation_count', models.PositiveIntegerField(default=0, verbose_name='Recommendations Written')),
+                ('completed_ranges', models.JSONField(blank=True, default=list, help_text='Inclusive [first, last] user id ranges that have been rebuilt', verbose_name='Completed Ranges')),
+            ],
+            options={
+                'verbose_name': 'Recommendation Rebuild',
+                'verbose_name_plural': 'Recommendation Rebuilds',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0004_recommendationrebuild'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='usersimilarity',
+            name='common_count',
+        ),
+        migrations.RemoveField(
+            model_name='usersimilarity',
+            name='dot_product',
+        ),
+        migrations.AddField(
+            model_name='recommendationjob',
+            name='refresh_similarities',
+            field=models.BooleanField(default=False, help_text="Recompute the user's similarities before their recommendations", verbose_name='Refresh Similarities'),
+        ),
+        migrations.DeleteModel(
+            name='UserRatingNorm',
+        ),
+    ]
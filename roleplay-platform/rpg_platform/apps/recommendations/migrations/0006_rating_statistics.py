@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_rating_statistics(apps, schema_editor):
+    """Compute the statistics similarities are refreshed from for existing ratings"""
+    from rpg_platform.apps.recommendations.incremental import rebuild_rating_statistics
+
+    rebuild_rating_statistics()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recommendations', '0005_similarity_refresh_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRatingNorm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sum_of_squares', models.FloatField(default=0, verbose_name='Sum of Squared Ratings')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='Rating Count')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_norm', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'User Rating Norm',
+                'verbose_name_plural': 'User Rating Norms',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserRatingOverlap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dot_product', models.FloatField(default=0, help_text='Sum of rating products over co-rated characters', verbose_name='Dot Product')),
+                ('common_count', models.IntegerField(default=0, verbose_name='Co-rated Characters')),
+                ('user1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_overlaps_as_user1', to=settings.AUTH_USER_MODEL, verbose_name='User 1')),
+                ('user2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_overlaps_as_user2', to=settings.AUTH_USER_MODEL, verbose_name='User 2')),
+            ],
+            options={
+                'verbose_name': 'User Rating Overlap',
+                'verbose_name_plural': 'User Rating Overlaps',
+                'indexes': [models.Index(fields=['user2'], name='recommendat_user2_i_a7b999_idx')],
+                'unique_together': {('user1', 'user2')},
+            },
+        ),
+        migrations.RunPython(build_rating_statistics, migrations.RunPython.noop),
+    ]
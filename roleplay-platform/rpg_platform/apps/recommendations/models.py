@@ -1,3 +1,5 @@
+import bisect
+
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
@@ -94,6 +96,64 @@ class UserSimilarity(models.Model):
         return f"Similarity between {self.user1.username} and {self.user2.username}: {self.similarity_score:.2f}"
 
 
+class UserRatingNorm(models.Model):
+    """
+    Per-user rating vector statistics used for incremental similarity updates
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='rating_norm',
+        verbose_name=_('User')
+    )
+    sum_of_squares = models.FloatField(_('Sum of Squared Ratings'), default=0)
+    rating_count = models.PositiveIntegerField(_('Rating Count'), default=0)
+
+    class Meta:
+        verbose_name = _('User Rating Norm')
+        verbose_name_plural = _('User Rating Norms')
+
+    def __str__(self):
+        return f"Rating norm for {self.user.username}: {self.sum_of_squares} over {self.rating_count} ratings"
+
+
+class UserRatingOverlap(models.Model):
+    """
+    Ratings two users share, kept for both directions of every pair of users
+    who rated a common character, so the similarity of any pair can be scored
+    without reading their ratings
+    """
+    user1 = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='rating_overlaps_as_user1',
+        verbose_name=_('User 1')
+    )
+    user2 = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='rating_overlaps_as_user2',
+        verbose_name=_('User 2')
+    )
+    dot_product = models.FloatField(
+        _('Dot Product'),
+        default=0,
+        help_text=_('Sum of rating products over co-rated characters')
+    )
+    common_count = models.IntegerField(_('Co-rated Characters'), default=0)
+
+    class Meta:
+        verbose_name = _('User Rating Overlap')
+        verbose_name_plural = _('User Rating Overlaps')
+        unique_together = (('user1', 'user2'),)
+        indexes = [
+            models.Index(fields=['user2']),
+        ]
+
+    def __str__(self):
+        return f"{self.common_count} characters rated by {self.user1.username} and {self.user2.username}"
+
+
 class UserPreference(models.Model):
     """
     Stores user preferences for different character attributes
@@ -132,3 +192,93 @@ class UserPreference(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s preference for {self.attribute}: {self.value} ({self.weight})"
+
+
+class RecommendationJob(models.Model):
+    """
+    Pending recommendation regeneration for a user.
+
+    There is at most one row per user, so repeated triggers inside the
+    coalescing window collapse into a single regeneration.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendation_job',
+        verbose_name=_('User')
+    )
+    requested_at = models.DateTimeField(
+        _('Requested At'),
+        help_text=_('Time of the most recent trigger for this user')
+    )
+    run_after = models.DateTimeField(
+        _('Run After'),
+        help_text=_('The job will not be picked up by a worker before this time')
+    )
+    locked_at = models.DateTimeField(_('Locked At'), null=True, blank=True)
+    locked_by = models.CharField(_('Locked By'), max_length=100, blank=True)
+    refresh_similarities = models.BooleanField(
+        _('Refresh Similarities'),
+        default=False,
+        help_text=_('Recompute the user\'s similarities before their recommendations')
+    )
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last Error'), blank=True)
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Recommendation Job')
+        verbose_name_plural = _('Recommendation Jobs')
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['locked_at', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"Recommendation job for {self.user.username} (run after {self.run_after:%Y-%m-%d %H:%M:%S})"
+
+
+class RecommendationRebuild(models.Model):
+    """
+    Progress of a batch rebuild of recommendations for all active users.
+
+    Completed chunks are recorded as inclusive user id ranges, so an
+    interrupted rebuild can be resumed without redoing finished users.
+    """
+    started_at = models.DateTimeField(_('Started At'), auto_now_add=True)
+    finished_at = models.DateTimeField(_('Finished At'), null=True, blank=True)
+    chunk_size = models.PositiveIntegerField(_('Chunk Size'))
+    total_users = models.PositiveIntegerField(_('Total Users'), default=0)
+    processed_users = models.PositiveIntegerField(_('Processed Users'), default=0)
+    recommendation_count = models.PositiveIntegerField(_('Recommendations Written'), default=0)
+    completed_ranges = models.JSONField(
+        _('Completed Ranges'),
+        default=list,
+        blank=True,
+        help_text=_('Inclusive [first, last] user id ranges that have been rebuilt')
+    )
+
+    class Meta:
+        verbose_name = _('Recommendation Rebuild')
+        verbose_name_plural = _('Recommendation Rebuilds')
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Recommendation rebuild started {self.started_at:%Y-%m-%d %H:%M:%S} ({self.processed_users}/{self.total_users} users)"
+
+    @property
+    def is_finished(self):
+        return self.finished_at is not None
+
+    def remaining_user_ids(self, user_ids):
+        """Filter sorted ``user_ids`` down to those outside completed chunks"""
+        ranges = sorted(self.completed_ranges)
+        starts = [first for first, _ in ranges]
+
+        remaining = []
+        for user_id in user_ids:
+            position = bisect.bisect_right(starts, user_id) - 1
+            if position < 0 or user_id > ranges[position][1]:
+                remaining.append(user_id)
+
+        return remaining
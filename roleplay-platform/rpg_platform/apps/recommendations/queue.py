@@ -0,0 +1,186 @@
+"""
+Database-backed job queue for recommendation regeneration.
+
+Signal handlers call ``enqueue_recommendation_refresh`` instead of running the
+recommendation strategies inline. Triggers for the same user are coalesced
+into a single ``RecommendationJob`` row, which is picked up by the
+``process_recommendation_jobs`` management command once its window expires.
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RecommendationJob
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after the first trigger before regenerating, so bursts of
+# ratings and comments from the same user produce a single recompute
+DEFAULT_COALESCE_SECONDS = 30
+
+# Seconds after which a job locked by a worker is considered abandoned
+DEFAULT_LOCK_TIMEOUT = 300
+
+# Jobs failing more often than this are dropped
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def get_coalesce_window():
+    return timedelta(seconds=getattr(
+        settings, 'RECOMMENDATION_JOB_COALESCE_SECONDS', DEFAULT_COALESCE_SECONDS
+    ))
+
+
+def get_lock_timeout():
+    return timedelta(seconds=getattr(
+        settings, 'RECOMMENDATION_JOB_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT
+    ))
+
+
+def get_max_attempts():
+    return getattr(settings, 'RECOMMENDATION_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+
+def default_worker_id():
+    """Identifier stored on jobs locked by this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_recommendation_refresh(user_id, delay=None, similarities=False):
+    """
+    Request a recommendation regeneration for a user.
+
+    If a job for the user is already queued, only its ``requested_at`` is
+    bumped and the original ``run_after`` is kept, so a burst of triggers is
+    served by one regeneration at the end of the first window. With
+    ``similarities`` the user's stored similarities are recomputed first.
+    """
+    now = timezone.now()
+    run_after = now + (get_coalesce_window() if delay is None else delay)
+
+    changes = {'requested_at': now}
+    if similarities:
+        changes['refresh_similarities'] = True
+
+    # Fast path: a job is already queued (or running) for this user
+    if RecommendationJob.objects.filter(user_id=user_id).update(**changes):
+        return False
+
+    try:
+        with transaction.atomic():
+            RecommendationJob.objects.create(
+                user_id=user_id,
+                requested_at=now,
+                run_after=run_after,
+                refresh_similarities=similarities
+            )
+    except IntegrityError:
+        # Another request created the job concurrently
+        RecommendationJob.objects.filter(user_id=user_id).update(**changes)
+        return False
+
+    return True
+
+
+def enqueue_on_commit(user_id, similarities=False):
+    """Enqueue a refresh once the surrounding transaction commits"""
+    transaction.on_commit(lambda: enqueue_recommendation_refresh(user_id, similarities=similarities))
+
+
+def claim_jobs(worker_id, limit=10):
+    """
+    Lock up to ``limit`` due jobs for this worker.
+
+    Claiming is a conditional UPDATE per job, so several worker processes can
+    poll the same table without handing out a job twice.
+    """
+    now = timezone.now()
+    unlocked = Q(locked_at__isnull=True) | Q(locked_at__lt=now - get_lock_timeout())
+
+    candidates = list(
+        RecommendationJob.objects.filter(unlocked, run_after__lte=now)
+        .order_by('run_after')
+        .values_list('pk', 'locked_at')[:limit]
+    )
+
+    claimed = []
+    for pk, locked_at in candidates:
+        updated = RecommendationJob.objects.filter(
+            pk=pk, locked_at=locked_at
+        ).update(locked_at=now, locked_by=worker_id)
+
+        if updated:
+            claimed.append(RecommendationJob.objects.get(pk=pk))
+
+    return claimed
+
+
+def complete_job(job):
+    """
+    Remove a finished job.
+
+    If the user triggered again while the job was running, the job is released
+    with a fresh window instead so the new activity is not lost.
+    """
+    deleted, _ = RecommendationJob.objects.filter(
+        pk=job.pk,
+        requested_at=job.requested_at
+    ).delete()
+
+    if not deleted:
+        RecommendationJob.objects.filter(pk=job.pk).update(
+            locked_at=None,
+            locked_by='',
+            attempts=0,
+            run_after=timezone.now() + get_coalesce_window()
+        )
+
+
+def fail_job(job, error):
+    """Release a failed job for a retry with exponential backoff, or drop it"""
+    attempts = job.attempts + 1
+
+    if attempts >= get_max_attempts():
+        logger.error(f"Dropping recommendation job for user {job.user_id} after {attempts} attempts: {error}")
+        RecommendationJob.objects.filter(pk=job.pk).delete()
+        return
+
+    backoff = get_coalesce_window() * (2 ** attempts)
+    RecommendationJob.objects.filter(pk=job.pk).update(
+        locked_at=None,
+        locked_by='',
+        attempts=attempts,
+        last_error=str(error)[:2000],
+        run_after=timezone.now() + backoff
+    )
+
+
+def run_pending_jobs(worker_id=None, limit=10):
+    """
+    Claim and run a batch of due jobs.
+
+    Returns the number of jobs processed.
+    """
+    from .tasks import generate_recommendations_for_user, refresh_user_similarities
+
+    worker_id = worker_id or default_worker_id()
+    jobs = claim_jobs(worker_id, limit=limit)
+
+    for job in jobs:
+        try:
+            if job.refresh_similarities:
+                refresh_user_similarities(job.user_id)
+            generate_recommendations_for_user(job.user_id)
+        except Exception as e:
+            logger.exception(f"Recommendation job for user {job.user_id} failed")
+            fail_job(job, e)
+        else:
+            complete_job(job)
+
+    return len(jobs)
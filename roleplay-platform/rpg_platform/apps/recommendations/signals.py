@@ -1,28 +1,68 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.db.models import Count, Avg, Q
 from django.contrib.auth import get_user_model
 
-from rpg_platform.apps.characters.models import CharacterRating, CharacterComment
+from rpg_platform.apps.characters.models import Character, CharacterComment, CharacterKink, CharacterRating
+from rpg_platform.apps.characters.signals import character_kinks_changed
+from .candidates import INDEXED_FIELDS, POSITIVE_KINK_RATINGS, invalidate_attribute_index
+from .incremental import apply_rating_change, recompute_user_statistics, remove_character_ratings
 from .models import CharacterRecommendation, UserSimilarity, UserPreference
+from .queue import enqueue_on_commit
 
 User = get_user_model()
 
+# Character fields the attribute index depends on
+ATTRIBUTE_FIELDS = ('public', *INDEXED_FIELDS)
+
 
 @receiver(post_save, sender=CharacterRating)
 def update_recommendations_on_rating(sender, instance, created, **kwargs):
     """
-    Update recommendations when a user rates a character
+    Update recommendations and similarities when a user rates a character
     """
+    # The statistics similarities are scored from are adjusted right away;
+    # the stored similarities are refreshed from them by the worker, along
+    # with the recommendations
     if created:
-        # This is a new rating, update recommendations
-        from .tasks import generate_recommendations_for_user
-        generate_recommendations_for_user(instance.user.id)
+        apply_rating_change(instance.user_id, instance.character_id, None, instance.rating)
+    elif instance.original_rating is None:
+        # Saved without being loaded first, so the previous value is unknown
+        recompute_user_statistics(instance.user_id)
+    else:
+        apply_rating_change(instance.user_id, instance.character_id, instance.original_rating, instance.rating)
+
+    enqueue_on_commit(instance.user_id, similarities=True)
 
+    if created:
         # Also update preferences based on this rating
         update_user_preferences_from_rating(instance)
 
 
+@receiver(pre_delete, sender=Character)
+def remove_ratings_of_deleted_character(sender, instance, origin=None, **kwargs):
+    """
+    Remove the pairs of a deleted character's raters from the statistics
+    before its ratings go, all at once
+    """
+    remove_character_ratings(instance.pk)
+    if origin is not None:
+        origin._rating_statistics_removed = getattr(origin, '_rating_statistics_removed', set()) | {instance.pk}
+
+
+@receiver(post_delete, sender=CharacterRating)
+def update_recommendations_on_rating_delete(sender, instance, origin=None, **kwargs):
+    """
+    Update recommendations and similarities when a rating is removed
+    """
+    # Pairs of a deleted character's ratings were removed with the character
+    removed = instance.character_id in getattr(origin, '_rating_statistics_removed', ())
+    apply_rating_change(instance.user_id, instance.character_id, instance.rating, None, pairs=not removed)
+
+    enqueue_on_commit(instance.user_id, similarities=True)
+
+
 @receiver(post_save, sender=CharacterComment)
 def update_recommendations_on_comment(sender, instance, created, **kwargs):
     """
@@ -30,8 +70,64 @@ def update_recommendations_on_comment(sender, instance, created, **kwargs):
     """
     if created:
         # Schedule recommendation update
-        from .tasks import generate_recommendations_for_user
-        generate_recommendations_for_user(instance.author.id)
+        enqueue_on_commit(instance.author_id)
+
+
+@receiver(post_save, sender=Character)
+def invalidate_attribute_index_on_character_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Rebuild the character attribute index when an indexed field or the
+    visibility of a character changed
+    """
+    if created:
+        changed = instance.public
+    elif update_fields is not None and not set(update_fields) & set(ATTRIBUTE_FIELDS):
+        changed = False
+    else:
+        # Private characters are not indexed unless they were public before
+        changed = (instance.has_changed(*ATTRIBUTE_FIELDS)
+                   and (instance.public or instance.has_changed('public')))
+
+    if changed:
+        transaction.on_commit(invalidate_attribute_index)
+
+
+@receiver(post_delete, sender=Character)
+def invalidate_attribute_index_on_character_delete(sender, instance, **kwargs):
+    """
+    Rebuild the character attribute index after a public character was deleted
+    """
+    if instance.public:
+        transaction.on_commit(invalidate_attribute_index)
+
+
+@receiver([post_save, post_delete], sender=CharacterKink)
+def invalidate_attribute_index_on_kink_change(sender, instance, created=False, **kwargs):
+    """
+    Rebuild the character attribute index when a public character gained or
+    may have lost a positive kink
+    """
+    # The previous rating of an updated kink is unknown, so it may have been positive
+    updated = kwargs['signal'] is post_save and not created
+    if instance.rating not in POSITIVE_KINK_RATINGS and not updated:
+        return
+
+    # Rows deleted through querysets come without their character; rather
+    # than a query per row, their character counts as public
+    if CharacterKink.character.is_cached(instance) and not instance.character.public:
+        return
+
+    transaction.on_commit(invalidate_attribute_index)
+
+
+@receiver(character_kinks_changed)
+def invalidate_attribute_index_on_kink_sheet_change(sender, character_id, ratings=None, **kwargs):
+    """
+    Rebuild the character attribute index after a public character's kink
+    sheet was saved in bulk
+    """
+    if ratings and Character.objects.filter(pk=character_id, public=True).exists():
+        transaction.on_commit(invalidate_attribute_index)
 
 
 def update_user_preferences_from_rating(rating_instance):
@@ -0,0 +1,158 @@
+"""
+Vectorized user similarity engine.
+
+All ``CharacterRating`` rows are loaded in bulk into a sparse
+user x character matrix, and cosine (or adjusted cosine) similarities are
+computed for blocks of users with sparse matrix products instead of one query
+and one Python loop per candidate user.
+"""
+import logging
+
+import numpy as np
+from scipy import sparse
+
+from rpg_platform.apps.characters.models import CharacterRating
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of co-rated characters for two users to be considered similar
+MIN_COMMON_RATINGS = 2
+
+# Minimum number of ratings for a user to be considered as a neighbor
+MIN_NEIGHBOR_RATINGS = 3
+
+# Upper bound on the number of entries of each dense array materialized per
+# block: block ratings (block x characters) and similarities (block x users)
+BLOCK_ENTRIES = 2 ** 22
+
+
+class RatingMatrix:
+    """
+    Sparse user x character rating matrix with id <-> row/column lookups
+    """
+
+    def __init__(self, user_ids, character_ids, matrix):
+        self.user_ids = user_ids
+        self.character_ids = character_ids
+        self.matrix = matrix
+        self.user_index = {int(user_id): i for i, user_id in enumerate(user_ids)}
+        self.character_index = {int(character_id): i for i, character_id in enumerate(character_ids)}
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def build_rating_matrix(queryset=None):
+    """Load ratings in a single query and build a CSR rating matrix"""
+    if queryset is None:
+        queryset = CharacterRating.objects.all()
+
+    rows = np.array(
+        list(queryset.values_list('user_id', 'character_id', 'rating').iterator(chunk_size=10000)),
+        dtype=np.int64
+    ).reshape(-1, 3)
+
+    user_ids, user_rows = np.unique(rows[:, 0], return_inverse=True)
+    character_ids, character_cols = np.unique(rows[:, 1], return_inverse=True)
+
+    matrix = sparse.csr_matrix(
+        (rows[:, 2].astype(np.float32), (user_rows, character_cols)),
+        shape=(len(user_ids), len(character_ids))
+    )
+
+    logger.info(f"Built rating matrix: {len(user_ids)} users x {len(character_ids)} characters, {len(rows)} ratings")
+
+    return RatingMatrix(user_ids, character_ids, matrix)
+
+
+def normalize_rows(matrix, adjusted=False):
+    """
+    Scale each user's rating vector to unit length.
+
+    With ``adjusted`` the user's mean rating is subtracted from their ratings
+    first (adjusted cosine), which removes the bias of users who rate
+    everything high or low.
+    """
+    matrix = matrix.astype(np.float64, copy=True)
+
+    if adjusted:
+        counts = np.diff(matrix.indptr)
+        sums = np.asarray(matrix.sum(axis=1)).ravel()
+        means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        matrix.data -= np.repeat(means, counts)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    return sparse.diags(inverse) @ matrix
+
+
+def confidence_weight(common):
+    """Down-weight similarities backed by few co-rated characters"""
+    return np.minimum(1.0, common / 10.0) * 0.5 + 0.5
+
+
+def top_k_neighbors(rating_matrix, k=20, adjusted=False, min_common=MIN_COMMON_RATINGS,
+                    min_ratings=MIN_NEIGHBOR_RATINGS, user_ids=None):
+    """
+    Compute the ``k`` most similar users for every user (or for ``user_ids``).
+
+    With ``adjusted`` users are compared by adjusted cosine, see
+    ``normalize_rows``. Returns a dict mapping user id to a list of ``(other_user_id, score)``
+    tuples sorted by descending score.
+    """
+    n_users, n_characters = rating_matrix.shape
+    if not n_users:
+        return {}
+
+    normalized = normalize_rows(rating_matrix.matrix, adjusted=adjusted).astype(np.float32).tocsr()
+    rated = (rating_matrix.matrix != 0).astype(np.float32).tocsr()
+
+    # Only users with enough ratings can be neighbors
+    eligible = np.diff(rating_matrix.matrix.indptr) >= min_ratings
+
+    if user_ids is None:
+        rows = np.arange(n_users)
+    else:
+        rows = np.array(
+            [rating_matrix.user_index[u] for u in user_ids if u in rating_matrix.user_index],
+            dtype=np.int64
+        )
+
+    block_size = max(1, min(len(rows), BLOCK_ENTRIES // max(n_users, n_characters)))
+    k = min(k, n_users)
+    neighbors = {}
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        block_range = np.arange(len(block))
+
+        # Sparse x dense products make a single pass over the rating matrix
+        # and yield dense (block x users) similarity and co-rating counts
+        scores = np.asarray(normalized @ normalized[block].toarray().T).T
+        common = np.asarray(rated @ rated[block].toarray().T).T
+
+        scores = np.minimum(1.0, scores * confidence_weight(common))
+
+        invalid = (common < min_common) | ~eligible[np.newaxis, :] | (scores <= 0)
+        invalid[block_range, block] = True
+        scores[invalid] = -np.inf
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for offset, row in enumerate(block):
+            valid = np.isfinite(top_scores[offset])
+            neighbors[int(rating_matrix.user_ids[row])] = [
+                (int(rating_matrix.user_ids[column]), float(score))
+                for column, score in zip(top[offset][valid], top_scores[offset][valid])
+            ]
+
+    return neighbors
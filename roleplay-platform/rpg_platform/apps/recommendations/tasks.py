@@ -1,15 +1,25 @@
 from django.contrib.auth import get_user_model
 from django.db.models import Count, Avg, Q, F, Sum, Value, Case, When
+from django.utils import timezone
 from django.db import transaction
 import logging
-import math
 
 from rpg_platform.apps.characters.models import Character, CharacterRating, CharacterComment
-from .models import CharacterRecommendation, UserSimilarity, UserPreference
+from .models import CharacterRecommendation, UserRatingNorm, UserRatingOverlap, UserSimilarity, UserPreference
+from .candidates import top_scored_characters
+from .incremental import similarity_from_stats
+from .similarity import MIN_NEIGHBOR_RATINGS, build_rating_matrix, top_k_neighbors
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# Number of neighbors stored per user
+SIMILARITY_NEIGHBORS = 20
+
+# Similar users considered by recommend_from_similar_users
+SIMILAR_USER_THRESHOLD = 0.5
+SIMILAR_USER_LIMIT = 10
+
 
 def generate_recommendations_for_user(user_id):
     """
@@ -44,11 +54,16 @@ def generate_recommendations_for_user(user_id):
         Character.objects.filter(user=user).values_list('id', flat=True)
     )
 
+    # Dismissed recommendations are kept and must not be recommended again
+    dismissed_character_ids = set(
+        CharacterRecommendation.objects.filter(user=user, is_dismissed=True).values_list('character_id', flat=True)
+    )
+
     # Combine all characters to exclude from recommendations
-    excluded_character_ids = interacted_character_ids.union(own_character_ids)
+    excluded_character_ids = interacted_character_ids | own_character_ids | dismissed_character_ids
 
     # Only recommend public characters
-    base_queryset = Character.objects.filter(is_public=True).exclude(id__in=excluded_character_ids)
+    base_queryset = Character.objects.filter(public=True).exclude(id__in=excluded_character_ids)
 
     # Generate recommendations using different strategies
     recommendations = []
@@ -69,6 +84,9 @@ def generate_recommendations_for_user(user_id):
     recent_recs = recommend_recently_active(user, base_queryset)
     recommendations.extend(recent_recs)
 
+    # A character suggested by several strategies is stored once
+    recommendations = merge_recommendations(recommendations)
+
     # Save all recommendations to the database
     with transaction.atomic():
         CharacterRecommendation.objects.bulk_create(recommendations)
@@ -76,80 +94,73 @@ def generate_recommendations_for_user(user_id):
     logger.info(f"Generated {len(recommendations)} recommendations for user {user.username}")
 
 
+def merge_recommendations(recommendations):
+    """Keep the best scored recommendation per character"""
+    best = {}
+    for recommendation in recommendations:
+        current = best.get(recommendation.character_id)
+        if current is None or recommendation.score > current.score:
+            best[recommendation.character_id] = recommendation
+
+    return list(best.values())
+
+
+def recommendation_score_from_similar_users(avg_rating, count):
+    """Score a character rated highly by ``count`` similar users"""
+    return min(5.0, avg_rating * 0.8 + (count / 5) * 0.2 * 5)
+
+
+def popularity_score(avg_rating, rating_count):
+    """Score a character by its average rating and number of ratings"""
+    return min(5.0, (avg_rating * 0.8) + (min(1.0, rating_count / 10) * 0.2 * 5))
+
+
 def recommend_similar_to_rated(user, queryset, max_results=5):
     """Recommend characters similar to those the user has rated highly"""
     # Find characters the user has rated 4-5 stars
     highly_rated = CharacterRating.objects.filter(
         user=user,
         rating__gte=4
-    ).select_related('character')
+    )
 
     if not highly_rated.exists():
         return []
 
     # Get user's preferences
-    user_preferences = UserPreference.objects.filter(user=user)
-
-    preferences_by_attr = {}
-    for pref in user_preferences:
-        if pref.attribute not in preferences_by_attr:
-            preferences_by_attr[pref.attribute] = []
-        preferences_by_attr[pref.attribute].append({
-            'value': pref.value,
-            'weight': pref.weight
-        })
-
-    recommendations = []
-
-    # Get characters that match preferences
-    for character in queryset[:50]:  # Limit to prevent performance issues
-        score = 0
+    preferences = list(
+        UserPreference.objects.filter(user=user).values_list('attribute', 'value', 'weight')
+    )
 
-        # Score based on species preference
-        if 'species' in preferences_by_attr and character.species:
-            for pref in preferences_by_attr['species']:
-                if pref['value'].lower() == character.species.lower():
-                    score += pref['weight']
+    if not preferences:
+        return []
 
-        # Score based on gender preference
-        if 'gender' in preferences_by_attr and character.gender:
-            for pref in preferences_by_attr['gender']:
-                if pref['value'] == character.gender:
-                    score += pref['weight']
+    # Score the whole public catalog through the attribute index
+    top_characters = top_scored_characters(preferences, queryset, max_results)
 
-        # Only include if there's a meaningful match
-        if score > 0:
-            recommendations.append(
-                CharacterRecommendation(
-                    user=user,
-                    character=character,
-                    score=min(5.0, score),  # Cap at 5.0
-                    reason='similar_rating'
-                )
-            )
-
-    # Sort by score and limit results
-    recommendations.sort(key=lambda x: x.score, reverse=True)
-    return recommendations[:max_results]
+    return [
+        CharacterRecommendation(
+            user=user,
+            character_id=character_id,
+            score=min(5.0, score),  # Cap at 5.0
+            reason='similar_rating'
+        )
+        for character_id, score in top_characters
+    ]
 
 
 def recommend_popular_characters(user, queryset, max_results=3):
     """Recommend popular characters from the community"""
     # Find characters with high ratings and many comments
-    popular_characters = queryset.annotate(
-        avg_rating=Avg('ratings__rating'),
-        rating_count=Count('ratings'),
-        comment_count=Count('comments')
-    ).filter(
-        avg_rating__gte=4,
+    popular_characters = queryset.filter(
+        average_rating__gte=4,
         rating_count__gte=3
-    ).order_by('-avg_rating', '-rating_count', '-comment_count')[:max_results]
+    ).order_by('-average_rating', '-rating_count', '-comment_count')[:max_results]
 
     recommendations = []
 
     for character in popular_characters:
         # Score based on average rating and number of ratings
-        score = min(5.0, (character.avg_rating * 0.8) + (min(1.0, character.rating_count / 10) * 0.2 * 5))
+        score = popularity_score(character.average_rating, character.rating_count)
 
         recommendations.append(
             CharacterRecommendation(
@@ -163,63 +174,80 @@ def recommend_popular_characters(user, queryset, max_results=3):
     return recommendations
 
 
-def recommend_from_similar_users(user, queryset, max_results=5):
-    """Recommend characters that similar users have rated highly"""
-    # Find similar users
-    similar_users = UserSimilarity.objects.filter(
-        user1=user,
-        similarity_score__gte=0.5
-    ).order_by('-similarity_score')[:10]
-
-    if not similar_users.exists():
-        # Calculate similarities first if none exist
-        calculate_user_similarities(user)
-        similar_users = UserSimilarity.objects.filter(
-            user1=user,
-            similarity_score__gte=0.5
-        ).order_by('-similarity_score')[:10]
+def recommend_from_similar_users(user, queryset, max_results=5, neighbors=None):
+    """
+    Recommend characters that similar users have rated highly
 
-    similar_user_ids = [sim.user2_id for sim in similar_users]
+    ``neighbors`` may be a precomputed list of ``(user_id, score)`` tuples
+    from the similarity engine; otherwise stored similarities are used.
+    """
+    # Find similar users
+    if neighbors is None:
+        similar_user_ids = get_similar_user_ids(user)
+
+        if not similar_user_ids:
+            # Calculate similarities first if none exist
+            calculate_user_similarities(user)
+            similar_user_ids = get_similar_user_ids(user)
+    else:
+        similar_user_ids = [
+            other_id for other_id, score in neighbors
+            if score >= SIMILAR_USER_THRESHOLD
+        ][:SIMILAR_USER_LIMIT]
 
     if not similar_user_ids:
         return []
 
     # Get characters that similar users have rated highly
-    highly_rated_characters = CharacterRating.objects.filter(
+    highly_rated_characters = list(CharacterRating.objects.filter(
         user_id__in=similar_user_ids,
         rating__gte=4
     ).values('character_id').annotate(
         avg_rating=Avg('rating'),
         count=Count('character_id')
-    ).filter(count__gte=2).order_by('-avg_rating', '-count')
+    ).filter(count__gte=2).order_by('-avg_rating', '-count'))
+
+    # Check all candidates against the allowed queryset in one query
+    available_ids = set(queryset.filter(
+        id__in=[item['character_id'] for item in highly_rated_characters]
+    ).values_list('id', flat=True))
 
     recommendations = []
 
     for item in highly_rated_characters:
-        try:
-            character = queryset.get(id=item['character_id'])
-
-            # Score based on average rating and similarity of users
-            score = min(5.0, item['avg_rating'] * 0.8 + (item['count'] / 5) * 0.2 * 5)
-
-            recommendations.append(
-                CharacterRecommendation(
-                    user=user,
-                    character=character,
-                    score=score,
-                    reason='friend_rated'
-                )
-            )
+        if item['character_id'] not in available_ids:
+            continue
 
-            if len(recommendations) >= max_results:
-                break
+        # Score based on average rating and similarity of users
+        score = recommendation_score_from_similar_users(item['avg_rating'], item['count'])
 
-        except Character.DoesNotExist:
-            continue
+        recommendations.append(
+            CharacterRecommendation(
+                user=user,
+                character_id=item['character_id'],
+                score=score,
+                reason='friend_rated'
+            )
+        )
+
+        if len(recommendations) >= max_results:
+            break
 
     return recommendations
 
 
+def get_similar_user_ids(user):
+    """Get the ids of the users most similar to ``user`` from stored similarities"""
+    return list(similar_users_queryset().filter(
+        user1=user
+    ).order_by('-similarity_score').values_list('user2_id', flat=True)[:SIMILAR_USER_LIMIT])
+
+
+def similar_users_queryset():
+    """Stored similarities that qualify a user as similar"""
+    return UserSimilarity.objects.filter(similarity_score__gte=SIMILAR_USER_THRESHOLD)
+
+
 def recommend_recently_active(user, queryset, max_results=3):
     """Recommend recently active characters"""
     # Get recently updated characters
@@ -240,58 +268,33 @@ def recommend_recently_active(user, queryset, max_results=3):
     return recommendations
 
 
-def calculate_user_similarities(user):
-    """Calculate similarity between a user and other users based on ratings"""
-    # Get all users who have rated at least 3 characters
-    active_users = User.objects.annotate(
-        rating_count=Count('character_ratings')
-    ).filter(
-        rating_count__gte=3
-    ).exclude(
-        id=user.id
-    )[:50]  # Limit to prevent performance issues
-
-    # Get this user's ratings
-    user_ratings = {
-        r.character_id: r.rating
-        for r in CharacterRating.objects.filter(user=user)
-    }
+def co_rater_matrix(user_id):
+    """Rating matrix of a user and every user sharing a rated character"""
+    # Only users who share at least one rated character can be similar, so
+    # the rating matrix is restricted to them
+    rated_character_ids = CharacterRating.objects.filter(user_id=user_id).values('character_id')
+    co_rater_ids = CharacterRating.objects.filter(
+        character_id__in=rated_character_ids
+    ).values('user_id')
 
-    if not user_ratings:
-        return
-
-    similarities = []
-
-    for other_user in active_users:
-        # Get other user's ratings
-        other_ratings = {
-            r.character_id: r.rating
-            for r in CharacterRating.objects.filter(user=other_user)
-        }
-
-        # Find common rated characters
-        common_characters = set(user_ratings.keys()) & set(other_ratings.keys())
+    return build_rating_matrix(
+        CharacterRating.objects.filter(user_id__in=co_rater_ids)
+    )
 
-        if len(common_characters) < 2:
-            continue  # Not enough common ratings
 
-        # Calculate cosine similarity
-        dot_product = sum(user_ratings[cid] * other_ratings[cid] for cid in common_characters)
-        magnitude1 = math.sqrt(sum(rating ** 2 for rating in user_ratings.values()))
-        magnitude2 = math.sqrt(sum(rating ** 2 for rating in other_ratings.values()))
+def calculate_user_similarities(user, k=SIMILARITY_NEIGHBORS):
+    """Calculate similarity between a user and other users based on ratings"""
+    rating_matrix = co_rater_matrix(user.id)
 
-        similarity = dot_product / (magnitude1 * magnitude2) if magnitude1 * magnitude2 > 0 else 0
+    if user.id not in rating_matrix.user_index:
+        return []
 
-        # Add weight for number of common ratings
-        similarity_adj = similarity * (min(1, len(common_characters) / 10) * 0.5 + 0.5)
+    neighbors = top_k_neighbors(rating_matrix, k=k, user_ids=[user.id]).get(user.id, [])
 
-        similarities.append(
-            UserSimilarity(
-                user1=user,
-                user2=other_user,
-                similarity_score=min(1.0, similarity_adj)
-            )
-        )
+    similarities = [
+        UserSimilarity(user1=user, user2_id=other_id, similarity_score=score)
+        for other_id, score in neighbors
+    ]
 
     # Save all similarities
     with transaction.atomic():
@@ -302,3 +305,127 @@ def calculate_user_similarities(user):
         UserSimilarity.objects.bulk_create(similarities)
 
     return similarities
+
+
+def refresh_user_similarities(user_id, k=SIMILARITY_NEIGHBORS):
+    """
+    Bring the stored similarities of a user whose ratings changed up to date.
+
+    Run by the recommendation worker for jobs with ``refresh_similarities``.
+    Scores come from the rating statistics kept by ``incremental``, so no
+    ratings are read. The user's neighbors become their top ``k``, with the
+    same rules as ``rebuild_user_similarities``. Pairs of other users with
+    this user are rescored, dropped once they no longer qualify, or added
+    when the user now ranks among the other user's top ``k``, whose weakest
+    neighbor then makes room. Only rows whose score changed are written.
+    """
+    norm = UserRatingNorm.objects.filter(user_id=user_id).first()
+    overlaps = list(UserRatingOverlap.objects.filter(user1_id=user_id).values_list(
+        'user2_id', 'dot_product', 'common_count',
+        'user2__rating_norm__sum_of_squares', 'user2__rating_norm__rating_count'
+    ))
+
+    if norm is None or not norm.rating_count:
+        # The user has no ratings left, so they are similar to nobody
+        UserSimilarity.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).delete()
+        return []
+
+    scored = []
+    for other_id, dot_product, common_count, other_sum_of_squares, other_count in overlaps:
+        score = similarity_from_stats(dot_product, common_count, norm.sum_of_squares, other_sum_of_squares or 0)
+        if score > 0:
+            scored.append((other_id, score, other_count or 0))
+    scored.sort(key=lambda item: -item[1])
+
+    neighbors = [
+        (other_id, score) for other_id, score, other_count in scored
+        if other_count >= MIN_NEIGHBOR_RATINGS
+    ][:k]
+
+    # The user can only be the neighbor of others with enough ratings
+    reverse_scores = {
+        other_id: score for other_id, score, _ in scored
+    } if norm.rating_count >= MIN_NEIGHBOR_RATINGS else {}
+
+    now = timezone.now()
+    to_update, to_delete, to_create = [], [], []
+
+    def rescore(row, score):
+        if row.similarity_score != score:
+            row.similarity_score = score
+            row.updated_at = now
+            to_update.append(row)
+
+    with transaction.atomic():
+        own_scores = dict(neighbors)
+        for row in UserSimilarity.objects.filter(user1_id=user_id):
+            score = own_scores.pop(row.user2_id, None)
+            if score is None:
+                to_delete.append(row.pk)
+            else:
+                rescore(row, score)
+        to_create.extend(
+            UserSimilarity(user1_id=user_id, user2_id=other_id, similarity_score=score)
+            for other_id, score in own_scores.items()
+        )
+
+        for row in UserSimilarity.objects.filter(user2_id=user_id):
+            score = reverse_scores.pop(row.user1_id, None)
+            if score is None:
+                to_delete.append(row.pk)
+            else:
+                rescore(row, score)
+
+        # Remaining scores are pairs the other user does not store yet
+        stored = {}
+        for other_id, pk, score in UserSimilarity.objects.filter(
+            user1_id__in=reverse_scores
+        ).exclude(pk__in=to_delete).values_list('user1_id', 'pk', 'similarity_score'):
+            stored.setdefault(other_id, []).append((score, pk))
+
+        for other_id, score in reverse_scores.items():
+            other_neighbors = stored.get(other_id, [])
+            if len(other_neighbors) >= k:
+                weakest_score, weakest_pk = min(other_neighbors)
+                if score <= weakest_score:
+                    continue
+                to_delete.append(weakest_pk)
+            to_create.append(UserSimilarity(user1_id=other_id, user2_id=user_id, similarity_score=score))
+
+        if to_delete:
+            UserSimilarity.objects.filter(pk__in=to_delete).delete()
+        UserSimilarity.objects.bulk_update(to_update, ['similarity_score', 'updated_at'])
+        UserSimilarity.objects.bulk_create(to_create)
+
+    logger.debug(f"Refreshed similarities of user {user_id}: {len(to_update)} rescored, "
+                 f"{len(to_create)} added, {len(to_delete)} removed")
+
+    return neighbors
+
+
+def rebuild_user_similarities(k=SIMILARITY_NEIGHBORS, batch_size=5000):
+    """
+    Recalculate stored similarities for all users at once.
+
+    Returns the neighbor lists computed by the similarity engine.
+    """
+    rating_matrix = build_rating_matrix()
+    neighbors = top_k_neighbors(rating_matrix, k=k)
+
+    with transaction.atomic():
+        UserSimilarity.objects.all().delete()
+
+        batch = []
+        for user_id, user_neighbors in neighbors.items():
+            for other_id, score in user_neighbors:
+                batch.append(UserSimilarity(user1_id=user_id, user2_id=other_id, similarity_score=score))
+
+            if len(batch) >= batch_size:
+                UserSimilarity.objects.bulk_create(batch)
+                batch = []
+
+        UserSimilarity.objects.bulk_create(batch)
+
+    logger.info(f"Rebuilt user similarities for {len(neighbors)} users")
+
+    return neighbors
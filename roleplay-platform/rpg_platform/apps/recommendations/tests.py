@@ -0,0 +1,506 @@
+import math
+from io import StringIO
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rpg_platform.apps.characters.models import Character, CharacterKink, CharacterRating, Kink, KinkCategory
+from rpg_platform.utils.cache import get_version
+from .candidates import INDEX_VERSION_KEY, invalidate_attribute_index
+from .batch import SharedRecommendationData, build_chunk_recommendations
+from .incremental import rebuild_rating_statistics
+from .models import (
+    CharacterRecommendation, RecommendationJob, RecommendationRebuild, UserPreference, UserRatingNorm,
+    UserRatingOverlap, UserSimilarity
+)
+from .queue import enqueue_recommendation_refresh, run_pending_jobs
+from .similarity import build_rating_matrix, top_k_neighbors
+from .tasks import (
+    calculate_user_similarities, generate_recommendations_for_user, rebuild_user_similarities,
+    recommend_similar_to_rated, refresh_user_similarities
+)
+
+User = get_user_model()
+
+
+class RecommendationQueueTests(TestCase):
+    """
+    Tests for the coalescing recommendation job queue.
+    """
+
+    def setUp(self):
+        """Set up a rater and a handful of characters to rate."""
+        self.user = User.objects.create_user(
+            username='rater',
+            email='rater@example.com',
+            password='testpassword'
+        )
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@example.com',
+            password='testpassword'
+        )
+        self.characters = [
+            Character.objects.create(user=self.owner, name=f'Character {i}', gender='female', species='elf')
+            for i in range(20)
+        ]
+
+    def test_rating_burst_creates_single_job(self):
+        """Test that a burst of ratings from one user queues one job."""
+        with self.captureOnCommitCallbacks(execute=True):
+            for character in self.characters:
+                CharacterRating.objects.create(character=character, user=self.user, rating=5)
+
+        self.assertEqual(RecommendationJob.objects.filter(user=self.user).count(), 1)
+
+    def test_rating_does_not_regenerate_inline(self):
+        """Test that rating a character does not run the recommendation strategies."""
+        with mock.patch('rpg_platform.apps.recommendations.tasks.generate_recommendations_for_user') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                CharacterRating.objects.create(character=self.characters[0], user=self.user, rating=4)
+
+        generate.assert_not_called()
+
+    def test_burst_produces_one_recompute(self):
+        """Test that coalesced triggers are served by a single regeneration."""
+        for _ in range(20):
+            enqueue_recommendation_refresh(self.user.id, delay=timedelta(0))
+
+        with mock.patch('rpg_platform.apps.recommendations.tasks.generate_recommendations_for_user') as generate:
+            processed = run_pending_jobs('test-worker')
+
+        self.assertEqual(processed, 1)
+        generate.assert_called_once_with(self.user.id)
+        self.assertFalse(RecommendationJob.objects.exists())
+
+    def test_jobs_wait_for_coalescing_window(self):
+        """Test that jobs are not picked up before their window expires."""
+        enqueue_recommendation_refresh(self.user.id)
+
+        with mock.patch('rpg_platform.apps.recommendations.tasks.generate_recommendations_for_user') as generate:
+            processed = run_pending_jobs('test-worker')
+
+        self.assertEqual(processed, 0)
+        generate.assert_not_called()
+
+    def test_trigger_during_run_requeues_job(self):
+        """Test that activity while a job runs schedules another regeneration."""
+        enqueue_recommendation_refresh(self.user.id, delay=timedelta(0))
+
+        def trigger_again(user_id):
+            RecommendationJob.objects.filter(user_id=user_id).update(
+                requested_at=timezone.now() + timedelta(seconds=1)
+            )
+
+        with mock.patch('rpg_platform.apps.recommendations.tasks.generate_recommendations_for_user', side_effect=trigger_again):
+            run_pending_jobs('test-worker')
+
+        job = RecommendationJob.objects.get(user=self.user)
+        self.assertIsNone(job.locked_at)
+        self.assertGreater(job.run_after, timezone.now())
+
+
+class SimilarityEngineTests(TestCase):
+    """
+    Tests for the vectorized user similarity engine.
+    """
+
+    RATINGS = {
+        'alice': [5, 4, 1, 0, 3],
+        'bob': [4, 5, 2, 1, 0],
+        'carol': [1, 0, 5, 4, 2],
+        'dave': [0, 4, 1, 5, 5],
+    }
+
+    def setUp(self):
+        """Create users and their ratings from the RATINGS table."""
+        owner = User.objects.create_user(username='owner', password='testpassword')
+        characters = [
+            Character.objects.create(user=owner, name=f'Character {i}', gender='male', species='human')
+            for i in range(5)
+        ]
+
+        self.users = {}
+        for username, ratings in self.RATINGS.items():
+            user = User.objects.create_user(username=username, password='testpassword')
+            self.users[username] = user
+            for character, rating in zip(characters, ratings):
+                if rating:
+                    CharacterRating.objects.create(character=character, user=user, rating=rating)
+
+    def expected_similarity(self, first, second):
+        """Cosine similarity with the co-rating confidence factor, computed naively."""
+        a, b = self.RATINGS[first], self.RATINGS[second]
+        common = sum(1 for x, y in zip(a, b) if x and y)
+        dot = sum(x * y for x, y in zip(a, b))
+        cosine = dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)))
+        return min(1.0, cosine * (min(1, common / 10) * 0.5 + 0.5))
+
+    def test_neighbors_match_naive_cosine(self):
+        """Test that batched similarities equal the per-pair computation."""
+        neighbors = top_k_neighbors(build_rating_matrix(), k=10)
+
+        for username, user in self.users.items():
+            scores = dict(neighbors[user.id])
+            for other_name, other in self.users.items():
+                if other_name == username:
+                    self.assertNotIn(other.id, scores)
+                    continue
+                self.assertAlmostEqual(scores[other.id], self.expected_similarity(username, other_name), places=5)
+
+    def test_blocks_are_bounded_by_characters_too(self):
+        """Test that small blocks, sized for a catalog wider than the user base, give the same neighbors."""
+        rating_matrix = build_rating_matrix()
+        expected = top_k_neighbors(rating_matrix, k=10)
+
+        # Five characters per rating row, so a block holds a single user
+        with mock.patch('rpg_platform.apps.recommendations.similarity.BLOCK_ENTRIES', 9):
+            self.assertEqual(top_k_neighbors(rating_matrix, k=10), expected)
+
+    def test_adjusted_cosine_ignores_rating_baselines(self):
+        """Test that adjusted cosine matches tastes rather than how high users rate."""
+        characters = list(Character.objects.order_by('pk')[:4])
+        raters = {}
+        for username, ratings in [('high', [5, 4, 5, 4]), ('low', [3, 2, 3, 2]), ('flipped', [4, 5, 4, 5])]:
+            raters[username] = User.objects.create_user(username=username, password='testpassword')
+            for character, rating in zip(characters, ratings):
+                CharacterRating.objects.create(character=character, user=raters[username], rating=rating)
+
+        rating_matrix = build_rating_matrix(CharacterRating.objects.filter(user__in=raters.values()))
+        high = raters['high'].id
+        plain = dict(top_k_neighbors(rating_matrix)[high])
+        adjusted = dict(top_k_neighbors(rating_matrix, adjusted=True)[high])
+
+        # Opposite tastes, but every rating is high, which is all plain cosine sees
+        self.assertIn(raters['flipped'].id, plain)
+        self.assertNotIn(raters['flipped'].id, adjusted)
+        self.assertLess(plain[raters['low'].id], adjusted[raters['low'].id])
+        self.assertAlmostEqual(adjusted[raters['low'].id], 0.7, places=5)
+
+    def test_top_k_limits_and_orders_neighbors(self):
+        """Test that only the k best neighbors are returned, best first."""
+        neighbors = top_k_neighbors(build_rating_matrix(), k=2)
+
+        for user_neighbors in neighbors.values():
+            self.assertLessEqual(len(user_neighbors), 2)
+            scores = [score for _, score in user_neighbors]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_calculate_user_similarities_persists_neighbors(self):
+        """Test that similarities for a single user are stored."""
+        alice = self.users['alice']
+        calculate_user_similarities(alice)
+
+        stored = dict(UserSimilarity.objects.filter(user1=alice).values_list('user2__username', 'similarity_score'))
+        self.assertEqual(set(stored), {'bob', 'carol', 'dave'})
+        self.assertAlmostEqual(stored['bob'], self.expected_similarity('alice', 'bob'), places=5)
+
+
+class SimilarityRefreshTests(TestCase):
+    """
+    Tests for the similarity refresh queued by rating changes.
+    """
+
+    RATINGS = [[5, 3, 4, 1], [4, 2, 5, 5], [1, 5, 2, 3]]
+
+    def setUp(self):
+        """Create users and characters without any ratings."""
+        owner = User.objects.create_user(username='owner', password='testpassword')
+        self.characters = [
+            Character.objects.create(user=owner, name=f'Character {i}', gender='male', species='human')
+            for i in range(4)
+        ]
+        self.users = [
+            User.objects.create_user(username=f'user{i}', password='testpassword')
+            for i in range(3)
+        ]
+
+    def rate(self, user, character, rating):
+        """Create or change a rating and queue its jobs."""
+        with self.captureOnCommitCallbacks(execute=True):
+            rating_obj = CharacterRating.objects.filter(user=user, character=character).first()
+            if rating_obj is None:
+                CharacterRating.objects.create(user=user, character=character, rating=rating)
+            else:
+                rating_obj.rating = rating
+                rating_obj.save()
+
+    def run_jobs(self):
+        """Run every queued job without waiting for the coalescing window."""
+        RecommendationJob.objects.update(run_after=timezone.now())
+        with mock.patch('rpg_platform.apps.recommendations.tasks.generate_recommendations_for_user'):
+            while run_pending_jobs('test-worker'):
+                pass
+
+    def stored_similarities(self):
+        return {
+            (user1_id, user2_id): round(score, 5)
+            for user1_id, user2_id, score in UserSimilarity.objects.values_list('user1_id', 'user2_id', 'similarity_score')
+        }
+
+    def test_rating_queues_refresh_instead_of_updating_inline(self):
+        """Test that rating only queues a job flagged to refresh similarities."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+
+        self.assertFalse(UserSimilarity.objects.exists())
+        self.assertEqual(RecommendationJob.objects.filter(refresh_similarities=True).count(), 3)
+
+    def test_refresh_matches_batch_rebuild(self):
+        """Test that refreshed similarities equal those of the batch engine."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+        self.run_jobs()
+
+        self.rate(self.users[0], self.characters[1], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterRating.objects.get(user=self.users[1], character=self.characters[2]).delete()
+        self.run_jobs()
+
+        refreshed = self.stored_similarities()
+        self.assertTrue(refreshed)
+        self.assertTrue(all(score > 0 for score in refreshed.values()))
+
+        rebuild_user_similarities()
+        self.assertEqual(refreshed, self.stored_similarities())
+
+    def test_refresh_keeps_top_k(self):
+        """Test that a refresh adds the user to other lists only in place of weaker neighbors."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                CharacterRating.objects.create(user=user, character=character, rating=rating)
+        rebuild_user_similarities(k=1)
+
+        for character in self.characters:
+            self.rate(self.users[2], character, 5)
+        refresh_user_similarities(self.users[2].id, k=1)
+
+        for user in self.users:
+            self.assertLessEqual(UserSimilarity.objects.filter(user1=user).count(), 1)
+
+        expected = top_k_neighbors(build_rating_matrix(), k=1)
+        self.assertEqual(
+            list(UserSimilarity.objects.filter(user1=self.users[2]).values_list('user2_id', flat=True)),
+            [other_id for other_id, _ in expected[self.users[2].id]]
+        )
+
+    def stored_statistics(self):
+        return (
+            set(UserRatingNorm.objects.values_list('user_id', 'sum_of_squares', 'rating_count')),
+            set(UserRatingOverlap.objects.values_list('user1_id', 'user2_id', 'dot_product', 'common_count')),
+        )
+
+    def test_statistics_follow_rating_changes(self):
+        """Test that rating changes adjust norms and pairs to what a rebuild computes."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+        self.rate(self.users[0], self.characters[1], 1)
+        CharacterRating.objects.get(user=self.users[1], character=self.characters[2]).delete()
+        self.characters[3].delete()
+
+        adjusted = self.stored_statistics()
+        self.assertIn((self.users[0].id, self.users[2].id, 5.0 + 5 + 8, 3), adjusted[1])
+
+        rebuild_rating_statistics()
+        self.assertEqual(adjusted, self.stored_statistics())
+
+    def test_rating_adjusts_statistics_with_fixed_queries(self):
+        """Test that the work of a rating does not grow with the raters of the character."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+        for i in range(10):
+            rater = User.objects.create_user(username=f'rater{i}', password='testpassword')
+            CharacterRating.objects.create(user=rater, character=self.characters[0], rating=3)
+
+        rating = CharacterRating.objects.get(user=self.users[0], character=self.characters[0])
+        rating.rating = 2
+        # The rating and its character's aggregates, the rater's norm and
+        # both directions of the pairs, inside a savepoint
+        with self.assertNumQueries(8):
+            rating.save()
+
+    def test_refresh_writes_only_changed_pairs(self):
+        """Test that refreshing a user whose scores did not change writes nothing."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+        self.run_jobs()
+
+        with CaptureQueriesContext(connection) as queries:
+            refresh_user_similarities(self.users[0].id)
+
+        self.assertFalse([
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ])
+
+    def test_deleting_last_rating_removes_pairs(self):
+        """Test that a user without ratings has no similarities."""
+        for user, ratings in zip(self.users, self.RATINGS):
+            for character, rating in zip(self.characters, ratings):
+                self.rate(user, character, rating)
+        self.run_jobs()
+        self.assertTrue(UserSimilarity.objects.filter(user2=self.users[0]).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CharacterRating.objects.filter(user=self.users[0]).delete()
+        self.run_jobs()
+
+        self.assertFalse(UserSimilarity.objects.filter(user1=self.users[0]).exists())
+        self.assertFalse(UserSimilarity.objects.filter(user2=self.users[0]).exists())
+
+
+class CandidateScoringTests(TestCase):
+    """
+    Tests for preference scoring through the attribute index.
+    """
+
+    def setUp(self):
+        """Create a catalog larger than the old 50 character sample."""
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        owner = User.objects.create_user(username='owner', password='testpassword')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.characters = [
+                Character.objects.create(user=owner, name=f'Filler {i}', gender='male', species='human')
+                for i in range(60)
+            ]
+            self.best = Character.objects.create(user=owner, name='Best', gender='Female', species=' Elf ')
+            self.good = Character.objects.create(user=owner, name='Good', gender='female', species='orc')
+            self.hidden = Character.objects.create(
+                user=owner, name='Hidden', gender='female', species='elf', public=False
+            )
+            # Created last so it is first in catalog order, but excluded below
+            self.rated = Character.objects.create(user=owner, name='Rated', gender='female', species='elf')
+            CharacterRating.objects.create(user=self.user, character=self.rated, rating=5)
+
+        self.kink = Kink.objects.create(category=KinkCategory.objects.create(name='General'), name='Fluff')
+
+        UserPreference.objects.filter(user=self.user).delete()
+        UserPreference.objects.create(user=self.user, attribute='species', value='elf', weight=2.0)
+        UserPreference.objects.create(user=self.user, attribute='gender', value='female', weight=1.0)
+
+    def tearDown(self):
+        invalidate_attribute_index()
+
+    def test_scores_whole_catalog(self):
+        """Test that matches beyond the first 50 characters are found and ranked."""
+        queryset = Character.objects.filter(public=True).exclude(id=self.rated.id)
+        recommendations = recommend_similar_to_rated(self.user, queryset)
+
+        self.assertEqual(
+            [(r.character_id, r.score) for r in recommendations],
+            [(self.best.id, 3.0), (self.good.id, 1.0)]
+        )
+
+    def test_index_follows_catalog_changes(self):
+        """Test that a committed character change invalidates the index."""
+        queryset = Character.objects.filter(public=True).exclude(id=self.rated.id)
+        recommend_similar_to_rated(self.user, queryset)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hidden.public = True
+            self.hidden.save()
+
+        recommendations = recommend_similar_to_rated(self.user, queryset)
+        self.assertEqual(
+            [r.character_id for r in recommendations],
+            [self.hidden.id, self.best.id, self.good.id]
+        )
+
+    def test_only_indexed_changes_invalidate_index(self):
+        """Test that saves of unindexed fields or private characters keep the index."""
+        version = get_version(INDEX_VERSION_KEY)
+        hidden = Character.objects.get(pk=self.hidden.pk)
+        best = Character.objects.get(pk=self.best.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            best.personality = 'Cheerful'
+            best.save()
+            hidden.species = 'orc'
+            hidden.save()
+            CharacterKink.objects.create(character=best, kink=self.kink, rating='no')
+        self.assertEqual(get_version(INDEX_VERSION_KEY), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            best.species = 'orc'
+            best.save()
+        self.assertGreater(get_version(INDEX_VERSION_KEY), version)
+
+
+class BatchRebuildTests(TestCase):
+    """
+    Tests for the batch recommendation rebuild.
+    """
+
+    def setUp(self):
+        """Create raters with overlapping tastes and a small catalog."""
+        owner = User.objects.create_user(username='owner', password='testpassword')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.characters = [
+                Character.objects.create(
+                    user=owner, name=f'Character {i}', gender=['male', 'female'][i % 2],
+                    species=['elf', 'human', 'orc'][i % 3]
+                )
+                for i in range(12)
+            ]
+
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword') for i in range(5)]
+        for i, user in enumerate(self.users):
+            for j, character in enumerate(self.characters):
+                if (i + j) % 3 != 0:
+                    CharacterRating.objects.create(user=user, character=character, rating=(i * j) % 5 + 1)
+
+        rebuild_user_similarities()
+
+    def tearDown(self):
+        invalidate_attribute_index()
+
+    def stored_recommendations(self):
+        return set(CharacterRecommendation.objects.values_list('user_id', 'character_id', 'reason'))
+
+    def test_batch_matches_per_user_generation(self):
+        """Test that chunked generation produces the same recommendations."""
+        for user in self.users:
+            generate_recommendations_for_user(user.id)
+        expected = self.stored_recommendations()
+
+        recommendations = build_chunk_recommendations([user.id for user in self.users], SharedRecommendationData())
+
+        self.assertEqual({(r.user_id, r.character_id, r.reason) for r in recommendations}, expected)
+
+    def test_command_rebuilds_all_active_users(self):
+        """Test that the command records progress and finishes the run."""
+        call_command('rebuild_recommendations', workers=1, chunk_size=2, skip_similarities=True, stdout=StringIO())
+
+        run = RecommendationRebuild.objects.get()
+        self.assertTrue(run.is_finished)
+        self.assertEqual(run.processed_users, User.objects.filter(is_active=True).count())
+        self.assertEqual(run.recommendation_count, CharacterRecommendation.objects.count())
+
+    def test_resume_skips_completed_chunks(self):
+        """Test that resuming only processes users outside completed chunks."""
+        user_ids = sorted(User.objects.values_list('id', flat=True))
+        RecommendationRebuild.objects.create(
+            chunk_size=2,
+            processed_users=2,
+            completed_ranges=[[user_ids[0], user_ids[1]]]
+        )
+
+        call_command('rebuild_recommendations', workers=1, resume=True, stdout=StringIO())
+
+        run = RecommendationRebuild.objects.get()
+        self.assertTrue(run.is_finished)
+        self.assertEqual(run.processed_users, len(user_ids))
+        self.assertFalse(CharacterRecommendation.objects.filter(user_id__in=user_ids[:2]).exists())
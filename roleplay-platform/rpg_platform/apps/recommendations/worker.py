@@ -0,0 +1,75 @@
+"""
+Worker process entry point for the recommendation job queue.
+
+This module deliberately avoids importing models at import time so it can be
+used as a ``multiprocessing`` target on platforms that spawn fresh
+interpreters (Windows) as well as those that fork.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def worker_loop(poll_interval=1.0, batch_size=10, once=False):
+    """Poll the job queue and regenerate recommendations until interrupted"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    from django.db import close_old_connections
+    from .queue import default_worker_id, run_pending_jobs
+
+    worker_id = default_worker_id()
+    logger.info(f"Recommendation worker {worker_id} started")
+
+    try:
+        while True:
+            close_old_connections()
+            processed = run_pending_jobs(worker_id, limit=batch_size)
+
+            if once and not processed:
+                break
+
+            # Keep draining while there is work, otherwise back off
+            if not processed:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+    logger.info(f"Recommendation worker {worker_id} stopped")
+
+
+_shared_data = None
+
+
+def init_rebuild_worker():
+    """Pool initializer: set up Django and load the shared catalog data once"""
+    global _shared_data
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    from .batch import SharedRecommendationData
+
+    _shared_data = SharedRecommendationData()
+
+
+def rebuild_chunk_worker(user_ids):
+    """
+    Pool task: rebuild recommendations for a chunk of users.
+
+    Returns ``(first_user_id, last_user_id, user_count, recommendation_count)``.
+    """
+    from django.db import close_old_connections
+    from .batch import rebuild_recommendation_chunk
+
+    close_old_connections()
+    written = rebuild_recommendation_chunk(user_ids, _shared_data)
+
+    return user_ids[0], user_ids[-1], len(user_ids), written
@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     # Project apps
+    "rpg_platform.apps.core",
     "rpg_platform.apps.accounts",
     "rpg_platform.apps.characters",
     "rpg_platform.apps.messages.apps.MessagesConfig",  # Use the config class with custom label
@@ -79,9 +80,16 @@ WSGI_APPLICATION = "rpg_platform.rpg_platform.wsgi.application"
 ASGI_APPLICATION = "rpg_platform.rpg_platform.asgi.application"
 
 # Channel layers for WebSocket
+# Shared by every worker process on this host through a SQLite file; use
+# channels_redis when the workers run on several hosts
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": "rpg_platform.utils.channel_layers.SQLiteChannelLayer",
+        "CONFIG": {
+            "path": BASE_DIR / "channels.sqlite3",
+            "expiry": 60,
+            "capacity": 100,
+        },
     },
 }
 
@@ -165,6 +173,35 @@ CACHES = {
     }
 }
 
+# Seconds a process keeps using a cache version before reading it again from the database,
+# so changes made in other processes are seen within this delay
+CACHE_VERSION_CHECK_INTERVAL = 2
+
+# Recommendation job queue
+# Triggers for the same user within this many seconds produce one regeneration
+RECOMMENDATION_JOB_COALESCE_SECONDS = 30
+RECOMMENDATION_JOB_LOCK_TIMEOUT = 300
+RECOMMENDATION_JOB_MAX_ATTEMPTS = 5
+
+# Character detail fragment cache
+# Seconds in the shared cache, and fragments kept per process
+CHARACTER_DETAIL_CACHE_TIMEOUT = 60 * 60
+CHARACTER_DETAIL_CACHE_LOCAL_SIZE = 256
+
+# Notification sockets batch events and count updates over this many seconds
+NOTIFICATION_PUSH_WINDOW = 0.25
+
+# Likes, ratings and comments on one character within this many seconds of
+# each other are folded into a single notification
+NOTIFICATION_AGGREGATION_WINDOW = 6 * 60 * 60
+
+# Chat messages are stored in batches of this many, or after this many seconds
+CHAT_WRITE_BATCH_SIZE = 100
+CHAT_WRITE_INTERVAL = 0.2
+
+# Failed flushes in a row after which chat messages are stored one by one, dropping failing ones
+CHAT_WRITE_ATTEMPTS = 3
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
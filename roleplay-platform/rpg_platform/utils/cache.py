@@ -0,0 +1,110 @@
+"""
+Caching helpers shared by the apps.
+
+``LocalLRUCache`` is a bounded in-process cache put in front of the shared
+Django cache. Entries are never invalidated in place: callers include a
+version number from ``get_version`` in their keys and call ``bump_version``
+after a change.
+
+Versions are stored in the ``CacheVersion`` table, which every process
+reads, and each process keeps the versions it read in the Django cache for
+``CACHE_VERSION_CHECK_INTERVAL`` seconds. A change is seen at once by the
+process making it and within that delay by every other process, whatever
+cache backend is configured.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+# Seconds a version read from the database is used before reading it again
+DEFAULT_VERSION_CHECK_INTERVAL = 2
+
+
+class LocalLRUCache:
+    """
+    Thread-safe least-recently-used cache local to the process
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_version_check_interval():
+    return getattr(settings, 'CACHE_VERSION_CHECK_INTERVAL', DEFAULT_VERSION_CHECK_INTERVAL)
+
+
+def _clock_version():
+    # Versions follow the clock, so a bump rolled back with its transaction
+    # never hands out a number that will be used again
+    return time.time_ns() // 1000
+
+
+def get_version(key):
+    """Return the current version of ``key``"""
+    from rpg_platform.apps.core.models import CacheVersion
+
+    version = cache.get(key)
+    if version is None:
+        versions = CacheVersion.objects.filter(key=key).values_list('version', flat=True)
+        version = versions.first()
+        if version is None:
+            # A new key starts from the clock too, rather than from a number
+            # entries may have been cached under before a rollback
+            CacheVersion.objects.bulk_create(
+                [CacheVersion(key=key, version=_clock_version())], ignore_conflicts=True
+            )
+            version = versions.get()
+        cache.set(key, version, get_version_check_interval())
+    return version
+
+
+def bump_version(key):
+    """Move ``key`` to a new version, invalidating entries keyed on the old one"""
+    from rpg_platform.apps.core.models import CacheVersion
+
+    versions = CacheVersion.objects.filter(key=key)
+    if not versions.update(version=Greatest(F('version') + 1, Value(_clock_version()))):
+        try:
+            with transaction.atomic():
+                CacheVersion.objects.create(key=key, version=_clock_version())
+        except IntegrityError:
+            # Created concurrently by another process
+            versions.update(version=Greatest(F('version') + 1, Value(_clock_version())))
+
+    version = versions.values_list('version', flat=True).get()
+    cache.set(key, version, get_version_check_interval())
+    return version
@@ -0,0 +1,360 @@
+"""
+Channel layer shared by the processes of one host without Redis.
+
+``SQLiteChannelLayer`` keeps messages and group memberships in a SQLite
+database in WAL mode, so every worker process on the host that points at the
+same file sees the same channels and groups. Receivers poll the database,
+backing off while their channels are idle.
+
+Messages sent to process-specific channels (``specific.<client>!<name>``) are
+stored under the non-local part of the name, like ``channels_redis`` does: a
+single poller per event loop pops every message for the process at once and
+hands them to the waiting consumers, so the number of queries does not grow
+with the number of open websockets.
+
+Message bodies are stored as JSON, so messages may only contain JSON
+serializable values (which is all the websocket events of this project
+send).
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    target TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, id);
+CREATE INDEX IF NOT EXISTS channel_messages_target ON channel_messages (target, expires);
+CREATE INDEX IF NOT EXISTS channel_messages_expires ON channel_messages (expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+CREATE INDEX IF NOT EXISTS channel_groups_channel ON channel_groups (channel);
+"""
+
+
+class _LoopReceiver:
+    """
+    Messages popped for process-specific channels, for one event loop
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.waiters = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by a SQLite database shared by the processes of a host
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.001,
+        max_poll_interval=0.05,
+        cleanup_interval=5,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path or Path(settings.BASE_DIR) / 'channels.sqlite3')
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.cleanup_interval = cleanup_interval
+        self.client_prefix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sqlite-channel-layer')
+        self._receivers = {}
+        self._next_cleanup = 0
+
+    # Database access
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    connection.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Run statements in one write transaction"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _send_sync(self, channel, body):
+        now = time.time()
+        capacity = self.get_capacity(channel)
+        with self._write() as connection:
+            self._maybe_clean_expired(connection, now)
+            queued, = connection.execute(
+                'SELECT COUNT(*) FROM channel_messages WHERE target = ? AND expires >= ?',
+                (channel, now)
+            ).fetchone()
+            if queued >= capacity:
+                raise ChannelFull(channel)
+            connection.execute(
+                'INSERT INTO channel_messages (channel, target, body, expires) VALUES (?, ?, ?, ?)',
+                (self.non_local_name(channel), channel, body, now + self.expiry)
+            )
+
+    def _group_send_sync(self, group, body):
+        now = time.time()
+        with self._write() as connection:
+            self._maybe_clean_expired(connection, now)
+            queued = dict(connection.execute(
+                """
+                SELECT g.channel, COUNT(m.id) FROM channel_groups g
+                LEFT JOIN channel_messages m
+                    ON m.target = g.channel AND m.expires >= ?
+                WHERE g.group_name = ? AND g.expires >= ?
+                GROUP BY g.channel
+                """,
+                (now, group, now)
+            ).fetchall())
+
+            # Like the other layers, full channels silently miss the message
+            rows = [
+                (self.non_local_name(channel), channel, body, now + self.expiry)
+                for channel, count in queued.items()
+                if count < self.get_capacity(channel)
+            ]
+            connection.executemany(
+                'INSERT INTO channel_messages (channel, target, body, expires) VALUES (?, ?, ?, ?)',
+                rows
+            )
+        return len(rows)
+
+    def _pop_sync(self, channel, limit=1):
+        """Pop the oldest unexpired messages stored under ``channel``"""
+        now = time.time()
+
+        # Idle receivers only read, so they don't take the write lock
+        waiting = self._connection().execute(
+            'SELECT 1 FROM channel_messages WHERE channel = ? AND expires >= ? LIMIT 1', (channel, now)
+        ).fetchone()
+        if not waiting:
+            return []
+
+        with self._write() as connection:
+            self._maybe_clean_expired(connection, now)
+            rows = connection.execute(
+                """
+                DELETE FROM channel_messages WHERE id IN (
+                    SELECT id FROM channel_messages
+                    WHERE channel = ? AND expires >= ? ORDER BY id LIMIT ?
+                )
+                RETURNING id, target, body, expires
+                """,
+                (channel, now, limit)
+            ).fetchall()
+        return sorted(rows)
+
+    def _maybe_clean_expired(self, connection, now):
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + self.cleanup_interval
+
+        # Any channel with an expired message is removed from all groups
+        connection.execute(
+            """
+            DELETE FROM channel_groups WHERE expires < ? OR channel IN (
+                SELECT target FROM channel_messages WHERE expires < ?
+            )
+            """,
+            (now, now)
+        )
+        connection.execute('DELETE FROM channel_messages WHERE expires < ?', (now,))
+
+    def _group_add_sync(self, group, channel):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?)',
+            (group, channel, time.time() + self.group_expiry)
+        )
+
+    def _group_discard_sync(self, group, channel):
+        self._connection().execute(
+            'DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', (group, channel)
+        )
+
+    def _flush_sync(self):
+        with self._write() as connection:
+            connection.execute('DELETE FROM channel_messages')
+            connection.execute('DELETE FROM channel_groups')
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """
+        Send a message onto a (general or specific) channel.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+
+        await self._run(self._send_sync, channel, json.dumps(message))
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel.
+        """
+        self.require_valid_channel_name(channel)
+
+        if "!" in channel:
+            return await self._receive_specific(channel)
+
+        interval = self.poll_interval
+        while True:
+            rows = await self._run(self._pop_sync, channel)
+            if rows:
+                return json.loads(rows[0][2])
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def new_channel(self, prefix="specific."):
+        """
+        Returns a new channel name that can be used by something in our
+        process as a specific channel.
+        """
+        return "%s.sqlite.%s!%s" % (
+            prefix,
+            self.client_prefix,
+            "".join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    # Process-specific channels
+
+    def _loop_receiver(self):
+        loop = asyncio.get_running_loop()
+        receiver = self._receivers.get(loop)
+        if receiver is None:
+            # Forget receivers of event loops that were closed (one per
+            # async_to_sync call outside of an event loop)
+            for other in [other for other in self._receivers if other.is_closed()]:
+                del self._receivers[other]
+            receiver = self._receivers[loop] = _LoopReceiver()
+        return receiver
+
+    async def _receive_specific(self, channel):
+        receiver = self._loop_receiver()
+        receiver.waiters[channel] = receiver.waiters.get(channel, 0) + 1
+        try:
+            while True:
+                buffer = receiver.buffers.get(channel)
+                while buffer:
+                    expires, message = buffer.pop(0)
+                    if expires >= time.time():
+                        return message
+
+                if receiver.task is None or receiver.task.done():
+                    receiver.task = asyncio.ensure_future(self._poll_specific(receiver))
+                receiver.wakeup.clear()
+                await receiver.wakeup.wait()
+        finally:
+            receiver.waiters[channel] -= 1
+            if not receiver.waiters[channel]:
+                del receiver.waiters[channel]
+                if not receiver.buffers.get(channel):
+                    receiver.buffers.pop(channel, None)
+
+    async def _poll_specific(self, receiver):
+        """Pop the messages of every specific channel waited on in this loop"""
+        interval = self.poll_interval
+        while receiver.waiters:
+            received = False
+            for name in {self.non_local_name(channel) for channel in receiver.waiters}:
+                for _, target, body, expires in await self._run(self._pop_sync, name, 100):
+                    receiver.buffers.setdefault(target, []).append((expires, json.loads(body)))
+                    received = True
+
+            if received:
+                interval = self.poll_interval
+                receiver.wakeup.set()
+                # Give the woken receivers a chance to run
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+
+            # Drop messages of channels nobody receives from any more
+            now = time.time()
+            for channel in [channel for channel in receiver.buffers if channel not in receiver.waiters]:
+                receiver.buffers[channel] = [item for item in receiver.buffers[channel] if item[0] >= now]
+                if not receiver.buffers[channel]:
+                    del receiver.buffers[channel]
+
+    # Flush extension
+
+    async def flush(self):
+        await self._run(self._flush_sync)
+
+    async def close(self):
+        # Connections stay open with their executor threads
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        """
+        Adds the channel name to a group.
+        """
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add_sync, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._run(self._group_discard_sync, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        await self._run(self._group_send_sync, group, json.dumps(message))